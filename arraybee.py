@@ -0,0 +1,1425 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# arraybee.py - an array-backed engine for the VarBee model
+"""
+arraybee.py
+
+An alternative engine for the VarBee model. The bees and mites are held in
+numpy arrays rather than as objects, and each time-step is advanced by two
+kernels that loop over those arrays, one for the mites and one for the bees.
+The kernels follow the same rules as Mite.update and Bee.update in
+varbee.py.
+
+The kernels are plain Python, so they can be run as they are or compiled
+with Numba. The backend is chosen with set_backend() (or per simulation),
+and falls back to plain Python if Numba is not installed. Without Numba the
+mites are updated by a vectorized kernel instead, with masked numpy
+operations on the whole population. Both backends use the same random
+draws, so runs from the same seed give identical results.
+
+BatchSimulation runs many replicates of the same scenario at once. Its
+arrays have a replicate axis, and each replicate has its own random number
+stream, drawn as an ArraySimulation would draw it.
+
+The simulations don't keep their own copy of the environment. They read
+the original environment, which runs on a shared landscape all share, and
+keep the nectar taken from each location in an array of zeros whose memory
+is only used where the bees have foraged. The waiting mites only index the
+locations with bees in them, so the memory a run uses depends on where its
+bees have been rather than the size of the landscape.
+
+Running this file checks that the replicates of a BatchSimulation match
+single runs, that the memory of a run on a shared landscape doesn't grow
+with its size, and that the two backends give the same results:
+
+    python3 arraybee.py [File] [number1] [number2]
+
+    File: A CSV file containing the environment
+    number1: The number of iterations to run
+    number2: The seed for the random number generator
+
+Differences from the object model in varbee.py:
+    - bees are still born if every bee has died
+"""
+import sys
+import copy
+import mmap
+import multiprocessing
+import numpy as np
+
+# The mode codes and moves are shared with the object model
+from varbee import SEARCH, FORAGE, WAIT, TRANSPORT, REPRODUCE, DROP, MOVES
+
+# Numba is only imported when the numba backend is first used, so runs that
+# don't use it start faster
+numba = None
+
+BACKENDS = ("python", "numba")
+
+_backend = "python"
+_kernels = {}
+
+###############################################################################
+#                                                                             #
+#  Kernels                                                                    #
+#                                                                             #
+###############################################################################
+
+def _step_mites(mite_x, mite_y, mite_mode, mite_host, mite_life, mite_alive,
+                n_mites, bee_x, bee_y, bee_life, bee_alive, bee_hive,
+                n_live_bees, other_mites, mite_capacity, drop_chance,
+                hive_x, hive_y, grid_x, grid_y, cell_keys, cell_start,
+                cell_bees, draws):
+    """
+    Update every mite for one time-step, as Mite.update. Mites born during
+    the step are added to the end of the arrays and updated in the same
+    step.
+
+    n_live_bees: The number of living bees in the whole simulation
+    other_mites: The number of mites in the simulation that are not in
+                these arrays (for a simulation split into domains)
+    mite_capacity: The number of mites each living bee can support. The
+                chance of a mite reproducing falls as the mite population
+                nears this many times the bee population.
+    drop_chance: The chance, out of 101, that a mite being transported
+                drops off each time-step
+    grid_x:     The number of valid x positions for a bee
+    grid_y:     The number of valid y positions for a bee
+    cell_keys:  The locations (x * grid_y + y) with living bees in them,
+                sorted
+    cell_start: For each of cell_keys, the start of the bees at that
+                location in cell_bees, and the end of the last one
+    cell_bees:  The indices of the living bees, sorted by location
+    draws:      Five uniform random numbers for each mite, including room
+                for the mites born this step
+
+    returns:    The new number of mites
+    """
+    i = 0
+    while i < n_mites:
+        if mite_mode[i] == WAIT:
+            # Randomly attach to one of the bees in the current location
+            x = mite_x[i]
+            y = mite_y[i]
+            if 0 <= x < grid_x and 0 <= y < grid_y:
+                cell = x * grid_y + y
+                k = np.searchsorted(cell_keys, cell)
+                if k < len(cell_keys) and cell_keys[k] == cell:
+                    count = cell_start[k + 1] - cell_start[k]
+                    mite_host[i] = cell_bees[cell_start[k] +
+                                             int(draws[i, 0] * count)]
+                    mite_mode[i] = TRANSPORT
+            # Mites waiting are dormant and assumed they won't die
+            mite_life[i] += 1
+
+        if mite_mode[i] == TRANSPORT:
+            host = mite_host[i]
+            mite_x[i] = bee_x[host]
+            mite_y[i] = bee_y[host]
+            hive = bee_hive[host]
+            if mite_x[i] == hive_x[hive] and mite_y[i] == hive_y[hive]:
+                mite_mode[i] = REPRODUCE
+                mite_host[i] = -1
+            # Small chance the mite will drop off
+            if draws[i, 1] * 101 < drop_chance:
+                mite_mode[i] = WAIT
+                mite_host[i] = -1
+
+        if mite_mode[i] == REPRODUCE:
+            if (int(draws[i, 2] * (n_live_bees * mite_capacity + 1)) >
+                    n_mites + other_mites):
+                child = n_mites
+                n_mites += 1
+                mite_x[child] = mite_x[i]
+                mite_y[child] = mite_y[i]
+                mite_mode[child] = WAIT
+                mite_host[child] = -1
+                mite_life[child] = 100
+                mite_alive[child] = True
+            if int(draws[i, 3] * 101) > 95:
+                mite_mode[i] = WAIT
+
+        if mite_mode[i] == DROP:
+            mite_host[i] = -1
+            mite_mode[i] = WAIT
+
+        mite_life[i] -= 1
+        host = mite_host[i]
+        if host >= 0:
+            bee_life[host] -= 1
+            if not bee_alive[host]:
+                mite_alive[i] = False
+        if int(draws[i, 4] * 46) > mite_life[i]:
+            mite_alive[i] = False
+        i += 1
+    return n_mites
+
+def _step_mites_vectorized(mite_x, mite_y, mite_mode, mite_host, mite_life,
+                           mite_alive, n_mites, bee_x, bee_y, bee_life,
+                           bee_alive, bee_hive, n_live_bees, other_mites,
+                           mite_capacity, drop_chance, hive_x, hive_y,
+                           grid_x, grid_y, cell_keys, cell_start, cell_bees,
+                           draws):
+    """
+    Update every mite for one time-step with masked numpy operations on
+    the whole population, giving the same results as _step_mites. The
+    arguments and return value are the same.
+
+    A mite's update only depends on its own arrays and the bees, apart from
+    the chance of reproducing, which depends on the mites born before it.
+    So the mites are updated together, a generation at a time: first the
+    mites at the start of the step, then the mites they gave birth to, and
+    so on. Only the births are decided one mite at a time.
+    """
+    start = 0
+    while start < n_mites:
+        end = n_mites
+        x = mite_x[start:end]
+        y = mite_y[start:end]
+        mode = mite_mode[start:end]
+        host = mite_host[start:end]
+        life = mite_life[start:end]
+        alive = mite_alive[start:end]
+        mite_draws = draws[start:end]
+
+        # Waiting mites randomly attach to one of the bees in their location
+        waiting = mode == WAIT
+        inside = waiting & (x >= 0) & (x < grid_x) & (y >= 0) & (y < grid_y)
+        cell = np.where(inside, x * grid_y + y, -1)
+        k = np.searchsorted(cell_keys, cell)
+        found = np.append(cell_keys, -1)[k] == cell
+        attach = np.flatnonzero(inside & found)
+        k = k[attach]
+        host[attach] = cell_bees[cell_start[k] +
+                                 (mite_draws[attach, 0] *
+                                  (cell_start[k + 1] - cell_start[k])
+                                  ).astype(np.int64)]
+        mode[attach] = TRANSPORT
+        # Mites waiting are dormant and assumed they won't die
+        life[waiting] += 1
+
+        # Transported mites move with their host, and reproduce when it
+        # reaches its hive
+        riding = np.flatnonzero(mode == TRANSPORT)
+        hosts = host[riding]
+        x[riding] = bee_x[hosts]
+        y[riding] = bee_y[hosts]
+        hives = bee_hive[hosts]
+        home = riding[(x[riding] == hive_x[hives]) &
+                      (y[riding] == hive_y[hives])]
+        mode[home] = REPRODUCE
+        host[home] = -1
+        # Small chance the mite will drop off
+        dropped = riding[mite_draws[riding, 1] * 101 < drop_chance]
+        mode[dropped] = WAIT
+        host[dropped] = -1
+
+        # Reproducing mites give birth while the population is below the
+        # number drawn, which rises by one with each birth
+        reproducing = np.flatnonzero(mode == REPRODUCE)
+        limits = (mite_draws[reproducing, 2] *
+                  (n_live_bees * mite_capacity + 1)).astype(np.int64)
+        parents = []
+        population = n_mites + other_mites
+        for parent, limit in zip(reproducing.tolist(), limits.tolist()):
+            if limit > population:
+                parents.append(parent)
+                population += 1
+        if parents:
+            children = slice(n_mites, n_mites + len(parents))
+            mite_x[children] = x[parents]
+            mite_y[children] = y[parents]
+            mite_mode[children] = WAIT
+            mite_host[children] = -1
+            mite_life[children] = 100
+            mite_alive[children] = True
+            n_mites += len(parents)
+        leaving = reproducing[(mite_draws[reproducing, 3] * 101
+                               ).astype(np.int64) > 95]
+        mode[leaving] = WAIT
+
+        dropping = mode == DROP
+        host[dropping] = -1
+        mode[dropping] = WAIT
+
+        # Mites shorten the lives of their hosts, and die with them
+        life -= 1
+        riding = np.flatnonzero(host >= 0)
+        np.subtract.at(bee_life, host[riding], 1)
+        alive[riding[~bee_alive[host[riding]]]] = False
+        alive[(mite_draws[:, 4] * 46).astype(np.int64) > life] = False
+        start = end
+    return n_mites
+
+def _step_bees(bee_x, bee_y, bee_mode, bee_tx, bee_ty, bee_store, bee_life,
+               bee_virus, bee_alive, bee_hive, bee_last_x, bee_last_y,
+               bee_last_amount, n_bees, original, depletion, hive_x, hive_y,
+               hive_store, known_x, known_y, known_amount, known_count,
+               known_slot, heat, draws):
+    """
+    Update every living bee for one time-step, as Bee.update, and add the
+    bees to the heatmap.
+
+    original:   The nectar each location started with, which isn't changed
+    depletion:  The nectar taken from each location, so the nectar left is
+                original - depletion
+
+    known_x, known_y, known_amount: The flower locations known to each
+                hive and their last known nectar, in the order they were
+                first found
+    known_count: The number of known flower locations for each hive
+    known_slot: One more than the index of each location in the known
+                arrays, or 0 if it isn't known
+    heat:       The heatmap of bee visits
+    draws:      Two uniform random numbers for each bee
+    """
+    grid_x = original.shape[0]
+    grid_y = original.shape[1]
+    valid_moves = np.empty(8, np.int64)
+    shortest_moves = np.empty(16, np.int64)
+    for i in range(n_bees):
+        if not bee_alive[i]:
+            continue
+        h = bee_hive[i]
+        x = bee_x[i]
+        y = bee_y[i]
+
+        if bee_mode[i] == FORAGE and x == bee_tx[i] and y == bee_ty[i]:
+            # If the bee is at the hive
+            if x == hive_x[h] and y == hive_y[h]:
+                # add the nectar to the hive store
+                hive_store[h] += bee_store[i]
+                bee_store[i] = 0
+                # add/change the last known nectar amount to the flower list
+                slot = known_slot[h, bee_last_x[i], bee_last_y[i]] - 1
+                if slot < 0:
+                    slot = known_count[h]
+                    known_count[h] += 1
+                    known_slot[h, bee_last_x[i], bee_last_y[i]] = slot + 1
+                    known_x[h, slot] = bee_last_x[i]
+                    known_y[h, slot] = bee_last_y[i]
+                known_amount[h, slot] = bee_last_amount[i]
+                # change the target to the flower currently known to have
+                # the most nectar
+                best = 0
+                for slot in range(1, known_count[h]):
+                    if known_amount[h, slot] > known_amount[h, best]:
+                        best = slot
+                bee_tx[i] = known_x[h, best]
+                bee_ty[i] = known_y[h, best]
+
+            # If the bee isn't at the hive (and therefore the target flower)
+            else:
+                nectar = original[y, x] - depletion[y, x]
+                if nectar == 0:
+                    bee_mode[i] = SEARCH
+                # take remaining nectar from the flower (if available)
+                if 0 < nectar < 10:
+                    bee_store[i] += nectar
+                    depletion[y, x] += nectar
+                    nectar = 0
+                    bee_tx[i] = hive_x[h]
+                    bee_ty[i] = hive_y[h]
+                    bee_last_amount[i] = nectar
+                    bee_last_x[i] = x
+                    bee_last_y[i] = y
+                # take 10 nectar from the flower (if available)
+                if nectar > 9:
+                    bee_store[i] += 10
+                    depletion[y, x] += 10
+                    nectar -= 10
+                    bee_tx[i] = hive_x[h]
+                    bee_ty[i] = hive_y[h]
+                    bee_last_amount[i] = nectar
+                    bee_last_x[i] = x
+                    bee_last_y[i] = y
+
+        if bee_mode[i] == SEARCH:
+            # Random move to any location inside the environment
+            n_valid = 0
+            for m in range(8):
+                new_x = x + MOVES[m, 0]
+                new_y = y + MOVES[m, 1]
+                if 0 <= new_x < grid_x and 0 <= new_y < grid_y:
+                    valid_moves[n_valid] = m
+                    n_valid += 1
+            move = valid_moves[int(draws[i, 0] * n_valid)]
+        else:
+            # Shortest move towards the target, built up in the same way
+            # as Bee.targeted_move so ties are broken the same way
+            n_shortest = 0
+            current_shortest = -1
+            for m in range(8):
+                dx = x + MOVES[m, 0] - bee_tx[i]
+                dy = y + MOVES[m, 1] - bee_ty[i]
+                distance = dx * dx + dy * dy
+                if current_shortest == -1:
+                    current_shortest = distance
+                    shortest_moves[0] = m
+                    n_shortest = 1
+                if distance < current_shortest:
+                    shortest_moves[0] = m
+                    n_shortest = 1
+                    current_shortest = distance
+                if distance == current_shortest:
+                    shortest_moves[n_shortest] = m
+                    n_shortest += 1
+            move = shortest_moves[int(draws[i, 0] * n_shortest)]
+        x += MOVES[move, 0]
+        y += MOVES[move, 1]
+        bee_x[i] = x
+        bee_y[i] = y
+
+        if bee_mode[i] == SEARCH and original[x, y] - depletion[x, y] > 0:
+            bee_tx[i] = x
+            bee_ty[i] = y
+            bee_mode[i] = FORAGE
+
+        # Reduce the lifespan, reducing by more if infected with virus
+        if bee_virus[i]:
+            bee_life[i] -= 3
+        bee_life[i] -= 1
+        if bee_life[i] < int(draws[i, 1] * 46):
+            bee_alive[i] = False
+
+        heat[x, y] += 1
+
+def _step_batch_mites(step_mites, mite_x, mite_y, mite_mode, mite_host,
+                      mite_life, mite_alive, n_mites, bee_x, bee_y, bee_life,
+                      bee_alive, bee_hive, n_live_bees, mite_capacity,
+                      drop_chance, hive_x, hive_y, grid_x, grid_y, cell_keys,
+                      cell_start, cell_bounds, cell_bees, draws):
+    """
+    Update the mites of every replicate for one time-step. The arrays have
+    a replicate on each row, and each row is passed to step_mites.
+
+    cell_keys:  The locations (x * grid_y + y) with living bees in them,
+                sorted by replicate and location
+    cell_start: For each of cell_keys, the start of the bees at that
+                location in cell_bees, and the end of the last one
+    cell_bounds: The start of each replicate's locations in cell_keys, and
+                the end of the last one
+    cell_bees:  The indices of the living bees within their replicate,
+                sorted by replicate and location
+
+    n_mites is updated with the new number of mites in each replicate.
+    """
+    for r in range(mite_x.shape[0]):
+        if n_mites[r] == 0:
+            continue
+        start = cell_bounds[r]
+        end = cell_bounds[r + 1]
+        n_mites[r] = step_mites(mite_x[r], mite_y[r], mite_mode[r],
+                                mite_host[r], mite_life[r], mite_alive[r],
+                                n_mites[r], bee_x[r], bee_y[r], bee_life[r],
+                                bee_alive[r], bee_hive[r], n_live_bees[r],
+                                0, mite_capacity, drop_chance, hive_x,
+                                hive_y, grid_x, grid_y, cell_keys[start:end],
+                                cell_start[start:end + 1], cell_bees,
+                                draws[r])
+
+def _step_batch_bees(step_bees, bee_x, bee_y, bee_mode, bee_tx, bee_ty,
+                     bee_store, bee_life, bee_virus, bee_alive, bee_hive,
+                     bee_last_x, bee_last_y, bee_last_amount, n_bees,
+                     original, depletion, hive_x, hive_y, hive_store,
+                     known_x, known_y, known_amount, known_count, known_slot,
+                     heat, draws):
+    """
+    Update the bees of every replicate for one time-step. The arrays have
+    a replicate on each row (or first axis), and each is passed to
+    step_bees. The replicates share the original environment.
+    """
+    for r in range(bee_x.shape[0]):
+        if n_bees[r] == 0:
+            continue
+        step_bees(bee_x[r], bee_y[r], bee_mode[r], bee_tx[r], bee_ty[r],
+                  bee_store[r], bee_life[r], bee_virus[r], bee_alive[r],
+                  bee_hive[r], bee_last_x[r], bee_last_y[r],
+                  bee_last_amount[r], n_bees[r], original, depletion[r],
+                  hive_x, hive_y, hive_store[r], known_x[r], known_y[r],
+                  known_amount[r], known_count[r], known_slot[r], heat[r],
+                  draws[r])
+
+def set_backend(name):
+    """
+    Set the backend used by simulations that don't choose their own
+
+    name:       "python" or "numba"
+
+    returns:    The backend in use, which is "python" if Numba was asked
+                for but is not installed
+    """
+    global _backend
+    _backend = _check_backend(name)
+    return _backend
+
+def get_backend():
+    """ Get the default backend """
+    return _backend
+
+def _import_numba():
+    """
+    Import Numba the first time it is needed
+
+    returns:    The numba module, or None if it is not installed
+    """
+    global numba
+    if numba is None:
+        try:
+            import numba as numba_module
+        except ImportError:
+            return None
+        numba = numba_module
+    return numba
+
+def _check_backend(name):
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %s, use one of %s" % (name, BACKENDS))
+    if name == "numba" and _import_numba() is None:
+        print("Numba is not installed, using the python backend")
+        return "python"
+    return name
+
+def _get_kernels(name):
+    """
+    Get the kernels for a backend, compiling them the first time Numba is
+    used. The python backend updates the mites with _step_mites_vectorized
+    rather than the loop in _step_mites.
+    """
+    if name not in _kernels:
+        if name == "numba":
+            kernels = tuple(numba.njit(cache=True)(kernel)
+                            for kernel in (_step_mites, _step_bees,
+                                           _step_batch_mites,
+                                           _step_batch_bees))
+        else:
+            # Without Numba, the mites are faster updated with numpy
+            kernels = (_step_mites_vectorized, _step_bees, _step_batch_mites,
+                       _step_batch_bees)
+        _kernels[name] = kernels
+    return _kernels[name]
+
+def _lazy_zeros(shape):
+    """
+    An array of zeros the size of the environment (or larger) whose memory
+    is only used, a page at a time, where it is written. numpy may back a
+    large array from np.zeros with huge pages of 2MB, so that a few writes
+    spread over the environment use memory in proportion to its size.
+
+    shape:      The shape of the array
+
+    returns:    An int64 array of zeros
+    """
+    size = int(np.prod(shape))
+    memory = mmap.mmap(-1, max(size * 8, 1))
+    if hasattr(mmap, "MADV_NOHUGEPAGE"):
+        memory.madvise(mmap.MADV_NOHUGEPAGE)
+    return np.frombuffer(memory, dtype=np.int64, count=size).reshape(shape)
+
+def _index_cells(cells):
+    """
+    Index the living bees by location for the waiting mites. Only the
+    locations with bees in them are indexed, so the index doesn't grow with
+    the environment.
+
+    cells:      The location of each living bee
+
+    returns:    The order that sorts the bees by location, the sorted
+                locations with bees in them, and the start of each
+                location's bees in the sorted bees, with the end of the last
+    """
+    order = np.argsort(cells, kind='stable')
+    keys, starts = np.unique(cells[order], return_index=True)
+    return order, keys, np.append(starts, len(cells)).astype(np.int64)
+
+def _regrow(depletion, replenishment, depleted, foraged):
+    """
+    Grow back the locations with less nectar than they started with, as
+    Environment.update, visiting only the locations that can have less
+
+    depletion:  The nectar taken from each location, flattened
+    replenishment: The nectar each location grows back each time-step,
+                flattened. depletion may hold several replicates of it.
+    depleted:   The flat indices of the locations that had less nectar at
+                the end of the last time-step
+    foraged:    The flat indices of the locations foraged this time-step
+
+    returns:    The flat indices of the locations that still have less
+                nectar than they started with
+    """
+    cells = np.unique(np.concatenate((depleted, foraged)))
+    growing = cells[depletion[cells] > 0]
+    depletion[growing] -= replenishment[growing % len(replenishment)]
+    return growing[depletion[growing] > 0]
+
+###############################################################################
+#                                                                             #
+#  Simulation                                                                 #
+#                                                                             #
+###############################################################################
+
+class ArraySimulation:
+    """
+    A simulation of the VarBee model with the bees and mites held in numpy
+    arrays. It can be used in place of varbee.Simulation.
+
+    A bee that dies is kept in the arrays, marked as dead, for one more
+    time-step so that mites riding it can see it has died.
+
+    branch() copies a simulation part way through a run, so that many runs
+    can go on from the same state with their own random numbers and
+    parameters.
+    """
+    # The parameters that can be changed when branching
+    branch_parameters = ("bee_lifespan", "mite_capacity", "drop_chance",
+                         "births_per_step")
+
+    def __init__(self, environment, num_bees=40, num_mites=40,
+                 hive_locations=[(25, 25)], num_iterations=100, seed=None,
+                 backend=None, births_per_step=1, landscape=None,
+                 bee_lifespan=100, mite_capacity=4, drop_chance=2,
+                 rasters=None):
+        """
+        Initialise the simulation, creating the hives, bees and mites
+
+        environment:    A list of lists containing the nectar in each
+                        location
+        num_bees:       The number of bees to start with
+        num_mites:      The number of mites to start with
+        hive_locations: A list of tuples containing the hive coordinates
+        num_iterations: The number of iterations the model will run for
+        seed:           The seed for the random number generator
+        backend:        "python" or "numba". If None the default from
+                        set_backend() is used
+        births_per_step: The number of bees born in each hive each
+                        time-step
+        landscape:      A landscape.SharedLandscape to read the original
+                        environment and replenishment from, rather than
+                        keeping copies of them
+        bee_lifespan:   The lifespan of a new bee
+        mite_capacity:  The number of mites each living bee can support
+        drop_chance:    The chance, out of 101, that a mite being
+                        transported drops off each time-step
+        rasters:        A rasters.Rasters to add the visits, carrier visits,
+                        waiting mites and nectar removed to, or None
+        """
+        self.backend = _check_backend(backend if backend else _backend)
+        self.rng = np.random.default_rng(seed)
+        if landscape is None:
+            self.original_environment = np.array(environment, dtype=np.int64)
+            self.replenishment = self.original_environment**2 // 2000
+        else:
+            self.original_environment = landscape.original
+            self.replenishment = landscape.replenishment
+        # The nectar taken from each location, rather than a copy of the
+        # environment. Locations the bees never forage are never written,
+        # so they take no memory.
+        self.depletion = _lazy_zeros(self.original_environment.shape)
+        self.depleted = np.zeros(0, dtype=np.int64)
+        self.num_iterations = num_iterations
+        self.births_per_step = births_per_step
+        self.bee_lifespan = bee_lifespan
+        self.mite_capacity = float(mite_capacity)
+        self.drop_chance = float(drop_chance)
+        self.bee_pop = []
+        self.mite_pop = []
+        self.timestep = 0
+        self.rasters = rasters
+        grid_x, grid_y = self.original_environment.shape
+        self.heat = _lazy_zeros((grid_x, grid_y))
+
+        # Hives
+        n_hives = len(hive_locations)
+        self.hive_x = np.array([loc[0] for loc in hive_locations],
+                               dtype=np.int64)
+        self.hive_y = np.array([loc[1] for loc in hive_locations],
+                               dtype=np.int64)
+        self.hive_store = np.zeros(n_hives, dtype=np.int64)
+        self.known_x = _lazy_zeros((n_hives, grid_x * grid_y))
+        self.known_y = _lazy_zeros((n_hives, grid_x * grid_y))
+        self.known_amount = _lazy_zeros((n_hives, grid_x * grid_y))
+        self.known_count = np.zeros(n_hives, dtype=np.int64)
+        self.known_slot = _lazy_zeros((n_hives, grid_x, grid_y))
+
+        # Bees
+        self.n_bees = 0
+        self.bee_x = np.zeros(0, dtype=np.int64)
+        self.bee_y = np.zeros(0, dtype=np.int64)
+        self.bee_mode = np.zeros(0, dtype=np.int64)
+        self.bee_tx = np.zeros(0, dtype=np.int64)
+        self.bee_ty = np.zeros(0, dtype=np.int64)
+        self.bee_store = np.zeros(0, dtype=np.int64)
+        self.bee_life = np.zeros(0, dtype=np.int64)
+        self.bee_virus = np.zeros(0, dtype=np.bool_)
+        self.bee_alive = np.zeros(0, dtype=np.bool_)
+        self.bee_hive = np.zeros(0, dtype=np.int64)
+        self.bee_last_x = np.zeros(0, dtype=np.int64)
+        self.bee_last_y = np.zeros(0, dtype=np.int64)
+        self.bee_last_amount = np.zeros(0, dtype=np.int64)
+        for j in range(num_bees):
+            self.add_bee(0)
+
+        # Mites, in random locations
+        self.n_mites = 0
+        self.mite_x = np.zeros(0, dtype=np.int64)
+        self.mite_y = np.zeros(0, dtype=np.int64)
+        self.mite_mode = np.zeros(0, dtype=np.int64)
+        self.mite_host = np.zeros(0, dtype=np.int64)
+        self.mite_life = np.zeros(0, dtype=np.int64)
+        self.mite_alive = np.zeros(0, dtype=np.bool_)
+        self.add_mites(num_mites)
+
+    _bee_arrays = ("bee_x", "bee_y", "bee_mode", "bee_tx", "bee_ty",
+                   "bee_store", "bee_life", "bee_virus", "bee_alive",
+                   "bee_hive", "bee_last_x", "bee_last_y", "bee_last_amount")
+    _mite_arrays = ("mite_x", "mite_y", "mite_mode", "mite_host",
+                    "mite_life", "mite_alive")
+
+    def _grow(self, names, size):
+        """
+        Make sure the named arrays can hold at least size agents, doubling
+        their capacity when they need to grow
+        """
+        capacity = len(getattr(self, names[0]))
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        for name in names:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _grow_mites(self, size):
+        self._grow(self._mite_arrays, size)
+
+    def _mite_limit(self, n_live_bees):
+        """
+        The mite population can't grow past mite_capacity times the bee
+        population, which bounds the births in one step
+        """
+        return int(n_live_bees * self.mite_capacity) + 1
+
+    def add_bee(self, hive):
+        """
+        Add a new bee at a hive, as a Bee created with the default values
+
+        hive:   The index of the hive
+        """
+        self._grow(self._bee_arrays, self.n_bees + 1)
+        i = self.n_bees
+        self.bee_x[i] = self.hive_x[hive]
+        self.bee_y[i] = self.hive_y[hive]
+        self.bee_mode[i] = SEARCH
+        self.bee_tx[i] = -1
+        self.bee_ty[i] = -1
+        self.bee_store[i] = 0
+        self.bee_life[i] = self.bee_lifespan
+        self.bee_virus[i] = False
+        self.bee_alive[i] = True
+        self.bee_hive[i] = hive
+        self.bee_last_x[i] = self.hive_x[hive]
+        self.bee_last_y[i] = self.hive_y[hive]
+        self.bee_last_amount[i] = 0
+        self.n_bees += 1
+
+    def add_mites(self, num_mites):
+        """
+        Add mites waiting in random locations, as at the start of a run
+
+        num_mites:  The number of mites to add
+        """
+        grid_x, grid_y = self.original_environment.shape
+        start = self.n_mites
+        end = start + num_mites
+        self._grow_mites(end)
+        self.mite_x[start:end] = self.rng.integers(0, grid_y + 1,
+                                                   size=num_mites)
+        self.mite_y[start:end] = self.rng.integers(0, grid_x + 1,
+                                                   size=num_mites)
+        self.mite_mode[start:end] = WAIT
+        self.mite_host[start:end] = -1
+        self.mite_life[start:end] = 100
+        self.mite_alive[start:end] = True
+        self.n_mites = end
+
+    def branch(self, seed=None, **parameters):
+        """
+        Copy the simulation in its current state, to run on from here
+        independently of it
+
+        seed:       The seed for the random number generator of the copy
+        parameters: New values of any of branch_parameters for the copy
+
+        returns:    The copy, which shares only the original environment
+                    and replenishment with this simulation
+        """
+        for name in parameters:
+            if name not in self.branch_parameters:
+                raise ValueError("%s can't be changed when branching, only "
+                                 "%s" % (name,
+                                         ", ".join(self.branch_parameters)))
+        child = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray) and \
+                    name not in ("original_environment", "replenishment"):
+                setattr(child, name, value.copy())
+        child.bee_pop = list(self.bee_pop)
+        child.mite_pop = list(self.mite_pop)
+        child.rasters = copy.deepcopy(self.rasters)
+        child.rng = np.random.default_rng(seed)
+        for name, value in parameters.items():
+            setattr(child, name, type(getattr(self, name))(value))
+        return child
+
+    def update(self):
+        """
+        Run one time-step of the model and log the bee and mite populations
+        """
+        step_mites, step_bees = _get_kernels(self.backend)[:2]
+        grid_x, grid_y = self.original_environment.shape
+        n_bees = self.n_bees
+        live = self.bee_alive[:n_bees]
+        n_live_bees = int(np.count_nonzero(live))
+        dead_before_step = ~live
+
+        # Index the living bees by location for the waiting mites
+        live_bees = np.flatnonzero(live)
+        cells = self.bee_x[live_bees] * grid_y + self.bee_y[live_bees]
+        order, cell_keys, cell_start = _index_cells(cells)
+        cell_bees = live_bees[order]
+        # The bees forage where they are before they move
+        foraged = self.bee_y[live_bees] * grid_y + self.bee_x[live_bees]
+
+        # Process mites
+        if self.n_mites:
+            max_mites = max(self.n_mites, self._mite_limit(n_live_bees)) + \
+                self.n_mites
+            self._grow_mites(max_mites)
+            draws = self.rng.random((max_mites, 5))
+            self.n_mites = step_mites(self.mite_x, self.mite_y,
+                                      self.mite_mode, self.mite_host,
+                                      self.mite_life, self.mite_alive,
+                                      self.n_mites, self.bee_x, self.bee_y,
+                                      self.bee_life, self.bee_alive,
+                                      self.bee_hive, n_live_bees, 0,
+                                      self.mite_capacity, self.drop_chance,
+                                      self.hive_x, self.hive_y, grid_x,
+                                      grid_y, cell_keys, cell_start,
+                                      cell_bees, draws)
+
+        if self.rasters is not None:
+            carried = self._add_mite_rasters(n_bees)
+            before = (self.bee_x[live_bees], self.bee_y[live_bees],
+                      self.bee_store[live_bees])
+
+        # Move Bees
+        if n_bees:
+            draws = self.rng.random((n_bees, 2))
+            step_bees(self.bee_x, self.bee_y, self.bee_mode, self.bee_tx,
+                      self.bee_ty, self.bee_store, self.bee_life,
+                      self.bee_virus, self.bee_alive, self.bee_hive,
+                      self.bee_last_x, self.bee_last_y, self.bee_last_amount,
+                      n_bees, self.original_environment, self.depletion,
+                      self.hive_x, self.hive_y, self.hive_store,
+                      self.known_x, self.known_y, self.known_amount,
+                      self.known_count, self.known_slot, self.heat, draws)
+
+        if self.rasters is not None:
+            self._add_bee_rasters(live_bees, carried, *before)
+
+        # Hive actions (make more bees)
+        for hive in range(len(self.hive_x)):
+            for i in range(self.births_per_step):
+                self.add_bee(hive)
+
+        # Clean up dead insects. Bees that died this step are kept until
+        # the next one.
+        keep = np.ones(self.n_bees, dtype=np.bool_)
+        keep[:n_bees] = ~dead_before_step
+        self._compact_bees(keep)
+        keep = self.mite_alive[:self.n_mites].copy()
+        for name in self._mite_arrays:
+            array = getattr(self, name)
+            kept = array[:self.n_mites][keep]
+            array[:len(kept)] = kept
+        self.n_mites = int(np.count_nonzero(keep))
+
+        # Update the environment
+        self.depleted = _regrow(self.depletion.reshape(-1),
+                                self.replenishment.reshape(-1),
+                                self.depleted, foraged)
+
+        # Log the bee and mite populations
+        self.bee_pop.append(int(np.count_nonzero(
+            self.bee_alive[:self.n_bees])))
+        self.mite_pop.append(self.n_mites)
+        self.timestep += 1
+        if self.rasters is not None:
+            self.rasters.end_step()
+
+    def _add_mite_rasters(self, n_bees):
+        """
+        Add the waiting mites to the rasters
+
+        n_bees:     The number of bees in the arrays
+
+        returns:    A mask of the bees carrying mites
+        """
+        grid_x, grid_y = self.original_environment.shape
+        n_mites = self.n_mites
+        alive = self.mite_alive[:n_mites]
+        hosts = self.mite_host[:n_mites]
+        carried = np.zeros(n_bees, dtype=np.bool_)
+        carried[hosts[alive & (hosts >= 0)]] = True
+        x = self.mite_x[:n_mites]
+        y = self.mite_y[:n_mites]
+        # Mites can start just outside the environment
+        waiting = alive & (hosts < 0) & (self.mite_mode[:n_mites] == WAIT) & \
+            (x < grid_x) & (y < grid_y)
+        self.rasters.add("waiting_mites", x[waiting], y[waiting])
+        return carried
+
+    def _add_bee_rasters(self, moved, carried, x, y, store):
+        """
+        Add the visits, carrier visits and nectar removed to the rasters
+
+        moved:      The indices of the bees moved this time-step
+        carried:    A mask of the bees carrying mites
+        x, y, store: The positions and nectar stores of the moved bees
+                    before they moved. Any nectar gained was taken there.
+        """
+        bee_x = self.bee_x[moved]
+        bee_y = self.bee_y[moved]
+        self.rasters.add("visits", bee_x, bee_y)
+        carriers = carried[moved]
+        self.rasters.add("carrier_visits", bee_x[carriers], bee_y[carriers])
+        gained = self.bee_store[moved] - store
+        foraging = gained > 0
+        self.rasters.add("nectar_removed", x[foraging], y[foraging],
+                         gained[foraging])
+
+    def _compact_bees(self, keep):
+        """
+        Remove the bees not kept from the arrays and renumber the mites'
+        hosts to match
+        """
+        new_index = np.cumsum(keep) - 1
+        for name in self._bee_arrays:
+            array = getattr(self, name)
+            kept = array[:self.n_bees][keep]
+            array[:len(kept)] = kept
+        hosts = self.mite_host[:self.n_mites]
+        riding = hosts >= 0
+        hosts[riding] = new_index[hosts[riding]]
+        self.n_bees = int(np.count_nonzero(keep))
+
+    def population(self):
+        """
+        returns: A tuple of the number of living bees and mites
+        """
+        return (int(np.count_nonzero(self.bee_alive[:self.n_bees])),
+                self.n_mites)
+
+    def metrics(self):
+        """
+        returns: A dict of the number of bees foraging and searching, and
+                 the nectar stored in all the hives
+        """
+        live = self.bee_alive[:self.n_bees]
+        foraging = int(np.count_nonzero(live &
+                                        (self.bee_mode[:self.n_bees] ==
+                                         FORAGE)))
+        return {"foraging": foraging,
+                "searching": int(np.count_nonzero(live)) - foraging,
+                "hive_store": int(self.hive_store.sum())}
+
+    def snapshot(self):
+        """
+        The state of the simulation, for viewing while it runs. Mites being
+        carried are shown where their host is.
+
+        returns: Arrays of the bee and mite positions, one row each, and
+                 the environment
+        """
+        live = self.bee_alive[:self.n_bees]
+        bees = np.column_stack((self.bee_x[:self.n_bees][live],
+                                self.bee_y[:self.n_bees][live]))
+        mites = np.column_stack((self.mite_x[:self.n_mites],
+                                 self.mite_y[:self.n_mites]))
+        hosts = self.mite_host[:self.n_mites]
+        carried = hosts >= 0
+        mites[carried, 0] = self.bee_x[hosts[carried]]
+        mites[carried, 1] = self.bee_y[hosts[carried]]
+        return bees, mites, self.environment
+
+    @property
+    def environment(self):
+        """
+        The nectar left in each location, as a new array
+        """
+        return self.original_environment - self.depletion
+
+    def heatmap(self):
+        """
+        Create a heatmap of the total number of bees in each position
+
+        returns: A list of lists of the bee counts
+        """
+        return self.heat.tolist()
+
+class BatchSimulation:
+    """
+    Many replicates of the same scenario advanced together. The arrays of
+    ArraySimulation gain a replicate axis, so one update() steps every
+    replicate, and each replicate has its own numpy Generator.
+
+    Each replicate draws its random numbers in the same way as an
+    ArraySimulation, so replicate r gives the same results as an
+    ArraySimulation with seed seeds[r].
+    """
+    def __init__(self, environment, num_replicates, num_bees=40,
+                 num_mites=40, hive_locations=[(25, 25)], num_iterations=100,
+                 seed=None, backend=None, births_per_step=1, landscape=None,
+                 bee_lifespan=100, mite_capacity=4, drop_chance=2):
+        """
+        Initialise the replicates, creating the hives, bees and mites
+
+        environment:    A list of lists containing the nectar in each
+                        location
+        num_replicates: The number of replicates to run
+        num_bees:       The number of bees to start with
+        num_mites:      The number of mites to start with
+        hive_locations: A list of tuples containing the hive coordinates
+        num_iterations: The number of iterations the model will run for
+        seed:           The seed the replicate seeds are spawned from
+        backend:        "python" or "numba". If None the default from
+                        set_backend() is used
+        births_per_step: The number of bees born in each hive each
+                        time-step
+        landscape:      A landscape.SharedLandscape to read the original
+                        environment and replenishment from
+        bee_lifespan, mite_capacity, drop_chance: As ArraySimulation
+        """
+        self.backend = _check_backend(backend if backend else _backend)
+        self.num_replicates = num_replicates
+        self.seeds = replicate_seeds(seed, num_replicates)
+        self.rngs = [np.random.default_rng(s) for s in self.seeds]
+        if landscape is None:
+            self.original_environment = np.array(environment, dtype=np.int64)
+            self.replenishment = self.original_environment**2 // 2000
+        else:
+            self.original_environment = landscape.original
+            self.replenishment = landscape.replenishment
+        # The nectar taken from each location of each replicate, as
+        # ArraySimulation
+        self.depletion = _lazy_zeros((num_replicates,) +
+                                     self.original_environment.shape)
+        self.depleted = np.zeros(0, dtype=np.int64)
+        self.num_iterations = num_iterations
+        self.births_per_step = births_per_step
+        self.bee_lifespan = bee_lifespan
+        self.mite_capacity = float(mite_capacity)
+        self.drop_chance = float(drop_chance)
+        # The populations of every replicate at each time-step
+        self.bee_pop = []
+        self.mite_pop = []
+        self.timestep = 0
+        grid_x, grid_y = self.original_environment.shape
+        self.heat = _lazy_zeros((num_replicates, grid_x, grid_y))
+
+        # Hives
+        n_hives = len(hive_locations)
+        shape = (num_replicates, n_hives)
+        self.hive_x = np.array([loc[0] for loc in hive_locations],
+                               dtype=np.int64)
+        self.hive_y = np.array([loc[1] for loc in hive_locations],
+                               dtype=np.int64)
+        self.hive_store = np.zeros(shape, dtype=np.int64)
+        self.known_x = _lazy_zeros(shape + (grid_x * grid_y,))
+        self.known_y = _lazy_zeros(shape + (grid_x * grid_y,))
+        self.known_amount = _lazy_zeros(shape + (grid_x * grid_y,))
+        self.known_count = np.zeros(shape, dtype=np.int64)
+        self.known_slot = _lazy_zeros(shape + (grid_x, grid_y))
+
+        # Bees
+        self.n_bees = np.zeros(num_replicates, dtype=np.int64)
+        for name in ArraySimulation._bee_arrays:
+            dtype = np.bool_ if name in ("bee_virus", "bee_alive") \
+                else np.int64
+            setattr(self, name, np.zeros((num_replicates, 0), dtype=dtype))
+        for j in range(num_bees):
+            self.add_bees(0)
+
+        # Mites, in random locations
+        self.n_mites = np.full(num_replicates, num_mites, dtype=np.int64)
+        for name in ArraySimulation._mite_arrays:
+            dtype = np.bool_ if name == "mite_alive" else np.int64
+            setattr(self, name, np.zeros((num_replicates, 0), dtype=dtype))
+        self._grow_mites(num_mites)
+        for r, rng in enumerate(self.rngs):
+            self.mite_x[r, :num_mites] = rng.integers(0, grid_y + 1,
+                                                      size=num_mites)
+            self.mite_y[r, :num_mites] = rng.integers(0, grid_x + 1,
+                                                      size=num_mites)
+        self.mite_mode[:, :num_mites] = WAIT
+        self.mite_host[:, :num_mites] = -1
+        self.mite_life[:, :num_mites] = 100
+        self.mite_alive[:, :num_mites] = True
+
+    def _grow(self, names, size):
+        """
+        Make sure the named arrays can hold at least size agents in every
+        replicate, doubling their capacity when they need to grow
+        """
+        capacity = getattr(self, names[0]).shape[1]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        for name in names:
+            old = getattr(self, name)
+            new = np.zeros((self.num_replicates, capacity), dtype=old.dtype)
+            new[:, :old.shape[1]] = old
+            setattr(self, name, new)
+
+    def _grow_mites(self, size):
+        self._grow(ArraySimulation._mite_arrays, size)
+
+    def add_bees(self, hive):
+        """
+        Add a new bee at a hive in every replicate, as a Bee created with
+        the default values
+
+        hive:   The index of the hive
+        """
+        self._grow(ArraySimulation._bee_arrays, int(self.n_bees.max()) + 1)
+        rows = np.arange(self.num_replicates)
+        i = self.n_bees
+        self.bee_x[rows, i] = self.hive_x[hive]
+        self.bee_y[rows, i] = self.hive_y[hive]
+        self.bee_mode[rows, i] = SEARCH
+        self.bee_tx[rows, i] = -1
+        self.bee_ty[rows, i] = -1
+        self.bee_store[rows, i] = 0
+        self.bee_life[rows, i] = self.bee_lifespan
+        self.bee_virus[rows, i] = False
+        self.bee_alive[rows, i] = True
+        self.bee_hive[rows, i] = hive
+        self.bee_last_x[rows, i] = self.hive_x[hive]
+        self.bee_last_y[rows, i] = self.hive_y[hive]
+        self.bee_last_amount[rows, i] = 0
+        self.n_bees += 1
+
+    def update(self):
+        """
+        Run one time-step of every replicate and log the bee and mite
+        populations
+        """
+        kernels = _get_kernels(self.backend)
+        step_mites, step_bees, step_batch_mites, step_batch_bees = kernels
+        num_replicates = self.num_replicates
+        grid_x, grid_y = self.original_environment.shape
+        n_cells = grid_x * grid_y
+        n_bees = self.n_bees.copy()
+        columns = np.arange(self.bee_alive.shape[1])
+        in_use = columns < n_bees[:, np.newaxis]
+        live = self.bee_alive & in_use
+        n_live_bees = np.count_nonzero(live, axis=1)
+        dead_before_step = in_use & ~live
+
+        # Index the living bees of every replicate by location for the
+        # waiting mites
+        rows, live_bees = np.nonzero(live)
+        cells = (rows * n_cells + self.bee_x[rows, live_bees] * grid_y +
+                 self.bee_y[rows, live_bees])
+        order, cell_keys, cell_start = _index_cells(cells)
+        cell_bees = live_bees[order]
+        cell_bounds = np.searchsorted(cell_keys, np.arange(num_replicates + 1)
+                                      * n_cells)
+        cell_keys %= n_cells
+        # The bees forage where they are before they move
+        foraged = (rows * n_cells + self.bee_y[rows, live_bees] * grid_y +
+                   self.bee_x[rows, live_bees])
+
+        # Process mites, drawing each replicate's random numbers from its
+        # own Generator
+        max_mites = np.maximum(self.n_mites, (n_live_bees *
+                                              self.mite_capacity).astype(
+                                                  np.int64) + 1) + \
+            self.n_mites
+        self._grow_mites(int(max_mites.max()))
+        draws = np.empty((num_replicates, self.mite_x.shape[1], 5))
+        for r, rng in enumerate(self.rngs):
+            if self.n_mites[r]:
+                draws[r, :max_mites[r]] = rng.random((max_mites[r], 5))
+        step_batch_mites(step_mites, self.mite_x, self.mite_y,
+                         self.mite_mode, self.mite_host, self.mite_life,
+                         self.mite_alive, self.n_mites, self.bee_x,
+                         self.bee_y, self.bee_life, self.bee_alive,
+                         self.bee_hive, n_live_bees, self.mite_capacity,
+                         self.drop_chance, self.hive_x, self.hive_y, grid_x,
+                         grid_y, cell_keys, cell_start, cell_bounds,
+                         cell_bees, draws)
+
+        # Move Bees
+        draws = np.empty((num_replicates, self.bee_x.shape[1], 2))
+        for r, rng in enumerate(self.rngs):
+            if n_bees[r]:
+                draws[r, :n_bees[r]] = rng.random((n_bees[r], 2))
+        step_batch_bees(step_bees, self.bee_x, self.bee_y, self.bee_mode,
+                        self.bee_tx, self.bee_ty, self.bee_store,
+                        self.bee_life, self.bee_virus, self.bee_alive,
+                        self.bee_hive, self.bee_last_x, self.bee_last_y,
+                        self.bee_last_amount, n_bees,
+                        self.original_environment, self.depletion,
+                        self.hive_x, self.hive_y, self.hive_store,
+                        self.known_x, self.known_y, self.known_amount,
+                        self.known_count, self.known_slot, self.heat, draws)
+
+        # Hive actions (make more bees)
+        for hive in range(len(self.hive_x)):
+            for i in range(self.births_per_step):
+                self.add_bees(hive)
+
+        # Clean up dead insects. Bees that died this step are kept until
+        # the next one.
+        width = int(self.n_bees.max())
+        keep = np.arange(width) < self.n_bees[:, np.newaxis]
+        old_width = min(width, dead_before_step.shape[1])
+        keep[:, :old_width] &= ~dead_before_step[:, :old_width]
+        self._compact_bees(keep)
+        width = int(self.n_mites.max())
+        keep = self.mite_alive[:, :width] & \
+            (np.arange(width) < self.n_mites[:, np.newaxis])
+        self._compact(ArraySimulation._mite_arrays, keep)
+        self.n_mites = np.count_nonzero(keep, axis=1)
+
+        # Update the environment
+        self.depleted = _regrow(self.depletion.reshape(-1),
+                                self.replenishment.reshape(-1),
+                                self.depleted, foraged)
+
+        # Log the bee and mite populations
+        self.bee_pop.append(self.population()[0])
+        self.mite_pop.append(self.n_mites.copy())
+        self.timestep += 1
+
+    def _compact(self, names, keep):
+        """
+        Move the agents kept to the front of each replicate's arrays, in
+        the same order. keep covers the columns in use, which may be fewer
+        than the capacity of the arrays.
+        """
+        width = keep.shape[1]
+        capacity = getattr(self, names[0]).shape[1]
+        order = np.argsort(~keep, axis=1, kind='stable')
+        order += np.arange(self.num_replicates)[:, np.newaxis] * capacity
+        order = order.ravel()
+        for name in names:
+            array = getattr(self, name)
+            array[:, :width] = array.reshape(-1).take(order).reshape(
+                self.num_replicates, width)
+
+    def _compact_bees(self, keep):
+        """
+        Remove the bees not kept from the arrays and renumber the mites'
+        hosts to match
+        """
+        new_index = np.cumsum(keep, axis=1) - 1
+        self._compact(ArraySimulation._bee_arrays, keep)
+        hosts = self.mite_host[:, :int(self.n_mites.max())]
+        riding = (hosts >= 0) & \
+            (np.arange(hosts.shape[1]) < self.n_mites[:, np.newaxis])
+        rows = np.nonzero(riding)[0]
+        hosts[riding] = new_index[rows, hosts[riding]]
+        self.n_bees = np.count_nonzero(keep, axis=1)
+
+    def population(self):
+        """
+        returns: A tuple of arrays of the number of living bees and mites
+                 in each replicate
+        """
+        columns = np.arange(self.bee_alive.shape[1])
+        bees = np.count_nonzero(self.bee_alive &
+                                (columns < self.n_bees[:, np.newaxis]),
+                                axis=1)
+        return bees, self.n_mites.copy()
+
+    @property
+    def environment(self):
+        """
+        The nectar left in each location of each replicate, as a new array
+        """
+        return self.original_environment - self.depletion
+
+    def replicate(self, r):
+        """
+        Split out the results of one replicate
+
+        r:          The index of the replicate
+
+        returns:    A tuple of the heatmap as a list of lists, and the bee
+                    and mite populations at each time-step as lists
+        """
+        return (self.heat[r].tolist(),
+                [int(bees[r]) for bees in self.bee_pop],
+                [int(mites[r]) for mites in self.mite_pop])
+
+def replicate_seeds(seed, num_replicates):
+    """
+    Spawn independent seeds for replicate runs from one seed
+
+    seed:           The seed the replicate seeds are spawned from
+    num_replicates: The number of seeds to spawn
+
+    returns:        A list of integer seeds
+    """
+    return [int(child.generate_state(1)[0])
+            for child in np.random.SeedSequence(seed).spawn(num_replicates)]
+
+def check_batch(environment, num_iterations=100, seed=0, num_replicates=4,
+                num_bees=40, num_mites=40):
+    """
+    Check each replicate of a BatchSimulation gives the same results as an
+    ArraySimulation run on its own from the replicate's seed
+
+    returns:    True if the populations, heatmaps and environments match
+    """
+    batch = BatchSimulation(environment, num_replicates, num_bees, num_mites,
+                            num_iterations=num_iterations, seed=seed)
+    for i in range(num_iterations):
+        batch.update()
+    for r in range(num_replicates):
+        single = ArraySimulation(environment, num_bees, num_mites,
+                                 num_iterations=num_iterations,
+                                 seed=batch.seeds[r], backend=batch.backend)
+        for i in range(num_iterations):
+            single.update()
+        heat, bee_pop, mite_pop = batch.replicate(r)
+        if not (single.bee_pop == bee_pop and single.mite_pop == mite_pop and
+                np.array_equal(single.heat, batch.heat[r]) and
+                np.array_equal(single.environment, batch.environment[r])):
+            return False
+    return True
+
+def check_backends(environment, num_iterations=100, seed=0, num_bees=40,
+                   num_mites=40):
+    """
+    Check the python and numba backends give the same results from the
+    same seed
+
+    returns:    True if the populations, heatmaps and environments match
+    """
+    simulations = [ArraySimulation(environment, num_bees, num_mites,
+                                   num_iterations=num_iterations, seed=seed,
+                                   backend=backend)
+                   for backend in BACKENDS]
+    for simulation in simulations:
+        for i in range(num_iterations):
+            simulation.update()
+    python, jit = simulations
+    return (python.bee_pop == jit.bee_pop and
+            python.mite_pop == jit.mite_pop and
+            np.array_equal(python.heat, jit.heat) and
+            np.array_equal(python.environment, jit.environment))
+
+def _private_memory():
+    """
+    returns: The private memory this process has in use, in bytes, or None
+             if it can't be read (it is read from /proc, so only on Linux)
+    """
+    try:
+        with open("/proc/self/status") as file1:
+            for line in file1:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _measure_memory(connection, spec, num_replicates, num_iterations, seed):
+    """
+    The worker process for check_memory. It runs a simulation (or a batch
+    of num_replicates) on a shared landscape and sends back how much its
+    private memory grew.
+    """
+    import landscape
+    shared = landscape.SharedLandscape.attach(spec)
+    before = _private_memory()
+    if num_replicates:
+        simulation = BatchSimulation(shared.original, num_replicates,
+                                     num_iterations=num_iterations,
+                                     seed=seed, landscape=shared)
+    else:
+        simulation = ArraySimulation(shared.original,
+                                     num_iterations=num_iterations,
+                                     seed=seed, landscape=shared)
+    for i in range(num_iterations):
+        simulation.update()
+    connection.send(_private_memory() - before)
+    simulation = None
+    shared.close()
+    connection.close()
+
+def check_memory(environment, num_iterations=100, seed=0, num_replicates=4,
+                 scale=40):
+    """
+    Check the memory a run uses on a shared landscape doesn't grow with the
+    size of the landscape. A single run and a batch are run in worker
+    processes on the environment and on the environment tiled scale times
+    in each direction, where the bees can only reach a small part of it.
+
+    returns:    True if the runs on the large landscape use less extra
+                memory than a tenth of the size of its environment, or None
+                if the memory of a process can't be read
+    """
+    import landscape
+    if _private_memory() is None:
+        return None
+    small = np.array(environment, dtype=np.int64)
+    large = np.tile(small, (scale, scale))
+    growth = {}
+    for name, values in (("small", small), ("large", large)):
+        shared = landscape.SharedLandscape.create(values)
+        for replicates in (0, num_replicates):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            worker = multiprocessing.Process(
+                target=_measure_memory,
+                args=(sender, shared.spec(), replicates, num_iterations,
+                      seed))
+            worker.start()
+            growth[name, replicates] = receiver.recv()
+            worker.join()
+        shared.unlink()
+    return all(growth["large", replicates] - growth["small", replicates] <
+               large.nbytes // 10 for replicates in (0, num_replicates))
+
+if __name__ == "__main__":
+    import model
+    environment_file = sys.argv[1] if len(sys.argv) > 1 else 'environment.csv'
+    num_iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    environment = model.read_environment(environment_file)
+    if check_batch(environment, num_iterations, seed):
+        print("The batched replicates give the same results as single runs")
+    else:
+        print("The batched replicates give DIFFERENT results to single runs")
+        sys.exit(1)
+    fits = check_memory(environment, num_iterations, seed)
+    if fits is None:
+        print("The memory of a process can't be read, so the memory of a "
+              "run can't be checked")
+    elif fits:
+        print("The memory of a run doesn't grow with the size of the "
+              "landscape")
+    else:
+        print("The memory of a run GROWS with the size of the landscape")
+        sys.exit(1)
+    if _import_numba() is None:
+        print("Numba is not installed, the backends can't be checked")
+        sys.exit(0)
+    if check_backends(environment, num_iterations, seed):
+        print("The python and numba backends give the same results")
+    else:
+        print("The python and numba backends give DIFFERENT results")
+        sys.exit(1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+NAME
+    branching.py - Sweeps of the VarBee model that share their burn-in
+
+SYNOPSIS
+    python3 branching.py File [number1] [number2] [number3]
+                         [--burn-in number4] [--branches number5]
+                         [--replicates number6] [--vary name low high]...
+                         [--seed number7] [--engine {array,jit}]
+                         [--workers number8]
+
+    File: A CSV file containing the environment
+    number1: The number of iterations of each run, including the burn-in
+             (default 1000)
+    number2: The number of bees to start with
+    number3: The number of mites to start with
+    number4: The number of time-steps of the shared burn-in (default 300)
+    number5: The number of parameter sets to branch (default 16)
+    number6: The number of runs branched for each parameter set, each with
+             its own random numbers (default 1)
+    --vary:  Vary a parameter from low to high over the branches. Any of
+             bee_lifespan, mite_capacity, drop_chance and added_mites (the
+             mites added when the run branches). Can be given more than
+             once. The default is to vary mite_capacity and drop_chance
+             over the ranges of sensitivity.py.
+    number7: The seed for the burn-in, the parameter sets and the branches
+    --engine: The engine used to run the model, uncompiled ("array") or
+             compiled with Numba ("jit")
+    number8: The number of worker processes (default the number of CPUs)
+
+DESCRIPTION
+    Runs the burn-in, the first number4 time-steps, once with the default
+    parameters. The runs of the sweep then branch from its state, each
+    with parameter values sampled by Latin hypercube and its own random
+    number stream, so no run simulates the burn-in again. The branches are
+    run by worker processes forked from the one that ran the burn-in, so
+    they share its state (and any compiled kernels) until they change it.
+
+    Each branch writes results_<k>.csv and heatmap_<k>.csv, whose
+    populations include the burn-in, and branches.csv lists the parameter
+    values of each branch with the mean bee and mite populations over the
+    last quarter of the run.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import os
+import sys
+import csv
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+import arraybee
+import sensitivity
+
+###############################################################################
+#                                                                             #
+#  Branching parameters                                                       #
+#                                                                             #
+###############################################################################
+NUM_ITERATIONS = 1000
+BURN_IN = 300
+NUM_BRANCHES = 16
+# The parameters that can be varied over the branches, with their default
+# (low, high, whole number) ranges
+PARAMETERS = {"bee_lifespan": sensitivity.PARAMETERS["bee_lifespan"],
+              "mite_capacity": sensitivity.PARAMETERS["mite_capacity"],
+              "drop_chance": sensitivity.PARAMETERS["drop_chance"],
+              "added_mites": (0, 100, True)}
+VARIED = ("mite_capacity", "drop_chance")
+
+###############################################################################
+#                                                                             #
+#  Branches                                                                   #
+#                                                                             #
+###############################################################################
+
+# The simulation at the end of the burn-in, inherited by each worker
+_trunk = None
+
+def _set_trunk(trunk):
+    '''
+    Give a worker process the simulation to branch from
+    '''
+    global _trunk
+    _trunk = trunk
+
+def run_branch(branch, seed, values, num_iterations):
+    '''
+    Run one branch from the end of the burn-in and write its results
+
+    branch:     The number of the branch, used in the file names
+    seed:       The seed for the branch's random numbers
+    values:     A dict of the parameter values of the branch
+    num_iterations: The number of iterations of the whole run
+
+    returns:    The means of the bee and mite populations over the last
+                quarter of the run
+    '''
+    values = dict(values)
+    added_mites = values.pop("added_mites", 0)
+    simulation = _trunk.branch(seed, **values)
+    simulation.add_mites(added_mites)
+    for i in range(num_iterations - simulation.timestep):
+        simulation.update()
+    model.write_results(simulation.heatmap(), simulation.bee_pop,
+                        simulation.mite_pop, "heatmap_%d.csv" % branch,
+                        "results_%d.csv" % branch)
+    tail = max(num_iterations // 4, 1)
+    return (float(np.mean(simulation.bee_pop[-tail:])),
+            float(np.mean(simulation.mite_pop[-tail:])))
+
+def _run_branch(task):
+    return run_branch(*task)
+
+def burn_in(environment, args):
+    '''
+    Run the shared burn-in
+
+    returns:    The simulation at the end of the burn-in
+    '''
+    backend = "numba" if args.engine == "jit" else "python"
+    trunk = arraybee.ArraySimulation(
+        environment, num_bees=args.num_bees, num_mites=args.num_mites,
+        hive_locations=model.HIVE_LOCATIONS[:model.NUM_HIVES],
+        num_iterations=args.num_iterations, seed=args.seed, backend=backend)
+    for i in range(args.burn_in):
+        trunk.update()
+    return trunk
+
+def run_branches(trunk, samples, seeds, args):
+    '''
+    Run the branches from the end of the burn-in in worker processes
+
+    samples:    A list of a dict of parameter values for each branch
+    seeds:      The seed for each branch
+
+    returns:    A list of the bee and mite means of each branch
+    '''
+    tasks = [(branch, seeds[branch], values, args.num_iterations)
+             for branch, values in enumerate(samples)]
+    # Forked workers share the burn-in's memory rather than a pickled copy
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods
+                                          else None)
+    with context.Pool(args.workers, initializer=_set_trunk,
+                      initargs=(trunk,)) as pool:
+        return pool.map(_run_branch, tasks)
+
+def write_branches(samples, seeds, outcomes, filename='branches.csv'):
+    '''
+    Write the parameter values and outcome of each branch
+    '''
+    names = list(samples[0])
+    with open(filename, 'w', newline='') as file1:
+        writer = csv.writer(file1)
+        writer.writerow(["branch", "seed"] + names + ["bees", "mites"])
+        for branch, (values, outcome) in enumerate(zip(samples, outcomes)):
+            writer.writerow([branch, seeds[branch]] +
+                            [values[name] for name in names] + list(outcome))
+
+def parse_args(argv):
+    '''
+    Command line processing
+
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the sweep parameters
+    '''
+    parser = argparse.ArgumentParser(
+        description="Sweeps of the VarBee model that share their burn-in")
+    parser.add_argument("environment_file", nargs='?',
+                        default=model.ENVIRONMENT_FILE,
+                        help="The CSV file containing the environment")
+    parser.add_argument("num_iterations", nargs='?', type=int,
+                        default=NUM_ITERATIONS,
+                        help="The number of iterations of each run")
+    parser.add_argument("num_bees", nargs='?', type=int,
+                        default=model.NUM_BEES,
+                        help="The number of bees to start with")
+    parser.add_argument("num_mites", nargs='?', type=int,
+                        default=model.NUM_MITES,
+                        help="The number of mites to start with")
+    parser.add_argument("--burn-in", type=int, default=BURN_IN,
+                        help="The number of time-steps of the burn-in")
+    parser.add_argument("--branches", type=int, default=NUM_BRANCHES,
+                        help="The number of parameter sets to branch")
+    parser.add_argument("--replicates", type=int, default=1,
+                        help="The runs branched for each parameter set")
+    parser.add_argument("--vary", nargs=3, action="append", default=[],
+                        metavar=("NAME", "LOW", "HIGH"),
+                        help="Vary a parameter over the branches")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed for the random number generator")
+    parser.add_argument("--engine", choices=("array", "jit"), default="array",
+                        help="The engine used to run the model")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes")
+    args = parser.parse_args(argv)
+
+    args.ranges = {}
+    for name, low, high in args.vary:
+        if name not in PARAMETERS:
+            parser.error("Unknown parameter %s, use one of %s"
+                         % (name, ", ".join(PARAMETERS)))
+        whole = PARAMETERS[name][2]
+        convert = int if whole else float
+        args.ranges[name] = (convert(low), convert(high), whole)
+    if not args.ranges:
+        args.ranges = {name: PARAMETERS[name] for name in VARIED}
+    if args.num_iterations <= 0:
+        args.num_iterations = NUM_ITERATIONS
+    if args.num_bees <= 0:
+        args.num_bees = model.NUM_BEES
+    if args.num_mites < 0:
+        args.num_mites = model.NUM_MITES
+    if not 0 <= args.burn_in <= args.num_iterations:
+        parser.error("--burn-in must be between 0 and the number of "
+                     "iterations")
+    if args.branches <= 0:
+        args.branches = NUM_BRANCHES
+    if args.replicates <= 0:
+        args.replicates = 1
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+    return args
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    print("Random seed = ", args.seed)
+    environment = model.read_environment(args.environment_file)
+
+    start = time.perf_counter()
+    trunk = burn_in(environment, args)
+    print("Burn-in of", args.burn_in, "time-steps took %.2f seconds"
+          % (time.perf_counter() - start))
+
+    rng = np.random.default_rng(args.seed)
+    points = sensitivity.latin_hypercube(args.branches, len(args.ranges),
+                                         rng)
+    samples = [values for values in sensitivity.scale(points, args.ranges)
+               for replicate in range(args.replicates)]
+    seeds = arraybee.replicate_seeds(args.seed, len(samples))
+    start = time.perf_counter()
+    outcomes = run_branches(trunk, samples, seeds, args)
+    print(len(samples), "branches of", args.num_iterations - args.burn_in,
+          "time-steps took %.2f seconds" % (time.perf_counter() - start))
+    write_branches(samples, seeds, outcomes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# domainbee.py - the VarBee model split into domains across processes
+"""
+domainbee.py
+
+Runs one simulation of the VarBee model across several worker processes.
+The environment is split into rectangular domains, one per worker, and each
+worker runs the array-backed engine from arraybee.py on the bees and mites
+in its domain. The classes contained are as follows:
+
+    - Domain
+    - DomainSimulation
+
+Each step, the parent process sends every worker the total populations and
+the messages for its domain, and each worker steps its agents and replies
+with the agents that have left its domain and the changes to its part of
+the environment:
+
+    - migration: bees that have moved into another domain are sent to it
+      with the mites riding them
+    - halo: a bee searching reads the location it has moved to, which may be
+      in the neighbouring domain, so each worker keeps a copy of the
+      locations one step outside its domain. The locations that have run
+      out of nectar or grown back are sent to the workers whose halo
+      contains them.
+
+The bees forage at environment[y][x] and search at environment[x][y], as in
+the object model, so a domain regrows and forages the transpose of the
+locations its bees occupy, and the environment must be square.
+
+Differences from a single array-backed simulation:
+    - the random numbers are drawn in each domain, so the results only
+      agree statistically
+    - a searching bee sees the halo as it was at the end of the last step
+    - mites count towards the total mite population for reproduction from
+      the start of the step in other domains
+"""
+import multiprocessing
+import numpy as np
+
+import arraybee
+import landscape
+from varbee import WAIT
+
+###############################################################################
+#                                                                             #
+#  Domains                                                                    #
+#                                                                             #
+###############################################################################
+
+def split_domains(shape, num_domains):
+    """
+    Split a grid into rectangular domains, as close to square as possible
+
+    shape:          The shape of the grid
+    num_domains:    The number of domains
+
+    returns:        The edges of the domains along x and along y. Domain
+                    i * (len(y_edges) - 1) + j covers x_edges[i] to
+                    x_edges[i + 1] and y_edges[j] to y_edges[j + 1].
+    """
+    nx = int(np.sqrt(num_domains))
+    while num_domains % nx:
+        nx -= 1
+    ny = num_domains // nx
+    if nx > shape[0] or ny > shape[1]:
+        raise ValueError("Can't split a %s grid into %d domains"
+                         % (shape, num_domains))
+    x_edges = np.linspace(0, shape[0], nx + 1).astype(np.int64)
+    y_edges = np.linspace(0, shape[1], ny + 1).astype(np.int64)
+    return x_edges, y_edges
+
+def domain_of(x, y, x_edges, y_edges):
+    """
+    Find the domains containing positions. Positions outside the grid
+    belong to the nearest domain.
+
+    returns:    The domain index of each position
+    """
+    i = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0,
+                len(x_edges) - 2)
+    j = np.clip(np.searchsorted(y_edges, y, side='right') - 1, 0,
+                len(y_edges) - 2)
+    return i * (len(y_edges) - 1) + j
+
+class Domain(arraybee.ArraySimulation):
+    """
+    The bees, mites and environment of one domain, run by a worker process
+    """
+    def __init__(self, shared, index, x_edges, y_edges, num_bees=40,
+                 hive_locations=[(25, 25)], num_iterations=100, seed=None,
+                 backend=None, births_per_step=1):
+        """
+        shared:         The landscape.SharedLandscape to run on
+        index:          The index of this domain
+        x_edges, y_edges: The edges of the domains, from split_domains()
+        num_bees:       The number of bees to start with, which are only
+                        added if the first hive is in this domain
+        """
+        super().__init__(shared.original, 0, 0, hive_locations,
+                         num_iterations, seed, backend, births_per_step,
+                         landscape=shared)
+        self.index = index
+        self.x_edges = x_edges
+        self.y_edges = y_edges
+        i, j = divmod(index, len(y_edges) - 1)
+        self.rect = (x_edges[i], x_edges[i + 1], y_edges[j], y_edges[j + 1])
+        self.own_hives = [hive for hive in range(len(hive_locations))
+                          if domain_of(self.hive_x[hive], self.hive_y[hive],
+                                       x_edges, y_edges) == index]
+        if 0 in self.own_hives:
+            for j in range(num_bees):
+                self.add_bee(0)
+
+    def update(self, total_bees, total_mites, migrants, halo):
+        """
+        Run one time-step of the domain
+
+        total_bees:     The number of living bees in every domain at the
+                        end of the last step
+        total_mites:    The number of mites in every domain at the end of
+                        the last step
+        migrants:       The (bees, mites) that have moved into the domain
+        halo:           The rows, columns and values of the locations in the
+                        halo that have changed
+
+        returns:        The number of living bees and mites, the migrants
+                        leaving for each domain, the rows, columns and
+                        values of the locations that other domains need,
+                        and the domain's metrics()
+        """
+        for bees, mites in migrants:
+            self.immigrate(bees, mites)
+        rows, columns, values = halo
+        original = self.original_environment
+        self.depletion[rows, columns] = original[rows, columns] - values
+
+        step_mites, step_bees = arraybee._get_kernels(self.backend)[:2]
+        grid_x, grid_y = original.shape
+        x0, x1, y0, y1 = self.rect
+        owned = self.depletion[y0:y1, x0:x1]
+        had_nectar = original[y0:y1, x0:x1] - owned > 0
+        n_bees = self.n_bees
+        live = self.bee_alive[:n_bees]
+        n_live_bees = total_bees
+        dead_before_step = ~live
+
+        # Index the living bees by location for the waiting mites
+        live_bees = np.flatnonzero(live)
+        cells = self.bee_x[live_bees] * grid_y + self.bee_y[live_bees]
+        order, cell_keys, cell_start = arraybee._index_cells(cells)
+        cell_bees = live_bees[order]
+
+        # Process mites, counting the mites in the other domains towards
+        # the population
+        if self.n_mites:
+            other_mites = max(total_mites - self.n_mites, 0)
+            max_mites = max(self.n_mites, self._mite_limit(n_live_bees)) + \
+                self.n_mites
+            self._grow_mites(max_mites)
+            draws = self.rng.random((max_mites, 5))
+            self.n_mites = step_mites(self.mite_x, self.mite_y,
+                                      self.mite_mode, self.mite_host,
+                                      self.mite_life, self.mite_alive,
+                                      self.n_mites, self.bee_x, self.bee_y,
+                                      self.bee_life, self.bee_alive,
+                                      self.bee_hive, n_live_bees, other_mites,
+                                      self.mite_capacity, self.drop_chance,
+                                      self.hive_x, self.hive_y, grid_x,
+                                      grid_y, cell_keys, cell_start,
+                                      cell_bees, draws)
+
+        # Move Bees
+        if n_bees:
+            draws = self.rng.random((n_bees, 2))
+            step_bees(self.bee_x, self.bee_y, self.bee_mode, self.bee_tx,
+                      self.bee_ty, self.bee_store, self.bee_life,
+                      self.bee_virus, self.bee_alive, self.bee_hive,
+                      self.bee_last_x, self.bee_last_y, self.bee_last_amount,
+                      n_bees, original, self.depletion, self.hive_x,
+                      self.hive_y, self.hive_store, self.known_x,
+                      self.known_y, self.known_amount, self.known_count,
+                      self.known_slot, self.heat, draws)
+
+        # Hive actions (make more bees), for the hives in this domain
+        for hive in self.own_hives:
+            for i in range(self.births_per_step):
+                self.add_bee(hive)
+
+        # Clean up dead insects. Bees that died this step are kept until
+        # the next one.
+        keep = np.ones(self.n_bees, dtype=np.bool_)
+        keep[:n_bees] = ~dead_before_step
+        self._compact_bees(keep)
+        self._compact_mites(self.mite_alive[:self.n_mites].copy())
+
+        # Update the environment this domain owns
+        owned -= self.replenishment[y0:y1, x0:x1] * (owned > 0)
+        nectar = original[y0:y1, x0:x1] - owned
+        changed = np.nonzero((nectar > 0) != had_nectar)
+        changes = (changed[0] + y0, changed[1] + x0, nectar[changed])
+
+        population = self.population()
+        metrics = self.metrics()
+        return (population[0], population[1], self.emigrate(), changes,
+                metrics)
+
+    def _compact_mites(self, keep):
+        """
+        Remove the mites not kept from the arrays
+        """
+        for name in self._mite_arrays:
+            array = getattr(self, name)
+            kept = array[:self.n_mites][keep]
+            array[:len(kept)] = kept
+        self.n_mites = int(np.count_nonzero(keep))
+
+    def emigrate(self):
+        """
+        Remove the bees that have left the domain, with the mites riding
+        them
+
+        returns:    A dict of the (bees, mites) leaving for each domain,
+                    each a dict of arrays by name. The mites' hosts are
+                    indices into the bees sent with them.
+        """
+        n_bees = self.n_bees
+        destination = domain_of(self.bee_x[:n_bees], self.bee_y[:n_bees],
+                                self.x_edges, self.y_edges)
+        leaving = destination != self.index
+        if not leaving.any():
+            return {}
+        hosts = self.mite_host[:self.n_mites]
+        riding_leaver = np.zeros(self.n_mites, dtype=np.bool_)
+        migrants = {}
+        for domain in np.unique(destination[leaving]):
+            bees = np.flatnonzero(destination == domain)
+            riding = np.isin(hosts, bees)
+            riding_leaver |= riding
+            mites = {name: getattr(self, name)[:self.n_mites][riding]
+                     for name in self._mite_arrays}
+            mites["mite_host"] = np.searchsorted(bees, mites["mite_host"])
+            migrants[int(domain)] = (
+                {name: getattr(self, name)[bees] for name in self._bee_arrays},
+                mites)
+        self._compact_mites(~riding_leaver)
+        keep = np.ones(self.n_bees, dtype=np.bool_)
+        keep[:n_bees] = ~leaving
+        self._compact_bees(keep)
+        return migrants
+
+    def immigrate(self, bees, mites):
+        """
+        Add the bees and mites that have moved into the domain
+
+        bees:       A dict of the bee arrays by name
+        mites:      A dict of the mite arrays by name, with hosts indexing
+                    into bees
+        """
+        count = len(bees["bee_x"])
+        self._grow(self._bee_arrays, self.n_bees + count)
+        for name in self._bee_arrays:
+            getattr(self, name)[self.n_bees:self.n_bees + count] = bees[name]
+        count = len(mites["mite_x"])
+        self._grow_mites(self.n_mites + count)
+        for name in self._mite_arrays:
+            getattr(self, name)[self.n_mites:self.n_mites + count] = \
+                mites[name]
+        hosts = self.mite_host[self.n_mites:self.n_mites + count]
+        hosts[hosts >= 0] += self.n_bees
+        self.n_mites += count
+        self.n_bees += len(bees["bee_x"])
+
+def _run_domain(connection, spec, index, x_edges, y_edges, parameters):
+    """
+    The worker process for one domain. It runs the updates sent by the
+    parent until it is told to stop.
+    """
+    shared = landscape.SharedLandscape.attach(spec)
+    domain = Domain(shared, index, x_edges, y_edges, **parameters)
+    while True:
+        message = connection.recv()
+        if message[0] == "update":
+            connection.send(domain.update(*message[1:]))
+        elif message[0] == "heat":
+            connection.send(domain.heat)
+        else:
+            break
+    domain = None
+    shared.close()
+    connection.close()
+
+###############################################################################
+#                                                                             #
+#  Simulation                                                                 #
+#                                                                             #
+###############################################################################
+
+class DomainSimulation:
+    """
+    A simulation of the VarBee model split into domains, each run by its
+    own worker process. It can be used in place of varbee.Simulation, and
+    must be closed with close() when the run is finished.
+    """
+    def __init__(self, environment, num_domains=2, num_bees=40,
+                 num_mites=40, hive_locations=[(25, 25)], num_iterations=100,
+                 seed=None, backend=None, births_per_step=1):
+        """
+        Initialise the simulation, starting a worker for each domain
+
+        environment:    A list of lists containing the nectar in each
+                        location. It must be square.
+        num_domains:    The number of domains (and worker processes)
+        num_bees:       The number of bees to start with
+        num_mites:      The number of mites to start with
+        hive_locations: A list of tuples containing the hive coordinates
+        num_iterations: The number of iterations the model will run for
+        seed:           The seed the seeds of the domains are spawned from
+        backend:        "python" or "numba"
+        births_per_step: The number of bees born in each hive each
+                        time-step
+        """
+        original = np.array(environment, dtype=np.int64)
+        if original.shape[0] != original.shape[1]:
+            raise ValueError("Domains need a square environment")
+        self.num_domains = num_domains
+        self.x_edges, self.y_edges = split_domains(original.shape,
+                                                   num_domains)
+        self.bee_pop = []
+        self.mite_pop = []
+        self.timestep = 0
+        self.total_bees = num_bees
+        self.total_mites = num_mites
+        self.totals = {"foraging": 0, "searching": num_bees, "hive_store": 0}
+        seeds = arraybee.replicate_seeds(seed, num_domains + 1)
+        self.rng = np.random.default_rng(seeds[0])
+
+        # The halo of each domain, the locations its bees can search
+        grid_x, grid_y = original.shape
+        self.halo_slices = []
+        for domain in range(num_domains):
+            i, j = divmod(domain, len(self.y_edges) - 1)
+            self.halo_slices.append(
+                (max(self.x_edges[i] - 1, 0),
+                 min(self.x_edges[i + 1] + 1, grid_x),
+                 max(self.y_edges[j] - 1, 0),
+                 min(self.y_edges[j + 1] + 1, grid_y)))
+        empty = np.zeros(0, dtype=np.int64)
+        self.halo = [(empty, empty, empty)] * num_domains
+
+        # Start the workers on a shared copy of the landscape
+        self.landscape = landscape.SharedLandscape.create(original)
+        self.connections = []
+        self.workers = []
+        for domain in range(num_domains):
+            parameters = dict(num_bees=num_bees,
+                              hive_locations=hive_locations,
+                              num_iterations=num_iterations,
+                              seed=seeds[domain + 1], backend=backend,
+                              births_per_step=births_per_step)
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_run_domain,
+                args=(worker_connection, self.landscape.spec(), domain,
+                      self.x_edges, self.y_edges, parameters),
+                daemon=True)
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+        # Mites, in random locations, sent to the domain they start in
+        self.migrants = [[] for domain in range(num_domains)]
+        mite_x = self.rng.integers(0, grid_y + 1, size=num_mites)
+        mite_y = self.rng.integers(0, grid_x + 1, size=num_mites)
+        destination = domain_of(mite_x, mite_y, self.x_edges, self.y_edges)
+        no_bees = {name: np.zeros(0, dtype=np.int64)
+                   for name in arraybee.ArraySimulation._bee_arrays}
+        for domain in range(num_domains):
+            here = destination == domain
+            count = int(np.count_nonzero(here))
+            mites = {"mite_x": mite_x[here],
+                     "mite_y": mite_y[here],
+                     "mite_mode": np.full(count, WAIT),
+                     "mite_host": np.full(count, -1),
+                     "mite_life": np.full(count, 100),
+                     "mite_alive": np.ones(count, dtype=np.bool_)}
+            self.migrants[domain].append((no_bees, mites))
+
+    def update(self):
+        """
+        Run one time-step of every domain, exchange the migrants and halos,
+        and log the bee and mite populations
+        """
+        for domain, connection in enumerate(self.connections):
+            connection.send(("update", self.total_bees, self.total_mites,
+                             self.migrants[domain], self.halo[domain]))
+        self.migrants = [[] for domain in range(self.num_domains)]
+        total_bees = 0
+        total_mites = 0
+        totals = dict.fromkeys(self.totals, 0)
+        changes = []
+        for connection in self.connections:
+            num_bees, num_mites, migrants, changed, metrics = \
+                connection.recv()
+            total_bees += num_bees
+            total_mites += num_mites
+            for name in totals:
+                totals[name] += metrics[name]
+            for domain in migrants:
+                self.migrants[domain].append(migrants[domain])
+            changes.append(changed)
+
+        # Send each domain the changes inside its halo
+        rows = np.concatenate([changed[0] for changed in changes])
+        columns = np.concatenate([changed[1] for changed in changes])
+        values = np.concatenate([changed[2] for changed in changes])
+        for domain, (x0, x1, y0, y1) in enumerate(self.halo_slices):
+            inside = (x0 <= rows) & (rows < x1) & (y0 <= columns) & \
+                (columns < y1)
+            self.halo[domain] = (rows[inside], columns[inside],
+                                 values[inside])
+
+        self.total_bees = total_bees
+        self.total_mites = total_mites
+        self.totals = totals
+        self.bee_pop.append(total_bees)
+        self.mite_pop.append(total_mites)
+        self.timestep += 1
+
+    def population(self):
+        """
+        returns: A tuple of the number of living bees and mites
+        """
+        return self.total_bees, self.total_mites
+
+    def metrics(self):
+        """
+        returns: A dict of the number of bees foraging and searching, and
+                 the nectar stored in all the hives, summed over the
+                 domains
+        """
+        return dict(self.totals)
+
+    def heatmap(self):
+        """
+        Create a heatmap of the total number of bees in each position,
+        summed over the domains
+
+        returns: A list of lists of the bee counts
+        """
+        for connection in self.connections:
+            connection.send(("heat",))
+        return sum(connection.recv() for connection in self.connections
+                   ).tolist()
+
+    def close(self):
+        """
+        Stop the workers and free the shared landscape
+        """
+        for connection in self.connections:
+            connection.send(("stop",))
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+        self.landscape.unlink()
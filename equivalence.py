@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+NAME
+    equivalence.py - Check a model engine gives the same results as another
+
+SYNOPSIS
+    python3 equivalence.py File [number1] [number2] [number3]
+                           [--candidate=Options] [--reference=Options]
+                           [--seeds number4] [--seed number5]
+                           [--alpha number6] [--min-correlation number7]
+
+    File: A CSV file containing the environment
+    number1: The number of iterations of each run (default 300)
+    number2: The number of bees to start with
+    number3: The number of mites to start with
+    Options: The model.py options that choose an engine, as one string
+             joined on with "=", e.g. --candidate="--engine jit".
+             The candidate defaults to "--engine array" and the reference to
+             "" (the classes in varbee.py). "--batch" runs all the seeds of
+             the array or jit engine in one batched simulation.
+    number4: The number of seeds each engine is run with (default 30)
+    number5: The seed the run seeds are spawned from
+    number6: The significance level of the tests (default 0.05)
+    number7: The least correlation allowed between the mean heatmaps
+             (default 0.9)
+
+DESCRIPTION
+    A faster engine doesn't draw its random numbers in the same order as
+    the varbee classes, so its runs can't be compared one by one. Instead
+    both engines are run with many seeds and the distributions of their
+    results are compared with two-sample Kolmogorov-Smirnov tests:
+
+        bees_<t>, mites_<t>: The populations at a quarter, half, three
+                        quarters and the end of the runs
+        bee_extinction, mite_extinction: The time-step the bees or mites
+                        died out, or the length of the run if they didn't
+        heat_cells:     The number of locations the bees visited
+        heat_distance:  The mean distance of the visits from the hive
+
+    The significance level is divided between the tests (Bonferroni), so
+    the chance of two equivalent engines failing is at most number6. The
+    mean heatmaps of the two engines must also be correlated. The tests,
+    the speedup of the candidate (the reference run time over the
+    candidate run time) and PASS or FAIL are printed and written to
+    equivalence.csv. The exit status is 0 on PASS and 1 on FAIL.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import sys
+import csv
+import time
+import shlex
+import argparse
+import numpy as np
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+import arraybee
+
+###############################################################################
+#                                                                             #
+#  Harness parameters                                                         #
+#                                                                             #
+###############################################################################
+NUM_ITERATIONS = 300
+NUM_SEEDS = 30
+ALPHA = 0.05
+MIN_CORRELATION = 0.9
+CANDIDATE = "--engine array"
+REFERENCE = ""
+# The fractions of the run the populations are compared at
+CHECKPOINTS = (0.25, 0.5, 0.75, 1.0)
+
+###############################################################################
+#                                                                             #
+#  Statistics                                                                 #
+#                                                                             #
+###############################################################################
+
+def ks_2samp(sample1, sample2):
+    '''
+    Two-sample Kolmogorov-Smirnov test of whether two samples come from the
+    same distribution. The p-value is the asymptotic one, which is
+    conservative for samples with ties, such as population counts.
+
+    sample1, sample2:   Sequences of numbers
+
+    returns:    A tuple of the statistic (the largest difference between the
+                empirical distribution functions) and the p-value
+    '''
+    sample1 = np.sort(np.asarray(sample1, dtype=float))
+    sample2 = np.sort(np.asarray(sample2, dtype=float))
+    n1 = len(sample1)
+    n2 = len(sample2)
+    values = np.concatenate((sample1, sample2))
+    cdf1 = np.searchsorted(sample1, values, side='right') / n1
+    cdf2 = np.searchsorted(sample2, values, side='right') / n2
+    statistic = float(np.max(np.abs(cdf1 - cdf2)))
+
+    # The Kolmogorov distribution, with the small sample correction of
+    # Stephens (1970)
+    en = np.sqrt(n1 * n2 / (n1 + n2))
+    lam = (en + 0.12 + 0.11 / en) * statistic
+    if lam < 0.2:
+        return statistic, 1.0
+    k = np.arange(1, 101)
+    p = 2 * np.sum((-1.0)**(k - 1) * np.exp(-2 * k**2 * lam**2))
+    return statistic, float(min(max(p, 0.0), 1.0))
+
+def extinction_time(pop):
+    '''
+    The first time-step a population is zero, or len(pop) if it never is
+    '''
+    for i, count in enumerate(pop):
+        if count == 0:
+            return i
+    return len(pop)
+
+def summarise(bee_pop, mite_pop, heat, num_iterations):
+    '''
+    The quantities of one run that are compared between the engines
+
+    returns:    A dict of the name and value of each quantity
+    '''
+    summary = {}
+    for fraction in CHECKPOINTS:
+        step = int(fraction * num_iterations)
+        # A run that stopped early keeps its last populations
+        summary["bees_%d" % step] = bee_pop[min(step, len(bee_pop) - 1)]
+        summary["mites_%d" % step] = mite_pop[min(step, len(mite_pop) - 1)]
+    summary["bee_extinction"] = extinction_time(bee_pop)
+    summary["mite_extinction"] = extinction_time(mite_pop)
+
+    heat = np.asarray(heat, dtype=float)
+    summary["heat_cells"] = int(np.count_nonzero(heat))
+    hive_x, hive_y = model.HIVE_LOCATIONS[0]
+    x, y = np.indices(heat.shape)
+    distance = np.hypot(x - hive_x, y - hive_y)
+    total = heat.sum()
+    summary["heat_distance"] = float((heat * distance).sum() / total) \
+        if total else 0.0
+    return summary
+
+###############################################################################
+#                                                                             #
+#  Running the engines                                                        #
+#                                                                             #
+###############################################################################
+
+def engine_args(args, options, seed):
+    '''
+    Make the model arguments for a run of an engine
+
+    args:       The parsed command line arguments of the harness
+    options:    The model.py options that choose the engine
+    seed:       The seed for the run
+
+    returns:    An argparse.Namespace as returned by model.parse_args()
+    '''
+    return model.parse_args([args.environment_file, str(args.num_iterations),
+                             str(args.num_bees), str(args.num_mites),
+                             "--seed", str(seed)] + shlex.split(options))
+
+def run_engine(environment, args, options, seeds):
+    '''
+    Run an engine once with each seed
+
+    environment:    A list of lists containing the environment
+    args:           The parsed command line arguments of the harness
+    options:        The model.py options that choose the engine
+    seeds:          The seeds to run with
+
+    returns:        A tuple of the list of the summaries of each run, the
+                    mean heatmap and the time taken by the runs in seconds
+    '''
+    run_args = engine_args(args, options, args.seed)
+    if run_args.batch:
+        # The batched engine runs all the seeds as its replicates
+        run_args.replicates = len(seeds)
+        return run_batch_engine(environment, run_args)
+    summaries = []
+    heats = []
+    seconds = 0.0
+    for seed in seeds:
+        run_args = engine_args(args, options, seed)
+        start = time.perf_counter()
+        # The object engine takes the nectar from the list it is given, so
+        # each run gets its own copy of the landscape
+        simulation = model.make_simulation([row[:] for row in environment],
+                                           run_args)
+        try:
+            model.run_simulation(simulation, model.make_rules(run_args),
+                                 run_args.num_iterations, progress=False)
+            heat = simulation.heatmap()
+        finally:
+            if run_args.domains > 1:
+                simulation.close()
+        seconds += time.perf_counter() - start
+        summaries.append(summarise(simulation.bee_pop, simulation.mite_pop,
+                                   heat, args.num_iterations))
+        heats.append(heat)
+    return summaries, np.mean(heats, axis=0), seconds
+
+def run_batch_engine(environment, args):
+    '''
+    Run the seeds in one arraybee.BatchSimulation. Its replicate seeds are
+    spawned from args.seed in the same way as the harness spawns the seeds
+    of the other engines.
+
+    returns:    As run_engine()
+    '''
+    backend = "numba" if args.engine == "jit" else "python"
+    start = time.perf_counter()
+    batch = arraybee.BatchSimulation([row[:] for row in environment],
+                                     args.replicates,
+                                     num_bees=args.num_bees,
+                                     num_mites=args.num_mites,
+                                     hive_locations=model.HIVE_LOCATIONS[
+                                         :model.NUM_HIVES],
+                                     num_iterations=args.num_iterations,
+                                     seed=args.seed, backend=backend,
+                                     births_per_step=args.births)
+    for i in range(args.num_iterations):
+        batch.update()
+    seconds = time.perf_counter() - start
+    summaries = []
+    for replicate in range(args.replicates):
+        heat, bee_pop, mite_pop = batch.replicate(replicate)
+        summaries.append(summarise(bee_pop, mite_pop, heat,
+                                   args.num_iterations))
+    return summaries, batch.heat.mean(axis=0), seconds
+
+###############################################################################
+#                                                                             #
+#  Comparing the engines                                                      #
+#                                                                             #
+###############################################################################
+
+def compare(reference, candidate, alpha, min_correlation, correlation):
+    '''
+    Test whether the candidate's results have the same distribution as the
+    reference's
+
+    reference, candidate:   Lists of the summaries of the runs
+    alpha:          The significance level of all the tests together
+    min_correlation: The least correlation allowed between the heatmaps
+    correlation:    The correlation between the mean heatmaps
+
+    returns:        A list of rows of the test name, statistic, p-value,
+                    threshold and whether it passed
+    '''
+    names = list(reference[0])
+    threshold = alpha / len(names)
+    rows = []
+    for name in names:
+        statistic, p = ks_2samp([run[name] for run in reference],
+                                [run[name] for run in candidate])
+        rows.append((name, statistic, p, threshold, p >= threshold))
+    rows.append(("heat_correlation", correlation, float("nan"),
+                 min_correlation, correlation >= min_correlation))
+    return rows
+
+def parse_args(argv):
+    '''
+    Command line processing
+
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the harness parameters
+    '''
+    parser = argparse.ArgumentParser(
+        description="Check a model engine gives the same results as another")
+    parser.add_argument("environment_file", nargs='?',
+                        default=model.ENVIRONMENT_FILE,
+                        help="A CSV file containing the environment")
+    parser.add_argument("num_iterations", nargs='?', type=int,
+                        default=NUM_ITERATIONS,
+                        help="The number of iterations of each run")
+    parser.add_argument("num_bees", nargs='?', type=int,
+                        default=model.NUM_BEES,
+                        help="The number of bees to start with")
+    parser.add_argument("num_mites", nargs='?', type=int,
+                        default=model.NUM_MITES,
+                        help="The number of mites to start with")
+    parser.add_argument("--candidate", default=CANDIDATE,
+                        help="The model.py options of the candidate engine")
+    parser.add_argument("--reference", default=REFERENCE,
+                        help="The model.py options of the reference engine")
+    parser.add_argument("--seeds", type=int, default=NUM_SEEDS,
+                        help="The number of seeds each engine is run with")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed the run seeds are spawned from")
+    parser.add_argument("--alpha", type=float, default=ALPHA,
+                        help="The significance level of the tests")
+    parser.add_argument("--min-correlation", type=float,
+                        default=MIN_CORRELATION,
+                        help="The least correlation between the heatmaps")
+    args = parser.parse_args(argv)
+
+    if args.num_iterations <= 0:
+        args.num_iterations = NUM_ITERATIONS
+    if args.num_bees <= 0:
+        args.num_bees = model.NUM_BEES
+    if args.num_mites <= 0:
+        args.num_mites = model.NUM_MITES
+    if args.seeds <= 1:
+        args.seeds = NUM_SEEDS
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+    for options in (args.candidate, args.reference):
+        # Check the options now rather than after the reference has run
+        run_args = engine_args(args, options, args.seed)
+        if run_args.replicates > 1:
+            parser.error("Use --seeds rather than --replicates")
+    return args
+
+def print_tests(rows, speedup, passed):
+    '''
+    Print the tests, the speedup and the verdict
+    '''
+    print("%-16s %10s %10s %10s  %s" % ("test", "statistic", "p-value",
+                                        "threshold", "result"))
+    for name, statistic, p, threshold, ok in rows:
+        print("%-16s %10.4f %10.4f %10.4f  %s" % (name, statistic, p,
+                                                  threshold,
+                                                  "pass" if ok else "FAIL"))
+    print("Speedup = %.2f" % speedup)
+    print("PASS" if passed else "FAIL")
+
+def write_tests(rows, speedup, passed, filename='equivalence.csv'):
+    '''
+    Write the tests, the speedup and the verdict to a CSV file
+    '''
+    with open(filename, 'w', newline='') as file1:
+        writer = csv.writer(file1)
+        writer.writerow(["test", "statistic", "p_value", "threshold",
+                         "passed"])
+        for row in rows:
+            writer.writerow(row)
+        writer.writerow(["speedup", speedup, "", "", ""])
+        writer.writerow(["equivalent", "", "", "", passed])
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    print("Random seed = ", args.seed)
+    environment = model.read_environment(args.environment_file)
+    seeds = arraybee.replicate_seeds(args.seed, args.seeds)
+
+    results = {}
+    for role, options in (("reference", args.reference),
+                          ("candidate", args.candidate)):
+        # A short untimed run first, so compiling a jit engine isn't counted
+        warm_up = argparse.Namespace(**vars(args))
+        warm_up.num_iterations = 2
+        run_engine(environment, warm_up, options, seeds[:2])
+        print("Running the", role, "engine", repr(options.strip()), "with",
+              args.seeds, "seeds")
+        results[role] = run_engine(environment, args, options, seeds)
+
+    reference, reference_heat, reference_seconds = results["reference"]
+    candidate, candidate_heat, candidate_seconds = results["candidate"]
+    correlation = float(np.corrcoef(np.ravel(reference_heat),
+                                    np.ravel(candidate_heat))[0, 1])
+    rows = compare(reference, candidate, args.alpha, args.min_correlation,
+                   correlation)
+    speedup = reference_seconds / candidate_seconds
+    passed = all(row[4] for row in rows)
+    print_tests(rows, speedup, passed)
+    write_tests(rows, speedup, passed)
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# landscape.py - a read-only landscape shared between model runs
+"""
+landscape.py
+
+Classes for sharing one read-only copy of a landscape between model runs in
+different processes. The classes contained are as follows:
+
+    - SharedLandscape
+    - DepletionLayer
+    - LayerEnvironment
+
+The SharedLandscape puts the original environment and the replenishment
+grid in multiprocessing.shared_memory blocks. Each run then reads them
+through its own DepletionLayer, which only stores the locations where nectar
+has been taken. The memory used by a run depends on how much of the
+landscape its bees have foraged, not on the size of the landscape or the
+number of runs.
+"""
+from multiprocessing import shared_memory
+import numpy as np
+
+import varbee
+
+class SharedLandscape:
+    """
+    The original environment and replenishment grid held in shared memory.
+    One process creates the landscape with create() and must unlink() it
+    when every run has finished. Other processes attach() to it using the
+    spec() of the landscape.
+    """
+    def __init__(self, original_memory, replenishment_memory, shape, owner):
+        """
+        Use create() or attach() rather than creating a landscape directly
+        """
+        self._original_memory = original_memory
+        self._replenishment_memory = replenishment_memory
+        self.shape = tuple(shape)
+        self.owner = owner
+        self.original = np.ndarray(self.shape, dtype=np.int64,
+                                   buffer=original_memory.buf)
+        self.replenishment = np.ndarray(self.shape, dtype=np.int64,
+                                        buffer=replenishment_memory.buf)
+        if not owner:
+            self.original.flags.writeable = False
+            self.replenishment.flags.writeable = False
+
+    @classmethod
+    def create(cls, environment):
+        """
+        Put an environment in shared memory
+
+        environment:    A list of lists containing the environment
+
+        returns:        The SharedLandscape
+        """
+        original = np.array(environment, dtype=np.int64)
+        memories = []
+        for values in (original, original**2 // 2000):
+            memory = shared_memory.SharedMemory(create=True,
+                                                size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=np.int64,
+                       buffer=memory.buf)[:] = values
+            memories.append(memory)
+        return cls(memories[0], memories[1], original.shape, owner=True)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attach to a landscape created by another process
+
+        spec:       The spec() of the landscape
+
+        returns:    The SharedLandscape, read-only
+        """
+        original_name, replenishment_name, shape = spec
+        memories = []
+        for name in (original_name, replenishment_name):
+            memories.append(shared_memory.SharedMemory(name=name))
+        return cls(memories[0], memories[1], shape, owner=False)
+
+    def spec(self):
+        """
+        returns: A picklable tuple for attaching to the landscape
+        """
+        return (self._original_memory.name, self._replenishment_memory.name,
+                self.shape)
+
+    def layer(self):
+        """
+        returns: A new DepletionLayer over the landscape for one run
+        """
+        return DepletionLayer(self)
+
+    def close(self):
+        """
+        Stop using the landscape in this process
+        """
+        self.original = None
+        self.replenishment = None
+        self._original_memory.close()
+        self._replenishment_memory.close()
+
+    def unlink(self):
+        """
+        Close the landscape and free the shared memory. Only called by the
+        process that created it.
+        """
+        self.close()
+        self._original_memory.unlink()
+        self._replenishment_memory.unlink()
+
+class _LayerRow:
+    """
+    One row of a DepletionLayer, so the layer can be indexed as
+    layer[row][column] like the list of lists environment
+    """
+    __slots__ = ("layer", "row")
+
+    def __init__(self, layer, row):
+        self.layer = layer
+        self.row = row
+
+    def __len__(self):
+        return self.layer.shape[1]
+
+    def __getitem__(self, column):
+        return self.layer.get(self.row, column)
+
+    def __setitem__(self, column, value):
+        self.layer.set(self.row, column, value)
+
+class DepletionLayer:
+    """
+    A run's own view of a SharedLandscape. Reads come from the shared
+    original environment unless the run has changed that location, and
+    changes are kept in a dict of the nectar taken from each location.
+    """
+    def __init__(self, landscape):
+        """
+        landscape:  The SharedLandscape to read from
+        """
+        self.landscape = landscape
+        self.original = landscape.original
+        self.replenishment = landscape.replenishment
+        self.shape = landscape.shape
+        # The nectar taken from each changed location. Negative if the
+        # location has grown back past its original value.
+        self.depletion = {}
+        # The changed locations that are still growing back
+        self.growing = set()
+        self.rows = [_LayerRow(self, row) for row in range(self.shape[0])]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def get(self, row, column):
+        """
+        returns: The nectar at a location
+        """
+        return (int(self.original[row, column]) -
+                self.depletion.get((row, column), 0))
+
+    def set(self, row, column, value):
+        """
+        Set the nectar at a location
+        """
+        location = (row, column)
+        depletion = int(self.original[row, column]) - value
+        if depletion == 0:
+            self.depletion.pop(location, None)
+            self.growing.discard(location)
+            return
+        self.depletion[location] = depletion
+        if depletion > 0 and self.replenishment[row, column] > 0:
+            self.growing.add(location)
+        else:
+            self.growing.discard(location)
+
+    def regrow(self):
+        """
+        Grow back the locations that have less nectar than they started
+        with, as Environment.update. Only the changed locations are
+        visited.
+        """
+        for location in list(self.growing):
+            depletion = (self.depletion[location] -
+                         int(self.replenishment[location]))
+            if depletion > 0:
+                self.depletion[location] = depletion
+            else:
+                self.growing.discard(location)
+                if depletion == 0:
+                    del self.depletion[location]
+                else:
+                    self.depletion[location] = depletion
+
+    def to_list(self):
+        """
+        returns: The current environment as a list of lists
+        """
+        current = np.array(self.original)
+        for location in self.depletion:
+            current[location] -= self.depletion[location]
+        return current.tolist()
+
+class LayerEnvironment(varbee.Environment):
+    """
+    The environment object for a run on a DepletionLayer. The original
+    environment and replenishment are the shared ones rather than copies.
+    """
+    def __init__(self, layer):
+        """
+        layer:  The DepletionLayer the run's bees forage on
+        """
+        self.environment = layer
+        self.original_environment = layer.original
+        self.replenishment = layer.replenishment
+
+    def update(self):
+        """
+        Update the environment, growing back the depleted locations
+        """
+        self.environment.regrow()
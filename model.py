@@ -4,12 +4,66 @@ NAME
     model.py - The driver for the VarBee model
 
 SYNOPSIS
-    python3 model.py File [number1] [number2] [number3]
+    python3 model.py File [number1] [number2] [number3] [--seed number4]
+                     [--engine {object,array,jit}] [--event-driven]
+                     [--stop-on-extinction] [--steady-window number5]
+                     [--steady-tolerance number6] [--births number7]
+                     [--replicates number8] [--workers number9] [--batch]
+                     [--domains number10] [--progress-interval number11]
+                     [--metrics File2] [--metrics-interval number12]
+                     [--cache Directory] [--cache-size number13]
+                     [--headless] [--rasters]
+                     [--raster-window number14]... [--database File3]
+                     [--publish Name] [--publish-interval number15]
 
     File: A CSV file containing the environment
     number1: The Number of iterations to run
     number2: The number of bees to start with
     number3: The number of mites to start with
+    number4: The seed for the random number generator
+    --engine: The engine used to run the model. "object" (the default) uses
+              the classes in varbee.py, "array" the array-backed engine in
+              arraybee.py and "jit" the same engine compiled with Numba
+    --event-driven: Park bees flying to a known target and only wake them
+              when they arrive, die or meet waiting mites (object engine)
+    --stop-on-extinction: Stop the run when the bees or mites die out
+    number5: Stop the run when the populations have been steady for this
+             many time-steps (0, the default, to never stop early)
+    number6: How much the populations may vary and still count as steady,
+             as a fraction of their mean (default 0.05)
+    number7: The number of bees born in the hive each time-step (default 1)
+    number8: The number of replicate runs (default 1). Replicates share one
+             read-only copy of the landscape and run in parallel
+    number9: The number of worker processes for the replicates (default
+             the number of CPUs)
+    --batch: Run all the replicates together in one batched simulation
+             rather than in worker processes (array and jit engines)
+    number10: Split the environment into this many domains, each run by its
+             own worker process (array and jit engines, default 1)
+    number11: The least number of seconds between progress updates in the
+             terminal (default 0.5, 0 to update every time-step)
+    File2: A file or FIFO to stream the metrics of the run to, as JSON
+             lines with the step, the bee and mite populations, the bees
+             foraging and searching, the hive store and the step latency
+    number12: The number of time-steps between metrics records (default 1)
+    Directory: A directory to cache the results of runs in. A run that is
+             already in the cache isn't run again.
+    number13: The most megabytes the cache may use (default 500)
+    --headless: Only write the result files, without plotting. matplotlib
+             is never imported, so short runs start faster and nothing
+             waits for a plot window to be closed.
+    --rasters: Also write rasters.npz, with the visits, the visits by bees
+             carrying mites, the waiting mites and the nectar removed in
+             each location (object, array and jit engines)
+    number14: Also keep the rasters for the last this many time-steps.
+             Can be given more than once.
+    File3: An SQLite database to add the parameters, populations and
+             heatmap of each run (or replicate) to, as well as writing the
+             files. See resultstore.py.
+    Name:    Publish the latest bees, mites and environment to a block of
+             shared memory with this name while the run goes on, for
+             viewer.py to watch (object, array and jit engines)
+    number15: The least number of seconds between snapshots (default 0.02)
 
 DESCRIPTION
     The model simulates
@@ -17,16 +71,33 @@ DESCRIPTION
     The number of bees and the number of iterations has a big impact on the
     running time of the model. While the model is running, the progress is
     displayed in the terminal window as a percent the model is complete.
+    If a run stops early, the reason and time-step are printed and written
+    to summary.csv along with the seed.
+
+    With --cache, the results of each run are kept under a hash of the
+    environment, the parameters, the seed and the model's code. Running
+    the same run again copies the results from the cache instead. The
+    least recently used runs are removed when the cache gets too big.
+
+    Runs with the same seed and parameters give the same results. If no
+    seed is given, a random one is chosen and printed so the run can be
+    repeated.
+
+    With more than one replicate, each replicate gets its own seed spawned
+    from the seed given and writes results_<r>.csv, heatmap_<r>.csv and
+    summary_<r>.csv. No plot is shown.
 """
 ###############################################################################
 #                                                                             #
 #  Python library imports                                                     #
 #                                                                             #
 ###############################################################################
+import os
 import sys
 import csv
-import random
-import matplotlib.pyplot as plt
+import time
+import argparse
+import multiprocessing
 import numpy as np
 
 ###############################################################################
@@ -35,6 +106,14 @@ import numpy as np
 #                                                                             #
 ###############################################################################
 import varbee
+import arraybee
+import domainbee
+import landscape
+import monitor
+import rasters
+import runcache
+import resultstore
+import snapshots
 
 ###############################################################################
 #                                                                             #
@@ -47,38 +126,128 @@ NUM_MITES = 40
 NUM_HIVES = 1
 HIVE_LOCATIONS = [(25, 25)] # Just one hive for now
 NUM_ITERATIONS = 100
+ENGINES = ("object", "array", "jit")
+# The rules of the model that model.py doesn't change, which are stored with
+# each run in a database
+BEE_LIFESPAN = 100
+MITE_CAPACITY = 4
+DROP_CHANCE = 2
+# The files a run writes, which are kept in the cache
+RESULT_FILES = ('summary.csv', 'heatmap.csv', 'results.csv')
+RASTERS_FILE = 'rasters.npz'
+# The arguments that change the results of a run
+RESULT_ARGUMENTS = ("num_iterations", "num_bees", "num_mites", "seed",
+                    "engine", "event_driven", "stop_on_extinction",
+                    "steady_window", "steady_tolerance", "births", "domains",
+                    "rasters", "raster_window")
 
 ###############################################################################
 #                                                                             #
-#  Model storage structures                                                   #
+#  Model functions                                                            #
 #                                                                             #
 ###############################################################################
-HIVES = {} #Store hives as a dict so bees can access the obj by location
-BEES = []
-ENVIRONMENT = []
-MITES = []
-bee_count = {}
-mite_pop = []
-bee_pop = []
 
-###############################################################################
-#                                                                             #
-#  Model start                                                                #
-#                                                                             #
-###############################################################################
+def parse_args(argv):
+    '''
+    Command line processing. Numbers that are not positive are ignored and
+    the default is used instead.
 
-#Command line processing
-try:
-    if sys.argv[1]:
-        ENVIRONMENT_FILE = sys.argv[1]
-    if int(sys.argv[2]) > 0:
-        NUM_ITERATIONS = int(sys.argv[2])
-    if int(sys.argv[3]) > 0:
-        NUM_BEES = int(sys.argv[3])
-    if int(sys.argv[4]) > 0:
-        NUM_MITES = int(sys.argv[4])
-except:
-    pass
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the model parameters
+    '''
+    parser = argparse.ArgumentParser(description="The VarBee model")
+    parser.add_argument("environment_file", nargs='?',
+                        default=ENVIRONMENT_FILE,
+                        help="A CSV file containing the environment")
+    parser.add_argument("num_iterations", nargs='?', type=int,
+                        default=NUM_ITERATIONS,
+                        help="The number of iterations to run")
+    parser.add_argument("num_bees", nargs='?', type=int, default=NUM_BEES,
+                        help="The number of bees to start with")
+    parser.add_argument("num_mites", nargs='?', type=int, default=NUM_MITES,
+                        help="The number of mites to start with")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed for the random number generator")
+    parser.add_argument("--engine", choices=ENGINES, default="object",
+                        help="The engine used to run the model")
+    parser.add_argument("--event-driven", action="store_true",
+                        help="Park bees flying to a known target")
+    parser.add_argument("--stop-on-extinction", action="store_true",
+                        help="Stop when the bees or mites die out")
+    parser.add_argument("--steady-window", type=int, default=0,
+                        help="Stop after this many steady time-steps")
+    parser.add_argument("--steady-tolerance", type=float, default=0.05,
+                        help="The relative variation allowed when steady")
+    parser.add_argument("--births", type=int, default=1,
+                        help="The number of bees born each time-step")
+    parser.add_argument("--replicates", type=int, default=1,
+                        help="The number of replicate runs")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes for replicates")
+    parser.add_argument("--batch", action="store_true",
+                        help="Run the replicates in one batched simulation")
+    parser.add_argument("--domains", type=int, default=1,
+                        help="The number of domains to split the run into")
+    parser.add_argument("--progress-interval", type=float, default=0.5,
+                        help="The seconds between progress updates")
+    parser.add_argument("--metrics", default=None,
+                        help="A file or FIFO to stream JSON metrics to")
+    parser.add_argument("--metrics-interval", type=int, default=1,
+                        help="The time-steps between metrics records")
+    parser.add_argument("--cache", default=None,
+                        help="A directory to cache the results of runs in")
+    parser.add_argument("--cache-size", type=float, default=500,
+                        help="The most megabytes the cache may use")
+    parser.add_argument("--headless", action="store_true",
+                        help="Write the result files without plotting")
+    parser.add_argument("--rasters", action="store_true",
+                        help="Also write the rasters to rasters.npz")
+    parser.add_argument("--raster-window", type=int, action="append",
+                        default=[],
+                        help="Keep the rasters for the last time-steps")
+    parser.add_argument("--database", default=None,
+                        help="An SQLite database to add the results to")
+    parser.add_argument("--publish", default=None,
+                        help="Publish snapshots of the run for viewer.py")
+    parser.add_argument("--publish-interval", type=float, default=0.02,
+                        help="The least seconds between snapshots")
+    args = parser.parse_args(argv)
+
+    if args.event_driven and args.engine != "object":
+        parser.error("--event-driven needs the object engine")
+    if args.batch and args.engine == "object":
+        parser.error("--batch needs the array or jit engine")
+    if args.domains > 1 and args.engine == "object":
+        parser.error("--domains needs the array or jit engine")
+    if args.domains > 1 and (args.batch or args.replicates > 1):
+        parser.error("--domains can't be used with replicates")
+    if args.metrics and (args.batch or args.replicates > 1):
+        parser.error("--metrics can't be used with replicates")
+    if args.cache and (args.batch or args.replicates > 1):
+        parser.error("--cache can't be used with replicates")
+    if args.rasters and (args.batch or args.replicates > 1 or
+                         args.domains > 1):
+        parser.error("--rasters can't be used with replicates or domains")
+    if args.raster_window and not args.rasters:
+        parser.error("--raster-window needs --rasters")
+    if args.publish and (args.batch or args.replicates > 1 or
+                         args.domains > 1):
+        parser.error("--publish can't be used with replicates or domains")
+
+    if args.num_iterations <= 0:
+        args.num_iterations = NUM_ITERATIONS
+    if args.num_bees <= 0:
+        args.num_bees = NUM_BEES
+    if args.num_mites <= 0:
+        args.num_mites = NUM_MITES
+    if args.replicates <= 0:
+        args.replicates = 1
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+    return args
 
 # check all rows have same number of columns
 def col_check(input_list):
@@ -108,144 +277,427 @@ def col_count(col):
             count += 1
     return count
 
-# Initialise environment
-with open(ENVIRONMENT_FILE, newline='') as file1:
-    DATASET = csv.reader(file1, quoting=csv.QUOTE_NONNUMERIC)
-    for row in DATASET:
-        rowlist = []
-        for value in row:
-            if value != '':
-                rowlist.append(int(value))
-        ENVIRONMENT.append(rowlist)
-
-if not col_check(ENVIRONMENT):
-    print("The environment file does not have an equal number of columns.\
-          Model run aborted")
-    raise IndexError
-
-# Create the environment object
-environment_object = varbee.Environment(ENVIRONMENT)
-
-# Create the hive(s)
-for j in range(NUM_HIVES):
-    HIVES[HIVE_LOCATIONS[j]] = varbee.Hive(environment=ENVIRONMENT,
-                                           hive_location=HIVE_LOCATIONS[j],
-                                           bees=BEES,
-                                           num_iterations=NUM_ITERATIONS)
-
-# Create Bees
-hivechoice = random.choice([i for i in range(len(HIVES))])
-for j in range(NUM_BEES):
-    BEES.append(varbee.Bee(environment=ENVIRONMENT,
-                hive_location=(25,25), hives=HIVES, bees=BEES, mites=MITES))
-
-# Create mites in random locations
-for i in range(NUM_MITES):
-    randloc = (random.randint(0, len(ENVIRONMENT[0])),
-               random.randint(0, len(ENVIRONMENT)))
-    MITES.append(varbee.Mite(current_position=randloc, environment=ENVIRONMENT,
-                             bees=BEES, mites=MITES))
-
-# Make a blank heat map for all locations
-for i in range(len(ENVIRONMENT[0])):
-    for j in range(len(ENVIRONMENT)):
-        bee_count[(i, j)] = 0
-
-def update():
-
-    # Process mites
-    if MITES:
-        for mite in MITES:
-            mite.update()
-
-    # Move Bees
-    if BEES:
-        for bee in BEES:
-            bee.update()
-
-        # Count the number of bees in the current location and add to a dict
-        for i in range(len(ENVIRONMENT)):
-            for j in range(len(ENVIRONMENT[0])):
-                for bee in BEES:
-                    if tuple(bee.current_position) == (i, j):
-                        bee_count[(i, j)] += 1
-
-    # Hive actions (make more bees)
-    if HIVES:
-        for location in HIVES:
-            HIVES[location].update()
-
-    # Clean up dead insects
-    if BEES:
-        bees_to_remove = []
-        for bee in BEES:
-            if not bee.alive:
-                bees_to_remove.append(bee)
-
-        for i in bees_to_remove:
-            BEES.remove(i)
-
-    # If there are mites, move them
-    if MITES:
-        mites_to_remove = []
-        for mite in MITES:
-            if not mite.alive:
-                mites_to_remove.append(mite)
-
-        for i in mites_to_remove:
-            MITES.remove(i)
-
-    # Update the environment
-    environment_object.update()
-
-
-for i in range(NUM_ITERATIONS):
-    print("Percent completed: ", int((i / NUM_ITERATIONS) * 100.0),
-          "\tNumber of bees remaining = ", len(BEES),
-          "\tNumber of mites remaining = ", len(MITES), "\r",
-          end='', flush=True)
-    update()
-
-    # Log the bee and mite populations
-    bee_pop.append(len(BEES))
-    mite_pop.append(len(MITES))
-
-print()
-
-fig, ax = plt.subplots()
-
-color = 'tab:green'
-ax.plot([i for i in range(len(bee_pop))], bee_pop, color=color)
-ax.tick_params(axis='y', labelcolor=color)
-ax.set_ylabel("Bee population", color=color)
-
-ax2 = ax.twinx()
-
-color = 'tab:red'
-ax2.plot([i for i in range(len(mite_pop))], mite_pop, color=color)
-ax2.tick_params(axis='y', labelcolor=color)
-ax2.set_ylabel("Mite population", color=color)
-
-plt.xlabel("Time-Step")
-plt.title("The Population of Bees and Mites. Timestep = %s" %NUM_ITERATIONS)
-
-plt.show()
-
-# Create a heatmap of the total number of bees in each position on the map
-heat = []
-heat_initial = [i for i in range(len(ENVIRONMENT[0]))]
-for i in range(len(ENVIRONMENT)):
-    heat.append(heat_initial[:])
-for key in bee_count.keys():
-    heat[key[0]][key[1]] = bee_count[key]
-
-with open('heatmap.csv', 'w', newline='') as file2:
-    writer = csv.writer(file2)
-    for row in heat:
-        writer.writerow(row)
-
-with open('results.csv', 'w', newline='') as file3:
-    writer = csv.writer(file3)
-    for i in range(len(bee_pop)):
-        row = [i, bee_pop[i], mite_pop[i]]
-        writer.writerow(row)
+def read_environment(filename):
+    '''
+    Read the environment from a CSV file
+
+    filename:   The name of the CSV file containing the environment
+
+    returns:    A list of lists containing the environment
+    '''
+    environment = []
+    with open(filename, newline='') as file1:
+        dataset = csv.reader(file1, quoting=csv.QUOTE_NONNUMERIC)
+        for row in dataset:
+            rowlist = []
+            for value in row:
+                if value != '':
+                    rowlist.append(int(value))
+            environment.append(rowlist)
+
+    if not col_check(environment):
+        print("The environment file does not have an equal number of columns.\
+              Model run aborted")
+        raise IndexError
+    return environment
+
+def make_simulation(environment, args, shared=None):
+    '''
+    Create the simulation for the engine chosen on the command line
+
+    environment:    A list of lists containing the environment
+    args:           The parsed command line arguments
+    shared:         A landscape.SharedLandscape to run on rather than
+                    environment, or None
+
+    returns:        A simulation with update(), population() and heatmap()
+    '''
+    parameters = dict(num_bees=args.num_bees,
+                      num_mites=args.num_mites,
+                      hive_locations=HIVE_LOCATIONS[:NUM_HIVES],
+                      num_iterations=args.num_iterations,
+                      seed=args.seed,
+                      births_per_step=args.births)
+    if args.rasters:
+        parameters["rasters"] = rasters.Rasters(
+            (len(environment), len(environment[0])), args.raster_window)
+    if args.engine == "object":
+        environment_object = None
+        if shared is not None:
+            environment = shared.layer()
+            environment_object = landscape.LayerEnvironment(environment)
+        return varbee.Simulation(environment, event_driven=args.event_driven,
+                                 environment_object=environment_object,
+                                 **parameters)
+    backend = "numba" if args.engine == "jit" else "python"
+    if args.domains > 1:
+        return domainbee.DomainSimulation(environment, args.domains,
+                                          backend=backend, **parameters)
+    if shared is not None:
+        environment = shared.original
+    return arraybee.ArraySimulation(environment, backend=backend,
+                                    landscape=shared, **parameters)
+
+def make_rules(args):
+    '''
+    Create the stopping rules chosen on the command line
+    '''
+    return varbee.StoppingRules(extinction=args.stop_on_extinction,
+                                window=args.steady_window,
+                                tolerance=args.steady_tolerance)
+
+def run_simulation(simulation, rules, num_iterations, progress=True,
+                   progress_interval=0.5, metrics=None, report=None,
+                   publisher=None):
+    '''
+    Run a simulation until it completes or the stopping rules stop it
+
+    simulation:     The simulation to run
+    rules:          The varbee.StoppingRules for the run
+    num_iterations: The most time-steps to run
+    progress:       True to display the progress in the terminal
+    progress_interval: The least number of seconds between progress updates
+    metrics:        A monitor.MetricsStream to record each step to, or None
+    report:         A function to call with the time-step and the bee and
+                    mite populations instead of displaying the progress
+    publisher:      A snapshots.SnapshotPublisher to publish the state to,
+                    or None
+    '''
+    throttle = monitor.Throttle(progress_interval)
+    for i in range(num_iterations):
+        if progress and throttle.due():
+            num_bees, num_mites = simulation.population()
+            if report is not None:
+                report(i, num_bees, num_mites)
+            else:
+                print("Percent completed: ",
+                      int((i / num_iterations) * 100.0),
+                      "\tNumber of bees remaining = ", num_bees,
+                      "\tNumber of mites remaining = ", num_mites, "\r",
+                      end='', flush=True)
+        start = time.perf_counter()
+        simulation.update()
+        if metrics is not None:
+            metrics.record(simulation, time.perf_counter() - start)
+        if publisher is not None:
+            publisher.publish(simulation)
+        if rules.check(*simulation.population()):
+            break
+
+def show_plot(bee_pop, mite_pop, args):
+    '''
+    Plot the bee and mite populations, unless running headless. The
+    plotting module (and matplotlib) is only imported here.
+    '''
+    if args.headless:
+        return
+    import plotting
+    plotting.plot_populations(bee_pop, mite_pop, len(bee_pop))
+
+def read_results(results_file='results.csv'):
+    '''
+    Read the population time series written by write_results()
+
+    returns:    A tuple of the lists of the bee and mite populations
+    '''
+    bee_pop = []
+    mite_pop = []
+    with open(results_file, newline='') as file3:
+        for row in csv.reader(file3):
+            bee_pop.append(int(row[1]))
+            mite_pop.append(int(row[2]))
+    return bee_pop, mite_pop
+
+def run_key(environment, args):
+    '''
+    The cache key of a run, from the environment, the arguments that change
+    its results and the code of the model, including every module that
+    shapes the files kept in the cache
+    '''
+    parameters = {name: getattr(args, name) for name in RESULT_ARGUMENTS}
+    parameters["hive_locations"] = HIVE_LOCATIONS[:NUM_HIVES]
+    return runcache.make_key(environment, parameters,
+                             (sys.modules[__name__], varbee, arraybee,
+                              domainbee, landscape, rasters))
+
+def write_summary(summary, summary_file='summary.csv'):
+    '''
+    Write a summary of the run, one name and value per row
+    '''
+    with open(summary_file, 'w', newline='') as file4:
+        writer = csv.writer(file4)
+        for name in summary:
+            writer.writerow([name, summary[name]])
+
+def run_parameters(args, seed, replicate=None):
+    '''
+    The parameters of a run, to store in a database
+
+    returns:    A dict of the parameters, by the names in
+                resultstore.PARAMETERS
+    '''
+    return {"environment": args.environment_file,
+            "engine": args.engine,
+            "seed": seed,
+            "num_iterations": args.num_iterations,
+            "num_bees": args.num_bees,
+            "num_mites": args.num_mites,
+            "births": args.births,
+            "bee_lifespan": BEE_LIFESPAN,
+            "mite_capacity": MITE_CAPACITY,
+            "drop_chance": DROP_CHANCE,
+            "event_driven": int(args.event_driven),
+            "domains": args.domains,
+            "replicate": replicate}
+
+def store_runs(database, runs):
+    '''
+    Add runs to a database in one transaction
+
+    database:   The SQLite database file
+    runs:       A list of tuples of the arguments of
+                resultstore.ResultStore.add_run()
+    '''
+    store = resultstore.ResultStore(database)
+    try:
+        store.add_runs(runs)
+    finally:
+        store.close()
+
+def write_results(heat, bee_pop, mite_pop, heatmap_file='heatmap.csv',
+                  results_file='results.csv'):
+    '''
+    Write the heatmap and the population time series to CSV files
+    '''
+    with open(heatmap_file, 'w', newline='') as file2:
+        writer = csv.writer(file2)
+        for row in heat:
+            writer.writerow(row)
+
+    with open(results_file, 'w', newline='') as file3:
+        writer = csv.writer(file3)
+        for i in range(len(bee_pop)):
+            row = [i, bee_pop[i], mite_pop[i]]
+            writer.writerow(row)
+
+###############################################################################
+#                                                                             #
+#  Replicates                                                                 #
+#                                                                             #
+###############################################################################
+
+# The shared landscape attached to by each worker process
+_shared = None
+
+def _attach_landscape(spec):
+    '''
+    Attach a worker process to the shared landscape
+    '''
+    global _shared
+    _shared = landscape.SharedLandscape.attach(spec)
+
+def run_replicate(replicate, seed, args):
+    '''
+    Run one replicate on the shared landscape and write its results
+
+    replicate:  The number of the replicate, used in the file names
+    seed:       The seed for the replicate
+    args:       The parsed command line arguments
+
+    returns:    The replicate number, time-steps run and stop reason
+    '''
+    args = argparse.Namespace(**vars(args))
+    args.seed = seed
+    simulation = make_simulation(None, args, shared=_shared)
+    rules = make_rules(args)
+    run_simulation(simulation, rules, args.num_iterations, progress=False)
+    heat = simulation.heatmap()
+    write_replicate(replicate, seed, args.engine, rules, heat,
+                    simulation.bee_pop, simulation.mite_pop)
+    if args.database:
+        store_runs(args.database, [(run_parameters(args, seed, replicate),
+                                    simulation.bee_pop, simulation.mite_pop,
+                                    heat, rules.stop_reason or "completed")])
+    return replicate, len(simulation.bee_pop), rules.stop_reason or \
+        "completed"
+
+def write_replicate(replicate, seed, engine, rules, heat, bee_pop, mite_pop):
+    '''
+    Write the summary, heatmap and results files of one replicate
+    '''
+    write_summary({"seed": seed,
+                   "engine": engine,
+                   "replicate": replicate,
+                   "time_steps": len(bee_pop),
+                   "stop_reason": rules.stop_reason or "completed"},
+                  "summary_%d.csv" % replicate)
+    write_results(heat, bee_pop, mite_pop, "heatmap_%d.csv" % replicate,
+                  "results_%d.csv" % replicate)
+
+def _run_replicate(task):
+    return run_replicate(*task)
+
+def run_replicates(environment, args):
+    '''
+    Run the replicates in a pool of worker processes that share one
+    read-only copy of the landscape. Each replicate's seed is spawned from
+    the seed on the command line.
+    '''
+    seeds = arraybee.replicate_seeds(args.seed, args.replicates)
+    tasks = [(replicate, seeds[replicate], args)
+             for replicate in range(args.replicates)]
+    shared = landscape.SharedLandscape.create(environment)
+    try:
+        workers = min(args.workers, args.replicates)
+        with multiprocessing.Pool(workers, initializer=_attach_landscape,
+                                  initargs=(shared.spec(),)) as pool:
+            done = 0
+            for replicate, time_steps, stop_reason in \
+                    pool.imap_unordered(_run_replicate, tasks):
+                done += 1
+                print("Replicate", replicate, "finished after", time_steps,
+                      "time-steps -", stop_reason,
+                      "(%d of %d)" % (done, args.replicates))
+    finally:
+        shared.unlink()
+
+def run_batch(environment, args):
+    '''
+    Run the replicates together in one arraybee.BatchSimulation. Each
+    replicate has its own stopping rules, and the batch stops when every
+    replicate has stopped. The results are then split out by replicate.
+    '''
+    backend = "numba" if args.engine == "jit" else "python"
+    batch = arraybee.BatchSimulation(environment, args.replicates,
+                                     num_bees=args.num_bees,
+                                     num_mites=args.num_mites,
+                                     hive_locations=HIVE_LOCATIONS[:NUM_HIVES],
+                                     num_iterations=args.num_iterations,
+                                     seed=args.seed, backend=backend,
+                                     births_per_step=args.births)
+    rules = [make_rules(args) for replicate in range(args.replicates)]
+    running = set(range(args.replicates))
+    # The heatmaps of the replicates that have stopped, as they were when
+    # they stopped. The batch goes on moving their bees.
+    stopped_heat = {}
+    throttle = monitor.Throttle(args.progress_interval)
+    for i in range(args.num_iterations):
+        if throttle.due():
+            print("Percent completed: ",
+                  int((i / args.num_iterations) * 100.0),
+                  "\tReplicates running = ", len(running), "\r",
+                  end='', flush=True)
+        batch.update()
+        num_bees, num_mites = batch.population()
+        for replicate in sorted(running):
+            if rules[replicate].check(int(num_bees[replicate]),
+                                      int(num_mites[replicate])):
+                running.discard(replicate)
+                stopped_heat[replicate] = batch.heat[replicate].tolist()
+        if not running:
+            break
+    print()
+
+    runs = []
+    for replicate in range(args.replicates):
+        heat, bee_pop, mite_pop = batch.replicate(replicate)
+        # A replicate that stopped early keeps its results up to the stop
+        time_steps = rules[replicate].stop_step or len(bee_pop)
+        heat = stopped_heat.get(replicate, heat)
+        write_replicate(replicate, batch.seeds[replicate], args.engine,
+                        rules[replicate], heat, bee_pop[:time_steps],
+                        mite_pop[:time_steps])
+        runs.append((run_parameters(args, batch.seeds[replicate], replicate),
+                     bee_pop[:time_steps], mite_pop[:time_steps], heat,
+                     rules[replicate].stop_reason or "completed"))
+    if args.database:
+        store_runs(args.database, runs)
+
+###############################################################################
+#                                                                             #
+#  Model start                                                                #
+#                                                                             #
+###############################################################################
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    print("Random seed = ", args.seed)
+
+    # Initialise environment
+    environment = read_environment(args.environment_file)
+
+    if args.batch:
+        run_batch(environment, args)
+        return
+    if args.replicates > 1:
+        run_replicates(environment, args)
+        return
+
+    result_files = RESULT_FILES + ((RASTERS_FILE,) if args.rasters else ())
+    cache = None
+    if args.cache:
+        cache = runcache.ResultCache(args.cache,
+                                     int(args.cache_size * 2**20))
+        key = run_key(environment, args)
+        # A run streaming metrics or snapshots is run again so it can be
+        # watched, and one adding to a database so its results are added
+        if not args.metrics and not args.publish and not args.database \
+                and cache.fetch(key, result_files):
+            print("The results of this run were found in the cache")
+            bee_pop, mite_pop = read_results()
+            show_plot(bee_pop, mite_pop, args)
+            return
+
+    simulation = make_simulation(environment, args)
+    rules = make_rules(args)
+    metrics = None
+    publisher = None
+    try:
+        if args.metrics:
+            metrics = monitor.MetricsStream(args.metrics,
+                                            args.metrics_interval)
+        if args.publish:
+            publisher = snapshots.SnapshotPublisher(
+                args.publish, (len(environment), len(environment[0])),
+                args.num_iterations, args.publish_interval)
+            print("Publishing snapshots to", args.publish)
+            publisher.publish(simulation, force=True)
+        run_simulation(simulation, rules, args.num_iterations,
+                       progress_interval=args.progress_interval,
+                       metrics=metrics, publisher=publisher)
+        heat = simulation.heatmap()
+    finally:
+        if metrics is not None:
+            metrics.close()
+        if publisher is not None:
+            publisher.close(simulation)
+        if args.domains > 1:
+            simulation.close()
+
+    print()
+    if rules.stop_reason:
+        print("Stopped early at time-step", rules.stop_step, "-",
+              rules.stop_reason)
+
+    write_summary({"seed": args.seed,
+                   "engine": args.engine,
+                   "time_steps": len(simulation.bee_pop),
+                   "stop_reason": rules.stop_reason or "completed"})
+
+    show_plot(simulation.bee_pop, simulation.mite_pop, args)
+
+    # Create a heatmap of the total number of bees in each position on the map
+    write_results(heat, simulation.bee_pop, simulation.mite_pop)
+    if args.rasters:
+        simulation.rasters.save(RASTERS_FILE)
+    if args.database:
+        store_runs(args.database, [(run_parameters(args, args.seed),
+                                    simulation.bee_pop, simulation.mite_pop,
+                                    heat, rules.stop_reason or "completed")])
+    if cache is not None:
+        cache.store(key, result_files)
+
+if __name__ == "__main__":
+    main()
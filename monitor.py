@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# monitor.py - progress output and a metrics stream for model runs
+"""
+monitor.py
+
+Classes for watching a model run without slowing it down. The classes
+contained are as follows:
+
+    - Throttle
+    - MetricsStream
+
+A Throttle limits how often the progress line is printed, and a
+MetricsStream writes one JSON object per line to a file or FIFO, e.g.:
+
+    {"step": 10, "bees": 50, "mites": 154, "foraging": 31, "searching": 19,
+     "hive_store": 2210, "latency": 0.0021}
+
+latency is the mean time in seconds the simulation took to update over the
+steps since the last record.
+"""
+import json
+import time
+
+class Throttle:
+    """
+    Says when something that should only happen every so often is due
+    """
+    def __init__(self, interval=0.5):
+        """
+        interval:   The least number of seconds between each time it is
+                    due. 0 for it to always be due.
+        """
+        self.interval = interval
+        self.last = None
+
+    def due(self):
+        """
+        returns: True the first time, and then if at least interval seconds
+                 have passed since it was last due
+        """
+        now = time.monotonic()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            return True
+        return False
+
+class MetricsStream:
+    """
+    Writes the metrics of a run as JSON lines every few time-steps
+    """
+    def __init__(self, filename, interval=1):
+        """
+        filename:   The file or FIFO to write to. Opening a FIFO waits for
+                    a reader.
+        interval:   The number of time-steps between each record
+        """
+        self.filename = filename
+        self.file = open(filename, 'w', buffering=1)
+        self.interval = max(interval, 1)
+        self.steps = 0
+        self.latency = 0.0
+
+    def record(self, simulation, latency):
+        """
+        Record a time-step of a simulation, writing a line if one is due
+
+        simulation: The simulation, with population() and metrics()
+        latency:    The time the step took in seconds
+        """
+        self.steps += 1
+        self.latency += latency
+        if self.file is None or self.steps % self.interval:
+            return
+        num_bees, num_mites = simulation.population()
+        record = {"step": simulation.timestep,
+                  "bees": num_bees,
+                  "mites": num_mites}
+        record.update(simulation.metrics())
+        record["latency"] = self.latency / self.interval
+        self.latency = 0.0
+        try:
+            self.file.write(json.dumps(record) + "\n")
+        except BrokenPipeError:
+            # The reader has gone, so stop streaming rather than stop the run
+            print("\nThe metrics reader closed", self.filename,
+                  "- no more metrics will be written")
+            self.close()
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+        except BrokenPipeError:
+            pass
+        self.file = None
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+NAME
+    plotting.py - Plots of the results of the VarBee model
+
+SYNOPSIS
+    python3 plotting.py [File]
+
+    File: The results file of a run (default results.csv)
+
+DESCRIPTION
+    Plots the bee and mite populations of a run against the time-step.
+    model.py only imports this module when it shows a plot, so headless
+    runs never import matplotlib. The results of a headless run can be
+    plotted afterwards by running this file.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import sys
+import matplotlib.pyplot as plt
+
+###############################################################################
+#                                                                             #
+#  Plotting functions                                                         #
+#                                                                             #
+###############################################################################
+
+def plot_populations(bee_pop, mite_pop, num_iterations):
+    '''
+    Plot the bee and mite populations against the time-step
+    '''
+    fig, ax = plt.subplots()
+
+    color = 'tab:green'
+    ax.plot([i for i in range(len(bee_pop))], bee_pop, color=color)
+    ax.tick_params(axis='y', labelcolor=color)
+    ax.set_ylabel("Bee population", color=color)
+
+    ax2 = ax.twinx()
+
+    color = 'tab:red'
+    ax2.plot([i for i in range(len(mite_pop))], mite_pop, color=color)
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.set_ylabel("Mite population", color=color)
+
+    plt.xlabel("Time-Step")
+    plt.title("The Population of Bees and Mites. Timestep = %s" %num_iterations)
+
+    plt.show()
+
+if __name__ == "__main__":
+    import model
+    results_file = sys.argv[1] if len(sys.argv) > 1 else 'results.csv'
+    bee_pop, mite_pop = model.read_results(results_file)
+    plot_populations(bee_pop, mite_pop, len(bee_pop))
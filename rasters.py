@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# rasters.py - spatial layers accumulated during a model run
+"""
+rasters.py
+
+Spatial layers, or rasters, of what happens in each location during a model
+run. The classes contained are as follows:
+
+    - Rasters
+
+The layers are:
+
+    visits:             Bee visits, as the heatmap
+    carrier_visits:     Visits by bees carrying at least one mite
+    waiting_mites:      Mites waiting for a host, counted every time-step
+    nectar_removed:     Nectar taken from the flowers by foraging bees
+
+Each layer is kept for the whole run and, optionally, for rolling windows of
+the last few time-steps. Only the locations where something happened in a
+time-step are changed, so keeping the layers costs about the same as the
+heatmap, and a window costs the same again. The layers are saved to a
+compressed numpy .npz file, in the smallest integer type that holds them.
+"""
+import collections
+import numpy as np
+
+LAYERS = ("visits", "carrier_visits", "waiting_mites", "nectar_removed")
+
+class Rasters:
+    """
+    The layers of a run, indexed [x][y] in the same way as the heatmap
+    """
+    def __init__(self, shape, windows=()):
+        """
+        shape:      The shape of the heatmap of the run
+        windows:    The lengths, in time-steps, of the rolling windows to
+                    keep the layers for as well as the whole run
+        """
+        self.shape = tuple(shape)
+        self.size = self.shape[0] * self.shape[1]
+        self.totals = np.zeros(len(LAYERS) * self.size, dtype=np.int64)
+        self.windows = sorted(set(window for window in windows if window > 0))
+        self.recent = {window: np.zeros_like(self.totals)
+                       for window in self.windows}
+        # The changes made in each of the last time-steps, kept to take them
+        # out of the windows again
+        self.history = collections.deque()
+        self.changes = []
+        self.pending_cells = []
+        self.pending_amounts = []
+        self.time_steps = 0
+
+    def add(self, layer, x, y, amounts=1):
+        """
+        Add to a layer in the current time-step
+
+        layer:      The name of the layer
+        x, y:       The coordinates of the locations, as sequences
+        amounts:    The amount to add at each location, or one amount for
+                    them all
+        """
+        x = np.asarray(x, dtype=np.int64)
+        if not x.size:
+            return
+        cells = LAYERS.index(layer) * self.size + x * self.shape[1] + \
+            np.asarray(y, dtype=np.int64)
+        self.pending_cells.append(cells)
+        self.pending_amounts.append(np.broadcast_to(
+            np.asarray(amounts, dtype=np.int64), cells.shape))
+
+    def flush(self):
+        """
+        Add the changes made so far in the current time-step to the layers
+        """
+        if not self.pending_cells:
+            return
+        cells = np.concatenate(self.pending_cells)
+        amounts = np.concatenate(self.pending_amounts)
+        self.pending_cells = []
+        self.pending_amounts = []
+        np.add.at(self.totals, cells, amounts)
+        for window in self.windows:
+            np.add.at(self.recent[window], cells, amounts)
+        if self.windows:
+            self.changes.append((cells, amounts))
+
+    def end_step(self):
+        """
+        Finish the current time-step, adding its changes to the layers and
+        taking the changes that have left each window out of it
+        """
+        self.flush()
+        self.time_steps += 1
+        if not self.windows:
+            return
+        self.history.append(self.changes)
+        self.changes = []
+        for window in self.windows:
+            if len(self.history) > window:
+                for cells, amounts in self.history[-window - 1]:
+                    np.subtract.at(self.recent[window], cells, amounts)
+        if len(self.history) > self.windows[-1]:
+            self.history.popleft()
+
+    def layer(self, name, window=None):
+        """
+        A layer as an array
+
+        name:       The name of the layer
+        window:     The window to return it for, or None for the whole run
+
+        returns:    An array of the shape of the heatmap
+        """
+        values = self.totals if window is None else self.recent[window]
+        start = LAYERS.index(name) * self.size
+        return values[start:start + self.size].reshape(self.shape)
+
+    def save(self, filename='rasters.npz'):
+        """
+        Save the layers to a compressed .npz file. The layers for the whole
+        run are named as in LAYERS, and those for a window as, e.g.,
+        visits_last_500.
+        """
+        self.flush()
+        arrays = {"time_steps": np.array(self.time_steps),
+                  "windows": np.array(self.windows, dtype=np.int64)}
+        for name in LAYERS:
+            arrays[name] = self.layer(name)
+            for window in self.windows:
+                arrays["%s_last_%d" % (name, window)] = self.layer(name,
+                                                                   window)
+        for name in arrays:
+            if arrays[name].size:
+                arrays[name] = arrays[name].astype(
+                    np.min_scalar_type(int(arrays[name].max())))
+        np.savez_compressed(filename, **arrays)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# resultstore.py - an SQLite database of the results of model runs
+"""
+resultstore.py
+
+A database of the results of many model runs, so that sweeps and ensembles
+can be compared with SQL rather than by reading a CSV file for each run.
+The classes contained are as follows:
+
+    - ResultStore
+
+The database has three tables:
+
+    runs:           One row for each run, with its parameters (as in
+                    PARAMETERS, each indexed) and outcome: time_steps,
+                    stop_reason, final_bees and final_mites
+    populations:    The bee and mite populations of each run at each step
+    heatmaps:       The heatmap of each run, as little-endian 32 bit
+                    integers, row by row
+
+e.g. the mean final number of mites for each bee lifespan:
+
+    SELECT bee_lifespan, AVG(final_mites) FROM runs GROUP BY bee_lifespan
+
+Running this file prints the result of a query as CSV, or the number of
+runs for each engine if no query is given:
+
+    python3 resultstore.py File [Query]
+
+    File: The SQLite file of the runs, which must exist
+    Query: An SQL query
+
+Several processes can add runs at the same time. Each waits for the others
+to finish writing.
+"""
+import os
+import sys
+import csv
+import sqlite3
+import argparse
+import numpy as np
+
+# The parameters of a run, each a column of the runs table
+PARAMETERS = ("environment", "engine", "seed", "num_iterations", "num_bees",
+              "num_mites", "births", "bee_lifespan", "mite_capacity",
+              "drop_chance", "event_driven", "domains", "replicate")
+OUTCOMES = ("time_steps", "stop_reason", "final_bees", "final_mites")
+# The query run when none is given
+SUMMARY_QUERY = "SELECT engine, COUNT(*) AS runs FROM runs GROUP BY engine"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    environment TEXT,
+    engine TEXT,
+    seed INTEGER,
+    num_iterations INTEGER,
+    num_bees INTEGER,
+    num_mites INTEGER,
+    births INTEGER,
+    bee_lifespan INTEGER,
+    mite_capacity REAL,
+    drop_chance REAL,
+    event_driven INTEGER,
+    domains INTEGER,
+    replicate INTEGER,
+    time_steps INTEGER,
+    stop_reason TEXT,
+    final_bees INTEGER,
+    final_mites INTEGER,
+    created TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS populations (
+    run INTEGER REFERENCES runs(id),
+    step INTEGER,
+    bees INTEGER,
+    mites INTEGER,
+    PRIMARY KEY (run, step)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS heatmaps (
+    run INTEGER PRIMARY KEY REFERENCES runs(id),
+    num_rows INTEGER,
+    num_columns INTEGER,
+    visits BLOB
+);
+""" + "".join("CREATE INDEX IF NOT EXISTS runs_%s ON runs(%s);\n" % (name, name)
+              for name in PARAMETERS)
+
+class ResultStore:
+    """
+    The results of model runs, kept in an SQLite database file
+    """
+    def __init__(self, filename, timeout=60):
+        """
+        filename:   The database file, which is created if it doesn't exist
+        timeout:    The most seconds to wait for another process writing
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=timeout)
+        # Readers don't block writers, or writers readers
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def add_run(self, parameters, bee_pop, mite_pop, heat,
+                stop_reason="completed"):
+        """
+        Add one run
+
+        parameters: A dict of the parameters of the run, by the names in
+                    PARAMETERS. Any left out are stored as NULL.
+        bee_pop:    The bee population at each time-step
+        mite_pop:   The mite population at each time-step
+        heat:       The heatmap, as a list of lists or an array
+        stop_reason: Why the run stopped
+
+        returns:    The id of the run
+        """
+        return self.add_runs([(parameters, bee_pop, mite_pop, heat,
+                               stop_reason)])[0]
+
+    def add_runs(self, runs):
+        """
+        Add many runs in one transaction
+
+        runs:       A list of tuples of the arguments of add_run()
+
+        returns:    A list of the ids of the runs
+        """
+        columns = PARAMETERS + OUTCOMES
+        insert = "INSERT INTO runs (%s) VALUES (%s)" % (
+            ", ".join(columns), ", ".join("?" * len(columns)))
+        ids = []
+        with self.connection:
+            for parameters, bee_pop, mite_pop, heat, stop_reason in runs:
+                values = [parameters.get(name) for name in PARAMETERS]
+                values += [len(bee_pop), stop_reason,
+                           int(bee_pop[-1]) if len(bee_pop) else None,
+                           int(mite_pop[-1]) if len(mite_pop) else None]
+                run = self.connection.execute(insert, values).lastrowid
+                self.connection.executemany(
+                    "INSERT INTO populations VALUES (?, ?, ?, ?)",
+                    ((run, step, int(bees), int(mites)) for step, (bees, mites)
+                     in enumerate(zip(bee_pop, mite_pop))))
+                heat = np.asarray(heat, dtype='<i4')
+                self.connection.execute(
+                    "INSERT INTO heatmaps VALUES (?, ?, ?, ?)",
+                    (run, heat.shape[0], heat.shape[1], heat.tobytes()))
+                ids.append(run)
+        return ids
+
+    def query(self, sql, parameters=()):
+        """
+        Run an SQL query
+
+        returns:    A tuple of the column names and a list of the rows
+        """
+        cursor = self.connection.execute(sql, parameters)
+        names = [column[0] for column in cursor.description or ()]
+        return names, cursor.fetchall()
+
+    def populations(self, run):
+        """
+        returns:    A tuple of the lists of the bee and mite populations of
+                    a run
+        """
+        rows = self.connection.execute(
+            "SELECT bees, mites FROM populations WHERE run = ? ORDER BY step",
+            (run,)).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def heatmap(self, run):
+        """
+        returns:    The heatmap of a run as an array
+        """
+        num_rows, num_columns, visits = self.connection.execute(
+            "SELECT num_rows, num_columns, visits FROM heatmaps WHERE run = ?",
+            (run,)).fetchone()
+        return np.frombuffer(visits, dtype='<i4').reshape(num_rows,
+                                                          num_columns)
+
+    def close(self):
+        self.connection.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the result of a query of a database of runs as "
+                    "CSV")
+    parser.add_argument("database", help="The SQLite file of the runs")
+    parser.add_argument("sql", nargs='?', default=SUMMARY_QUERY,
+                        help="The query, by default the number of runs for "
+                             "each engine")
+    args = parser.parse_args(argv)
+    # A query shouldn't leave an empty database behind
+    if not os.path.exists(args.database):
+        parser.error("There is no database %s" % args.database)
+    store = ResultStore(args.database)
+    names, rows = store.query(args.sql)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(names)
+    writer.writerows(rows)
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# runcache.py - a cache of the results of model runs
+"""
+runcache.py
+
+A cache of the output files of model runs, so a run that has already been
+made doesn't have to be made again. The classes and functions contained are
+as follows:
+
+    - ResultCache
+    - make_key
+
+Each run is stored under a key that is a hash of everything its results
+depend on: the environment, the parameters (including the seed) and the
+source code of the model. Changing any of them gives a new key, so stale
+results are never returned. The cache is kept within a size limit by
+removing the least recently used runs.
+"""
+import os
+import json
+import shutil
+import hashlib
+
+def make_key(environment, parameters, modules):
+    """
+    Make the cache key of a run
+
+    environment:    A list of lists containing the environment
+    parameters:     A dict of the parameters the results depend on
+    modules:        The modules whose source code the results depend on
+
+    returns:        The key, a string of hex digits
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(environment).encode())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    for module in modules:
+        with open(module.__file__, 'rb') as file1:
+            digest.update(file1.read())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    The output files of model runs, stored in a directory with one
+    directory per run
+    """
+    def __init__(self, directory, max_bytes=500 * 2**20):
+        """
+        directory:  The directory to keep the cache in
+        max_bytes:  The most space the cached files may take up
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def fetch(self, key, filenames, destination='.'):
+        """
+        Copy the files of a cached run to a directory
+
+        key:            The key of the run
+        filenames:      The names of the files to copy
+        destination:    The directory to copy them to
+
+        returns:        True if the run was cached, False otherwise
+        """
+        entry = os.path.join(self.directory, key)
+        for filename in filenames:
+            if not os.path.isfile(os.path.join(entry, filename)):
+                return False
+        for filename in filenames:
+            shutil.copyfile(os.path.join(entry, filename),
+                            os.path.join(destination, filename))
+        # Mark the run as recently used
+        os.utime(entry)
+        return True
+
+    def store(self, key, filenames, source='.'):
+        """
+        Store the files of a run, then remove the least recently used runs
+        until the cache is within its size limit
+
+        key:        The key of the run
+        filenames:  The names of the files to store
+        source:     The directory the files are in
+        """
+        size = sum(os.path.getsize(os.path.join(source, filename))
+                   for filename in filenames)
+        if size > self.max_bytes:
+            print("The results are bigger than the cache, not caching them")
+            return
+        entry = os.path.join(self.directory, key)
+        # Copy the files somewhere else first, so an entry is never seen
+        # half written
+        temporary = "%s.%d.tmp" % (entry, os.getpid())
+        os.makedirs(temporary, exist_ok=True)
+        for filename in filenames:
+            shutil.copyfile(os.path.join(source, filename),
+                            os.path.join(temporary, filename))
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # Another run stored the same results first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used runs until the cache is within its
+        size limit
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, filename))
+                       for filename in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            used, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+NAME
+    sensitivity.py - Global sensitivity analysis of the VarBee model
+
+SYNOPSIS
+    python3 sensitivity.py File [number1] [--samples number2]
+                           [--tolerance number3] [--max-runs number4]
+                           [--sampler {lhs,sobol}] [--replicates number5]
+                           [--workers number6] [--seed number7]
+                           [--engine {array,jit}]
+                           [--range name low high]...
+                           [--database File2]
+
+    File: A CSV file containing the environment
+    number1: The number of iterations of each model run (default 300)
+    number2: The number of samples to start with (default 16)
+    number3: The widest the 95% confidence interval of any sensitivity
+             index may be (default 0.1)
+    number4: The most model runs to make (default 5000). It must allow two
+             samples, i.e. at least 2 x (parameters + 2) x number5 runs.
+    --sampler: Latin hypercube ("lhs", the default) or Sobol sequence
+             ("sobol", which needs scipy) sampling
+    number5: The number of replicate runs averaged for each sample
+             (default 1)
+    number6: The number of worker processes (default the number of CPUs)
+    number7: The seed for the samples and model runs
+    --engine: The array engine uncompiled ("array") or compiled with Numba
+             ("jit")
+    --range: The range of a parameter, e.g. --range bee_lifespan 80 120
+    File2: An SQLite database to add every model run to (see
+             resultstore.py)
+
+DESCRIPTION
+    Estimates the first order and total Sobol sensitivity indices of the
+    bee population, mite population and mites per bee (the means over the
+    last quarter of each run) to these parameters:
+
+        bee_lifespan:   The lifespan of a new bee
+        mite_capacity:  The number of mites each bee can support, which sets
+                        the odds of a mite reproducing
+        drop_chance:    The chance (out of 101) of a mite dropping off its
+                        bee each time-step
+        num_bees:       The number of bees to start with
+        num_mites:      The number of mites to start with
+
+    The parameters are sampled with Saltelli's scheme: each sample is two
+    points A and B, with a model run at A, at B, and at A with each
+    parameter in turn taken from B. The runs of a sample share a seed so
+    the model's own randomness cancels out of the differences.
+
+    Samples are added, doubling each round, until the bootstrap 95%
+    confidence interval of every index is narrower than the tolerance.
+    The indices are printed each round and written to sensitivity.csv.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import os
+import sys
+import csv
+import argparse
+import multiprocessing
+import numpy as np
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+import arraybee
+import landscape
+
+###############################################################################
+#                                                                             #
+#  Analysis parameters                                                        #
+#                                                                             #
+###############################################################################
+# The default range of each parameter, and whether it is a whole number
+PARAMETERS = {"bee_lifespan": (50, 150, True),
+              "mite_capacity": (1.0, 8.0, False),
+              "drop_chance": (0.0, 10.0, False),
+              "num_bees": (10, 100, True),
+              "num_mites": (10, 100, True)}
+OUTPUTS = ("bees", "mites", "mites_per_bee")
+NUM_ITERATIONS = 300
+NUM_SAMPLES = 16
+TOLERANCE = 0.1
+MAX_RUNS = 5000
+BOOTSTRAP_RESAMPLES = 500
+
+###############################################################################
+#                                                                             #
+#  Sampling                                                                   #
+#                                                                             #
+###############################################################################
+
+def latin_hypercube(num_points, dimensions, rng):
+    '''
+    Latin hypercube sample of the unit cube
+
+    returns:    An array of num_points points, one per row
+    '''
+    points = (rng.random((num_points, dimensions)) +
+              np.arange(num_points)[:, np.newaxis]) / num_points
+    for column in range(dimensions):
+        points[:, column] = points[rng.permutation(num_points), column]
+    return points
+
+def make_sampler(name, dimensions, rng):
+    '''
+    Create a function that samples points from the unit cube. Falls back to
+    Latin hypercube sampling if scipy isn't installed for Sobol sampling.
+
+    name:       "lhs" or "sobol"
+    dimensions: The number of dimensions of the cube
+    rng:        The numpy Generator to sample with
+
+    returns:    A function taking the number of points to sample
+    '''
+    if name == "sobol":
+        if qmc is not None:
+            sobol = qmc.Sobol(dimensions, scramble=True, seed=rng)
+            return sobol.random
+        print("scipy is not installed, using Latin hypercube sampling")
+    return lambda num_points: latin_hypercube(num_points, dimensions, rng)
+
+def scale(points, ranges):
+    '''
+    Scale points in the unit cube to parameter values
+
+    points:     An array of points, one per row
+    ranges:     A dict of the (low, high, whole number) range of each
+                parameter, in the order of the columns
+
+    returns:    A list of a dict of parameter values for each point
+    '''
+    samples = []
+    for point in points:
+        values = {}
+        for value, name in zip(point, ranges):
+            low, high, whole = ranges[name]
+            if whole:
+                values[name] = int(low + value * (high - low + 1))
+                values[name] = min(values[name], high)
+            else:
+                values[name] = low + value * (high - low)
+        samples.append(values)
+    return samples
+
+###############################################################################
+#                                                                             #
+#  Model runs                                                                 #
+#                                                                             #
+###############################################################################
+
+# The shared landscape attached to by each worker process
+_shared = None
+
+def _attach_landscape(spec):
+    '''
+    Attach a worker process to the shared landscape
+    '''
+    global _shared
+    _shared = landscape.SharedLandscape.attach(spec)
+
+def run_model(values, seed, num_iterations, replicates=1, backend="python",
+              database=None, environment_file=None):
+    '''
+    Run the model with a set of parameter values on the shared landscape
+
+    values:         A dict of parameter values
+    seed:           The seed for the runs
+    num_iterations: The number of iterations to run
+    replicates:     The number of runs to average
+    backend:        The arraybee backend
+    database:       An SQLite database to add the runs to, or None
+    environment_file: The environment file, stored with the runs
+
+    returns:        The mean over the replicates of each output, the means
+                    over the last quarter of the run
+    '''
+    outputs = np.zeros(len(OUTPUTS))
+    runs = []
+    for replicate, replicate_seed in enumerate(
+            arraybee.replicate_seeds(seed, replicates)):
+        simulation = arraybee.ArraySimulation(
+            _shared.original, num_iterations=num_iterations,
+            seed=replicate_seed, backend=backend, landscape=_shared,
+            hive_locations=model.HIVE_LOCATIONS[:model.NUM_HIVES],
+            **values)
+        for i in range(num_iterations):
+            simulation.update()
+        tail = max(num_iterations // 4, 1)
+        bees = np.mean(simulation.bee_pop[-tail:])
+        mites = np.mean(simulation.mite_pop[-tail:])
+        outputs += (bees, mites, mites / max(bees, 1))
+        if database:
+            parameters = {"environment": environment_file,
+                          "engine": "jit" if backend == "numba" else "array",
+                          "seed": replicate_seed,
+                          "num_iterations": num_iterations,
+                          "births": simulation.births_per_step,
+                          "event_driven": 0,
+                          "domains": 1,
+                          "replicate": replicate}
+            parameters.update(values)
+            runs.append((parameters, simulation.bee_pop, simulation.mite_pop,
+                         simulation.heat, "completed"))
+    if runs:
+        model.store_runs(database, runs)
+    return outputs / replicates
+
+def _run_model(task):
+    return run_model(*task)
+
+###############################################################################
+#                                                                             #
+#  Sensitivity indices                                                        #
+#                                                                             #
+###############################################################################
+
+def sobol_indices(f_a, f_b, f_ab):
+    '''
+    Estimate the first order (Saltelli 2010) and total (Jansen) Sobol
+    indices from the model outputs of Saltelli's scheme
+
+    f_a, f_b:   The outputs at the A and B points, one per sample
+    f_ab:       The outputs with each parameter taken from B, one row per
+                sample and one column per parameter
+
+    returns:    Arrays of the first order and total index of each parameter
+    '''
+    variance = np.var(np.concatenate((f_a, f_b)))
+    if variance == 0:
+        return np.zeros(f_ab.shape[1]), np.zeros(f_ab.shape[1])
+    first = np.mean(f_b[:, np.newaxis] * (f_ab - f_a[:, np.newaxis]),
+                    axis=0) / variance
+    total = 0.5 * np.mean((f_a[:, np.newaxis] - f_ab)**2, axis=0) / variance
+    return first, total
+
+def bootstrap_intervals(f_a, f_b, f_ab, rng,
+                        resamples=BOOTSTRAP_RESAMPLES):
+    '''
+    Bootstrap 95% confidence intervals of the Sobol indices, resampling the
+    samples
+
+    returns:    Arrays of the low and high ends of the intervals of the
+                first order and total indices, in that order
+    '''
+    num_samples = len(f_a)
+    first = np.zeros((resamples, f_ab.shape[1]))
+    total = np.zeros((resamples, f_ab.shape[1]))
+    for resample in range(resamples):
+        chosen = rng.integers(0, num_samples, size=num_samples)
+        first[resample], total[resample] = sobol_indices(
+            f_a[chosen], f_b[chosen], f_ab[chosen])
+    return (np.percentile(first, 2.5, axis=0),
+            np.percentile(first, 97.5, axis=0),
+            np.percentile(total, 2.5, axis=0),
+            np.percentile(total, 97.5, axis=0))
+
+###############################################################################
+#                                                                             #
+#  Driver                                                                     #
+#                                                                             #
+###############################################################################
+
+def parse_args(argv):
+    '''
+    Command line processing
+
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the analysis parameters
+    '''
+    parser = argparse.ArgumentParser(
+        description="Global sensitivity analysis of the VarBee model")
+    parser.add_argument("environment_file", nargs='?',
+                        default=model.ENVIRONMENT_FILE,
+                        help="A CSV file containing the environment")
+    parser.add_argument("num_iterations", nargs='?', type=int,
+                        default=NUM_ITERATIONS,
+                        help="The number of iterations of each run")
+    parser.add_argument("--samples", type=int, default=NUM_SAMPLES,
+                        help="The number of samples to start with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="The widest confidence interval allowed")
+    parser.add_argument("--max-runs", type=int, default=MAX_RUNS,
+                        help="The most model runs to make")
+    parser.add_argument("--sampler", choices=("lhs", "sobol"), default="lhs",
+                        help="The sampling method")
+    parser.add_argument("--replicates", type=int, default=1,
+                        help="The runs averaged for each sample")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed for the samples and runs")
+    parser.add_argument("--engine", choices=("array", "jit"), default="array",
+                        help="The engine used to run the model")
+    parser.add_argument("--range", nargs=3, action="append", default=[],
+                        metavar=("NAME", "LOW", "HIGH"),
+                        help="The range of a parameter")
+    parser.add_argument("--database", default=None,
+                        help="An SQLite database to add the runs to")
+    args = parser.parse_args(argv)
+
+    args.ranges = dict(PARAMETERS)
+    for name, low, high in args.range:
+        if name not in PARAMETERS:
+            parser.error("Unknown parameter %s, use one of %s"
+                         % (name, ", ".join(PARAMETERS)))
+        whole = PARAMETERS[name][2]
+        convert = int if whole else float
+        args.ranges[name] = (convert(low), convert(high), whole)
+    if args.num_iterations <= 0:
+        args.num_iterations = NUM_ITERATIONS
+    if args.samples <= 1:
+        args.samples = NUM_SAMPLES
+    if args.replicates <= 0:
+        args.replicates = 1
+    # The indices need at least two samples, each run dimensions + 2 times
+    min_runs = 2 * (len(args.ranges) + 2) * args.replicates
+    if args.max_runs < min_runs:
+        parser.error("--max-runs must be at least %d, enough for two samples"
+                     % min_runs)
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+    return args
+
+def print_indices(indices, num_runs):
+    '''
+    Print the indices and their confidence intervals
+    '''
+    print("After", num_runs, "model runs:")
+    print("%-14s %-14s %18s %18s" % ("output", "parameter", "first order",
+                                     "total"))
+    for row in indices:
+        print("%-14s %-14s %6.3f [%5.2f,%5.2f] %6.3f [%5.2f,%5.2f]" % row)
+
+def write_indices(indices, filename='sensitivity.csv'):
+    '''
+    Write the indices and their confidence intervals to a CSV file
+    '''
+    with open(filename, 'w', newline='') as file1:
+        writer = csv.writer(file1)
+        writer.writerow(["output", "parameter", "first_order", "first_low",
+                         "first_high", "total", "total_low", "total_high"])
+        for row in indices:
+            writer.writerow(row)
+
+def analyse(environment, args):
+    '''
+    Add samples until every index's confidence interval is narrower than
+    the tolerance, or the most runs have been made
+
+    returns:    A list of rows of (output, parameter, first order index and
+                its interval, total index and its interval)
+    '''
+    names = list(args.ranges)
+    dimensions = len(names)
+    rng = np.random.default_rng(args.seed)
+    sample = make_sampler(args.sampler, 2 * dimensions, rng)
+    backend = "numba" if args.engine == "jit" else "python"
+    runs_per_sample = dimensions + 2
+    indices = []
+    widest = np.inf
+    f_a = np.zeros((0, len(OUTPUTS)))
+    f_b = np.zeros((0, len(OUTPUTS)))
+    f_ab = np.zeros((0, dimensions, len(OUTPUTS)))
+    num_runs = 0
+    new_samples = args.samples
+
+    shared = landscape.SharedLandscape.create(environment)
+    try:
+        with multiprocessing.Pool(args.workers,
+                                  initializer=_attach_landscape,
+                                  initargs=(shared.spec(),)) as pool:
+            while True:
+                new_samples = min(new_samples, (args.max_runs - num_runs) //
+                                  (runs_per_sample * args.replicates))
+                if new_samples <= 0:
+                    break
+                # Each sample's points: A, B, then A with each parameter
+                # taken from B
+                points = sample(new_samples)
+                a = points[:, :dimensions]
+                b = points[:, dimensions:]
+                tasks = []
+                for row in range(new_samples):
+                    seed = int(rng.integers(2**63))
+                    rows = [a[row], b[row]]
+                    for column in range(dimensions):
+                        mixed = a[row].copy()
+                        mixed[column] = b[row, column]
+                        rows.append(mixed)
+                    for values in scale(rows, args.ranges):
+                        tasks.append((values, seed, args.num_iterations,
+                                      args.replicates, backend, args.database,
+                                      args.environment_file))
+                outputs = np.array(pool.map(_run_model, tasks)).reshape(
+                    new_samples, runs_per_sample, len(OUTPUTS))
+                f_a = np.concatenate((f_a, outputs[:, 0]))
+                f_b = np.concatenate((f_b, outputs[:, 1]))
+                f_ab = np.concatenate((f_ab, outputs[:, 2:]))
+                num_runs += len(tasks) * args.replicates
+
+                indices = []
+                widest = 0.0
+                for k, output in enumerate(OUTPUTS):
+                    first, total = sobol_indices(f_a[:, k], f_b[:, k],
+                                                 f_ab[:, :, k])
+                    intervals = bootstrap_intervals(f_a[:, k], f_b[:, k],
+                                                    f_ab[:, :, k], rng)
+                    for i, name in enumerate(names):
+                        indices.append((output, name, first[i],
+                                        intervals[0][i], intervals[1][i],
+                                        total[i], intervals[2][i],
+                                        intervals[3][i]))
+                    widest = max(widest,
+                                 np.max(intervals[1] - intervals[0]),
+                                 np.max(intervals[3] - intervals[2]))
+                print_indices(indices, num_runs)
+                if widest <= args.tolerance:
+                    print("Every confidence interval is narrower than",
+                          args.tolerance)
+                    break
+                print("Widest confidence interval = %.3f, adding samples"
+                      % widest)
+                # Double the number of samples
+                new_samples = len(f_a)
+    finally:
+        shared.unlink()
+    if widest > args.tolerance:
+        print("Stopped after", num_runs, "model runs with confidence",
+              "intervals up to %.3f wide" % widest)
+    return indices
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    print("Random seed = ", args.seed)
+    environment = model.read_environment(args.environment_file)
+    indices = analyse(environment, args)
+    write_indices(indices)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+NAME
+    service.py - A long-running local service that runs the VarBee model
+
+SYNOPSIS
+    python3 service.py serve [--socket File] [--workers number1]
+    python3 service.py run [--socket File] [model.py arguments]
+
+    File: The Unix socket the service listens on (default varbee.sock)
+    number1: The most runs made at once, each in its own worker process
+             (default the number of CPUs)
+
+DESCRIPTION
+    "serve" starts the service. It listens on a Unix socket and runs the
+    model on a pool of worker processes that stay running, so a run doesn't
+    pay for starting Python, importing the model or reading the environment
+    file again. Each worker keeps the environments it has read, and only
+    reads a file again when it changes.
+
+    "run" sends a run to the service, shows its progress and writes
+    summary.csv, heatmap.csv and results.csv as model.py does, e.g.:
+
+        python3 service.py run myfile.csv 300 40 40 --engine jit --seed 3
+
+    The model.py options for replicates, domains, metrics, the cache,
+    rasters and the database can't be used with the service.
+
+    The protocol is one JSON object per line. A client sends requests of
+    the form:
+
+        {"id": 1, "arguments": ["myfile.csv", "300", "--seed", "3"]}
+
+    and can send more on the same connection without waiting. The service
+    replies to each, with its id, with a "started" message when a worker
+    takes it, "progress" messages with the step and the bee and mite
+    populations, and finally a "result" message with the seed, engine,
+    time_steps, stop_reason, stop_step, bee_pop, mite_pop and heatmap of
+    the run, or an "error" message. File names are read by the service, so
+    should be absolute.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import io
+import os
+import sys
+import json
+import signal
+import asyncio
+import functools
+import argparse
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+
+###############################################################################
+#                                                                             #
+#  Service parameters                                                         #
+#                                                                             #
+###############################################################################
+SOCKET_FILE = 'varbee.sock'
+# The longest request line accepted, in bytes
+MAX_REQUEST = 2**20
+
+###############################################################################
+#                                                                             #
+#  Worker processes                                                           #
+#                                                                             #
+###############################################################################
+
+# The queue each worker process sends the progress of its runs to
+_progress = None
+# The environments read by a worker, by file name, with the modification
+# time and size of the file when it was read
+_environments = {}
+
+def _init_worker(progress):
+    '''
+    Set up a worker process
+    '''
+    global _progress
+    _progress = progress
+
+def load_environment(filename):
+    '''
+    Read an environment file, or return it from memory if it has already
+    been read and hasn't changed since
+
+    filename:   The CSV file containing the environment
+
+    returns:    A new list of lists containing the environment. The object
+                engine takes nectar from the list it runs on, so each run
+                gets its own copy of the rows kept in memory.
+    '''
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    if path not in _environments or _environments[path][0] != version:
+        _environments[path] = (version, model.read_environment(path))
+    return [row[:] for row in _environments[path][1]]
+
+def run_request(run_id, argv):
+    '''
+    Make one run in a worker process
+
+    run_id:     The service's number for the run, sent with its progress
+    argv:       The model.py command line arguments of the run
+
+    returns:    A dict of the results of the run
+    '''
+    args = model.parse_args(argv)
+    environment = load_environment(args.environment_file)
+    simulation = model.make_simulation(environment, args)
+    rules = model.make_rules(args)
+
+    def report(step, num_bees, num_mites):
+        _progress.put((run_id, step, num_bees, num_mites))
+
+    model.run_simulation(simulation, rules, args.num_iterations,
+                         progress_interval=args.progress_interval,
+                         report=report)
+    return {"seed": args.seed,
+            "engine": args.engine,
+            "time_steps": len(simulation.bee_pop),
+            "stop_reason": rules.stop_reason or "completed",
+            "stop_step": rules.stop_step,
+            "bee_pop": simulation.bee_pop,
+            "mite_pop": simulation.mite_pop,
+            "heatmap": simulation.heatmap()}
+
+###############################################################################
+#                                                                             #
+#  The service                                                                #
+#                                                                             #
+###############################################################################
+
+def check_arguments(argv):
+    '''
+    Check the model.py arguments of a request before it is run
+
+    returns:    An error message, or None if the arguments can be run
+    '''
+    if not isinstance(argv, list) or \
+            not all(isinstance(arg, str) for arg in argv):
+        return "arguments must be a list of strings"
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(usage):
+            args = model.parse_args(argv)
+    except SystemExit:
+        return usage.getvalue().strip().splitlines()[-1]
+    if args.replicates > 1 or args.batch:
+        return "replicates can't be run by the service"
+    if args.domains > 1:
+        return "domains can't be run by the service"
+    if args.metrics or args.cache or args.rasters or args.database or \
+            args.publish:
+        return ("--metrics, --cache, --rasters, --database and --publish "
+                "can't be used with the service")
+    if not os.path.isfile(args.environment_file):
+        return "no environment file %s" % args.environment_file
+    return None
+
+class Service:
+    """
+    Runs the requests of clients connected to a Unix socket on a pool of
+    worker processes
+    """
+    def __init__(self, socket_file=SOCKET_FILE, workers=None):
+        """
+        socket_file:    The Unix socket to listen on
+        workers:        The number of worker processes
+        """
+        self.socket_file = socket_file
+        self.workers = workers or os.cpu_count() or 1
+        # Spawn rather than fork the workers, as the service has threads
+        context = multiprocessing.get_context("spawn")
+        self.progress = context.Queue()
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=context, initializer=_init_worker,
+            initargs=(self.progress,))
+        self.limit = None
+        self.runs = {}
+        self.next_id = 0
+
+    async def serve(self):
+        '''
+        Serve clients until the service is interrupted
+        '''
+        loop = asyncio.get_running_loop()
+        self.limit = asyncio.Semaphore(self.workers)
+        if os.path.exists(self.socket_file):
+            os.remove(self.socket_file)
+        server = await asyncio.start_unix_server(self.handle_client,
+                                                 self.socket_file,
+                                                 limit=MAX_REQUEST)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        forward = asyncio.ensure_future(
+            loop.run_in_executor(None, self.forward_progress, loop))
+        print("Serving on", self.socket_file, "with", self.workers,
+              "workers")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            print("Stopping")
+            # Wait for the runs already started in a thread, so the loop
+            # goes on sending their progress and results to their clients.
+            # The runs still waiting for a worker are cancelled.
+            await loop.run_in_executor(None, functools.partial(
+                self.pool.shutdown, cancel_futures=True))
+            self.progress.put(None)
+            await forward
+            if os.path.exists(self.socket_file):
+                os.remove(self.socket_file)
+
+    def forward_progress(self, loop):
+        '''
+        Pass the progress sent by the workers to the runs' clients. This
+        runs in its own thread, as reading the queue blocks.
+        '''
+        while True:
+            message = self.progress.get()
+            if message is None:
+                return
+            loop.call_soon_threadsafe(self.report, *message)
+
+    def report(self, run_id, step, num_bees, num_mites):
+        '''
+        Send the progress of a run to its client
+        '''
+        if run_id in self.runs:
+            send, request_id = self.runs[run_id]
+            send({"id": request_id, "type": "progress", "step": step,
+                  "bees": num_bees, "mites": num_mites})
+
+    async def handle_client(self, reader, writer):
+        '''
+        Read the requests of a client and run each as it arrives
+        '''
+        lock = asyncio.Lock()
+        tasks = set()
+
+        def send(message):
+            writer.write((json.dumps(message) + "\n").encode())
+
+        async def run(request):
+            request_id = request.get("id") if isinstance(request, dict) \
+                else None
+            error = check_arguments(request.get("arguments")) \
+                if isinstance(request, dict) else "a request must be an object"
+            if error:
+                send({"id": request_id, "type": "error", "message": error})
+                return
+            async with self.limit:
+                run_id = self.next_id
+                self.next_id += 1
+                self.runs[run_id] = (send, request_id)
+                send({"id": request_id, "type": "started"})
+                try:
+                    result = await asyncio.wrap_future(self.pool.submit(
+                        run_request, run_id, request["arguments"]))
+                    result.update({"id": request_id, "type": "result"})
+                except Exception as error:
+                    result = {"id": request_id, "type": "error",
+                              "message": "%s: %s" % (type(error).__name__,
+                                                     error)}
+                finally:
+                    del self.runs[run_id]
+            send(result)
+            async with lock:
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    send({"id": None, "type": "error",
+                          "message": "a request must be a line of JSON"})
+                    continue
+                task = asyncio.ensure_future(run(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # Finish the runs already sent before hanging up
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+###############################################################################
+#                                                                             #
+#  The client                                                                 #
+#                                                                             #
+###############################################################################
+
+async def submit(socket_file, argv):
+    '''
+    Send one run to the service, showing its progress
+
+    socket_file:    The Unix socket of the service
+    argv:           The model.py command line arguments of the run
+
+    returns:        The result message of the run
+    '''
+    # The service may be running in another directory
+    filename = model.parse_args(argv).environment_file
+    if filename in argv:
+        argv[argv.index(filename)] = os.path.abspath(filename)
+    else:
+        argv = [os.path.abspath(filename)] + argv
+    reader, writer = await asyncio.open_unix_connection(socket_file,
+                                                        limit=2**26)
+    writer.write((json.dumps({"id": 0, "arguments": argv}) + "\n").encode())
+    await writer.drain()
+    shown = False
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("The service closed the connection")
+            message = json.loads(line)
+            if message["type"] == "progress":
+                print("Time-step: ", message["step"],
+                      "\tNumber of bees remaining = ", message["bees"],
+                      "\tNumber of mites remaining = ", message["mites"],
+                      "\r", end='', flush=True)
+                shown = True
+            elif message["type"] in ("result", "error"):
+                if shown:
+                    print()
+                return message
+    finally:
+        writer.close()
+
+def parse_args(argv):
+    '''
+    Command line processing
+
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the service parameters
+    '''
+    parser = argparse.ArgumentParser(
+        description="A local service that runs the VarBee model")
+    parser.add_argument("command", choices=("serve", "run"),
+                        help="Start the service or send it a run")
+    parser.add_argument("--socket", default=SOCKET_FILE,
+                        help="The Unix socket the service listens on")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The most runs made at once")
+    args, model_args = parser.parse_known_args(argv)
+    args.model_args = model_args
+    if args.command == "serve" and model_args:
+        parser.error("unrecognized arguments: %s" % " ".join(model_args))
+    return args
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    if args.command == "serve":
+        asyncio.run(Service(args.socket, args.workers).serve())
+        return 0
+
+    result = asyncio.run(submit(args.socket, args.model_args))
+    if result["type"] == "error":
+        print("The run failed:", result["message"])
+        return 1
+    print("Random seed = ", result["seed"])
+    if result["stop_reason"] != "completed":
+        print("Stopped early at time-step", result["stop_step"], "-",
+              result["stop_reason"])
+    model.write_summary({name: result[name] for name in
+                         ("seed", "engine", "time_steps", "stop_reason")})
+    model.write_results(result["heatmap"], result["bee_pop"],
+                        result["mite_pop"])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
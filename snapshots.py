@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- Coding UTF-8 -*-
+# snapshots.py - the latest state of a model run in shared memory
+"""
+snapshots.py
+
+The latest state of a running model, published to a named block of shared
+memory so that viewers in other processes can watch the run without slowing
+it down. The classes contained are as follows:
+
+    - SnapshotPublisher
+    - SnapshotReader
+
+The run publishes with a SnapshotPublisher at most every few hundredths of
+a second, whatever the speed of the model. Any number of viewers can attach
+to the block by name with a SnapshotReader, and attach or detach at any
+time. A viewer reads the latest snapshot at its own frame rate, and never
+blocks the run.
+
+The block holds a header, the environment, and the positions of the bees
+and mites. The header is:
+
+    sequence:       Odd while a snapshot is being written, and increased
+                    again when it is complete
+    rows, columns:  The shape of the environment
+    capacity:       The most bees and most mites the block holds positions
+                    for
+    timestep:       The time-step of the snapshot
+    num_iterations: The number of time-steps the run will take
+    bees, mites:    The bee and mite populations. Only the first capacity
+                    positions are held if there are more.
+    finished:       1 when the run has finished
+
+A reader copies the snapshot and checks that the sequence didn't change
+while it was copying, trying again if it did.
+"""
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import monitor
+
+HEADER = ("sequence", "rows", "columns", "capacity", "timestep",
+          "num_iterations", "bees", "mites", "finished")
+# The most bees and most mites whose positions are published
+CAPACITY = 20000
+
+def _layout(rows, columns, capacity):
+    '''
+    The offsets of the parts of the block, in 64 bit words
+
+    returns:    A tuple of the offsets of the environment, the bee
+                positions and the mite positions, and the size in words
+    '''
+    environment = len(HEADER)
+    bees = environment + rows * columns
+    mites = bees + 2 * capacity
+    return environment, bees, mites, mites + 2 * capacity
+
+class SnapshotPublisher:
+    """
+    Publishes the state of a simulation to a named block of shared memory.
+    It must be closed when the run has finished.
+    """
+    def __init__(self, name, shape, num_iterations, interval=0.02,
+                 capacity=CAPACITY):
+        """
+        name:       The name of the block, which viewers attach to
+        shape:      The shape of the environment
+        num_iterations: The number of time-steps the run will take
+        interval:   The least number of seconds between snapshots
+        capacity:   The most bees and most mites to publish the positions of
+        """
+        rows, columns = shape
+        offsets = _layout(rows, columns, capacity)
+        self.memory = shared_memory.SharedMemory(name=name, create=True,
+                                                 size=offsets[-1] * 8)
+        words = np.ndarray(offsets[-1], dtype=np.int64,
+                           buffer=self.memory.buf)
+        words[:] = 0
+        self.header = words[:len(HEADER)]
+        self.environment = words[offsets[0]:offsets[1]].reshape(rows,
+                                                                columns)
+        self.bees = words[offsets[1]:offsets[2]].reshape(capacity, 2)
+        self.mites = words[offsets[2]:offsets[3]].reshape(capacity, 2)
+        self.capacity = capacity
+        for field, value in (("rows", rows), ("columns", columns),
+                             ("capacity", capacity),
+                             ("num_iterations", num_iterations)):
+            self.header[HEADER.index(field)] = value
+        self.throttle = monitor.Throttle(interval)
+
+    def publish(self, simulation, force=False):
+        """
+        Publish the state of a simulation, if a snapshot is due
+
+        simulation: The simulation, with snapshot() and population()
+        force:      True to publish even if a snapshot isn't due
+        """
+        if self.memory is None or not (self.throttle.due() or force):
+            return
+        bees, mites, environment = simulation.snapshot()
+        num_bees, num_mites = simulation.population()
+        sequence = HEADER.index("sequence")
+        self.header[sequence] += 1
+        self.environment[:] = environment
+        shown_bees = min(len(bees), self.capacity)
+        shown_mites = min(len(mites), self.capacity)
+        self.bees[:shown_bees] = bees[:shown_bees]
+        self.mites[:shown_mites] = mites[:shown_mites]
+        self.header[HEADER.index("timestep")] = simulation.timestep
+        self.header[HEADER.index("bees")] = num_bees
+        self.header[HEADER.index("mites")] = num_mites
+        self.header[sequence] += 1
+
+    def close(self, simulation=None):
+        """
+        Publish the final state, mark the run as finished and remove the
+        block. Viewers that are attached keep their copy of it.
+
+        simulation: The simulation, to publish its final state, or None
+        """
+        if self.memory is None:
+            return
+        if simulation is not None:
+            self.publish(simulation, force=True)
+        self.header[HEADER.index("finished")] = 1
+        self.header = self.environment = self.bees = self.mites = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+class SnapshotReader:
+    """
+    Reads the snapshots published by a run in another process
+    """
+    def __init__(self, name):
+        """
+        name:       The name of the block the run publishes to. Raises
+                    FileNotFoundError if there is no such block, or the
+                    run hasn't finished creating it.
+        """
+        self.memory = shared_memory.SharedMemory(name=name)
+        # The block belongs to the run, so it mustn't be removed when this
+        # process exits
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        header = np.ndarray(len(HEADER), dtype=np.int64,
+                            buffer=self.memory.buf)
+        rows, columns, capacity = (int(header[HEADER.index(field)])
+                                   for field in ("rows", "columns",
+                                                 "capacity"))
+        del header
+        if not capacity:
+            self.memory.close()
+            raise FileNotFoundError("The snapshots of %s aren't ready"
+                                    % name)
+        offsets = _layout(rows, columns, capacity)
+        self.words = np.ndarray(offsets[-1], dtype=np.int64,
+                                buffer=self.memory.buf)
+        self.offsets = offsets
+        self.shape = (rows, columns)
+        self.capacity = capacity
+
+    def read(self, timeout=1.0):
+        """
+        Copy the latest complete snapshot
+
+        timeout:    The most seconds to keep trying while the run is
+                    writing
+
+        returns:    A dict of the header fields, the "environment", and the
+                    "bee_positions" and "mite_positions" as arrays with a
+                    row for each, or None if no complete snapshot could be
+                    read
+        """
+        start = time.monotonic()
+        while True:
+            before = int(self.words[0])
+            if before % 2 == 0:
+                words = self.words.copy()
+                if int(self.words[0]) == before:
+                    break
+            if time.monotonic() - start > timeout:
+                return None
+            time.sleep(0.0005)
+        snapshot = dict(zip(HEADER, (int(value) for value in
+                                     words[:len(HEADER)])))
+        environment, bees, mites, end = self.offsets
+        snapshot["environment"] = words[environment:bees].reshape(
+            self.shape)
+        snapshot["bee_positions"] = words[bees:mites].reshape(-1, 2)[
+            :min(snapshot["bees"], self.capacity)]
+        snapshot["mite_positions"] = words[mites:end].reshape(-1, 2)[
+            :min(snapshot["mites"], self.capacity)]
+        return snapshot
+
+    def close(self):
+        self.words = None
+        self.memory.close()
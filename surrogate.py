@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""
+NAME
+    surrogate.py - A fast mean-field surrogate of the VarBee model
+
+SYNOPSIS
+    python3 surrogate.py calibrate File [number1] [--train number2]
+                         [--test number3] [--replicates number4]
+                         [--members number5] [--workers number6]
+                         [--seed number7] [--engine {array,jit}]
+                         [--range name low high]... [--output File2]
+
+    python3 surrogate.py query [File2] [--set name value]...
+                         [--sweep name low high number8]
+                         [--tolerance number9] [--run-uncertain]
+
+    File: A CSV file containing the environment
+    number1: The number of iterations of each run (default 300)
+    number2: The number of parameter sets to calibrate with (default 40)
+    number3: The number of parameter sets held out to test with (default 10)
+    number4: The number of agent runs averaged for each set (default 8)
+    number5: The number of surrogates in the ensemble, each calibrated on a
+             bootstrap resample of the training sets (default 5)
+    number6: The number of worker processes (default the number of CPUs)
+    number7: The seed for the parameter sets and the agent runs
+    --engine: The agent model engine, uncompiled ("array") or compiled with
+             Numba ("jit")
+    --range: The range of a parameter, as in sensitivity.py
+    File2: The calibrated surrogate (default surrogate.json)
+    --set: The value of a parameter. Parameters not set are in the middle
+             of their range.
+    --sweep: Vary a parameter over number8 values from low to high
+    number9: The most the ensemble may disagree, relative to its mean,
+             before a result counts as uncertain (default 0.1)
+    --run-uncertain: Run the agent model for the uncertain results of a
+             sweep, rather than only marking them
+
+DESCRIPTION
+    "calibrate" runs ensembles of the agent model (arraybee, which gives
+    the same results as varbee statistically, see equivalence.py) for
+    parameter sets sampled by Latin hypercube over the ranges of
+    sensitivity.py: bee_lifespan, mite_capacity, drop_chance, num_bees and
+    num_mites. A compartmental model of the bee and mite populations is
+    then fitted to the mean population trajectories:
+
+        bees:   Pass through AGE_STAGES stages of age (a gamma distributed
+                lifespan). Carried mites make their hosts age faster.
+        mites:  Wait in the field or in the hive, are carried by bees,
+                reproduce in the hive, drop off and die. Drops, leaving the
+                hive and the limit on births follow the agent model's rules.
+
+    The rates that aren't known from the rules are log-linear functions of
+    the parameters, fitted by Levenberg-Marquardt least squares. The error
+    of the surrogate against the held-out sets is printed, and the
+    surrogate is written to File2.
+
+    "query" predicts the populations from the surrogate, writing the
+    trajectory to surrogate_results.csv, or for a sweep the means over the
+    last quarter of the run to surrogate_sweep.csv. A result is uncertain
+    where the ensemble disagrees by more than number9. Many parameter sets
+    are predicted at once, thousands of times faster than the agent model.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+import arraybee
+import landscape
+import sensitivity
+
+###############################################################################
+#                                                                             #
+#  Surrogate parameters                                                       #
+#                                                                             #
+###############################################################################
+SURROGATE_FILE = 'surrogate.json'
+NUM_ITERATIONS = 300
+NUM_TRAIN = 40
+NUM_TEST = 10
+NUM_REPLICATES = 8
+NUM_MEMBERS = 5
+TOLERANCE = 0.1
+# The number of age stages of a bee
+AGE_STAGES = 8
+# The fitted rates: the correction to the bee lifespan, the chance per bee
+# of a mite in the field finding a host, the chance of a mite in the hive
+# finding a host, the chance of a carried mite reaching the hive, the death
+# rate of active mites and the extra ageing of a bee per carried mite
+RATES = ("lifespan", "field_attach", "hive_attach", "return", "mite_death",
+         "mite_ageing")
+# The starting values of the rates, before calibration
+INITIAL_RATES = (1.0, 0.001, 0.5, 0.05, 0.01, 1.0)
+# The chance of a reproducing mite leaving the hive each time-step
+LEAVE_CHANCE = 5 / 101
+# Compare the trajectories every this many time-steps when calibrating
+STRIDE = 5
+# The penalty on the weights of the parameters when calibrating, which keeps
+# the rates from depending on them more than the training sets justify
+RIDGE = 1e-3
+
+###############################################################################
+#                                                                             #
+#  The mean-field model                                                       #
+#                                                                             #
+###############################################################################
+
+def features(values, ranges):
+    '''
+    The features the rates are log-linear in: a constant and each parameter
+    scaled to -1 to 1 over its range
+
+    values:     A dict of an array of values for each parameter
+    ranges:     A dict of the (low, high, whole) range of each parameter
+
+    returns:    An array with a row for each parameter set
+    '''
+    columns = [np.ones(len(values[next(iter(ranges))]))]
+    for name, (low, high, whole) in ranges.items():
+        columns.append((2 * (np.asarray(values[name], dtype=float) - low) /
+                        (high - low)) - 1)
+    return np.column_stack(columns)
+
+def simulate(values, ranges, weights, num_iterations):
+    '''
+    Run the mean-field model for many parameter sets at once
+
+    values:     A dict of an array of values for each parameter
+    ranges:     The ranges the features are scaled over
+    weights:    An array of the weights of the features for each rate, one
+                column per rate, or a stack of them with one for each set
+    num_iterations: The number of time-steps to run
+
+    returns:    Arrays of the bee and mite populations after each time-step,
+                with a row for each parameter set
+    '''
+    phi = features(values, ranges)
+    if weights.ndim == 2:
+        exponents = phi @ weights
+    else:
+        exponents = np.einsum('nf,nfr->nr', phi, weights)
+    rates = np.exp(np.clip(exponents, -20, 20))
+    rates *= INITIAL_RATES
+    lifespan = np.asarray(values["bee_lifespan"], dtype=float)
+    capacity = np.asarray(values["mite_capacity"], dtype=float)
+    drop = np.asarray(values["drop_chance"], dtype=float) / 101
+    # Bees die when their lifespan falls below a uniform draw from 0 to 45
+    mean_life = np.maximum(lifespan - 22.5, 1.0) * rates[:, 0]
+    field_attach = rates[:, 1]
+    hive_attach = 1 - np.exp(-rates[:, 2])
+    home = 1 - np.exp(-rates[:, 3])
+    mite_death = 1 - np.exp(-rates[:, 4])
+    mite_ageing = rates[:, 5]
+
+    num_sets = len(lifespan)
+    stages = np.zeros((AGE_STAGES, num_sets))
+    stages[0] = values["num_bees"]
+    field = np.asarray(values["num_mites"], dtype=float).copy()
+    hive = np.zeros(num_sets)
+    carried = np.zeros(num_sets)
+    breeding = np.zeros(num_sets)
+    bee_pop = np.zeros((num_sets, num_iterations))
+    mite_pop = np.zeros((num_sets, num_iterations))
+    for step in range(num_iterations):
+        bees = stages.sum(axis=0)
+        mites = field + hive + carried + breeding
+
+        # Mites, which see the bees before they move
+        found_field = field * (1 - np.exp(-field_attach * bees))
+        found_hive = hive * hive_attach
+        arrived = carried * home
+        dropped = carried * drop
+        left = breeding * LEAVE_CHANCE
+        born = breeding * np.clip(1 - (mites + 1) / (capacity * bees + 1),
+                                  0, 1)
+        # Carried mites die with their hosts
+        ageing = np.minimum(AGE_STAGES / mean_life *
+                            (1 + mite_ageing * carried / np.maximum(bees, 1)),
+                            1)
+        host_deaths = stages[-1] * ageing / np.maximum(bees, 1)
+        carried_deaths = carried * np.minimum(mite_death + host_deaths, 1)
+        field += dropped - found_field
+        hive += born + left - found_hive
+        carried += found_field + found_hive - arrived - dropped - \
+            carried_deaths
+        breeding += arrived - left - breeding * mite_death
+
+        # Bees age through the stages, and one is born each time-step
+        moving = stages * ageing
+        stages -= moving
+        stages[1:] += moving[:-1]
+        stages[0] += 1
+
+        bee_pop[:, step] = stages.sum(axis=0)
+        mite_pop[:, step] = field + hive + carried + breeding
+    return bee_pop, mite_pop
+
+def fit(values, ranges, bee_targets, mite_targets, weights, iterations=60):
+    '''
+    Fit the weights of the rates to the agent model's mean trajectories by
+    Levenberg-Marquardt least squares. The residuals are scaled by the mean
+    of each population so the bees and mites count equally, and the weights
+    of the parameters are penalised by RIDGE.
+
+    values:     A dict of an array of values for each parameter
+    ranges:     The ranges the features are scaled over
+    bee_targets, mite_targets: The agent model's mean populations, with a
+                row for each parameter set
+    weights:    The weights to start from
+    iterations: The most iterations to make
+
+    returns:    The fitted weights
+    '''
+    num_iterations = bee_targets.shape[1]
+    scales = (bee_targets.mean(), mite_targets.mean())
+    targets = np.concatenate((bee_targets[:, STRIDE - 1::STRIDE] / scales[0],
+                              mite_targets[:, STRIDE - 1::STRIDE] / scales[1]),
+                             axis=1).ravel()
+    num_sets = len(bee_targets)
+    num_weights = weights.size
+    step = 1e-4
+
+    def residuals(stack):
+        # Run every set with each stack of weights in one pass
+        repeated = {name: np.tile(np.asarray(values[name]), len(stack))
+                    for name in values}
+        stacked = np.repeat(stack, num_sets, axis=0)
+        bees, mites = simulate(repeated, ranges, stacked, num_iterations)
+        predictions = np.concatenate(
+            (bees[:, STRIDE - 1::STRIDE] / scales[0],
+             mites[:, STRIDE - 1::STRIDE] / scales[1]), axis=1)
+        penalty = np.sqrt(RIDGE * targets.size) * stack[:, 1:]
+        return np.concatenate(
+            (predictions.reshape(len(stack), -1) - targets,
+             penalty.reshape(len(stack), -1)), axis=1)
+
+    cost = np.sum(residuals(weights[np.newaxis])[0]**2)
+    damping = 1e-2
+    for iteration in range(iterations):
+        # The Jacobian by forward differences, one weight at a time
+        stack = np.repeat(weights[np.newaxis], num_weights + 1, axis=0)
+        stack[1:].reshape(num_weights, -1)[np.arange(num_weights),
+                                           np.arange(num_weights)] += step
+        r = residuals(stack)
+        jacobian = ((r[1:] - r[0]) / step).T
+        gradient = jacobian.T @ r[0]
+        curvature = jacobian.T @ jacobian
+        while True:
+            change = np.linalg.solve(
+                curvature + damping * np.diag(np.diag(curvature) + 1e-9),
+                -gradient)
+            trial = weights + change.reshape(weights.shape)
+            trial_cost = np.sum(residuals(trial[np.newaxis])[0]**2)
+            if np.isfinite(trial_cost) and trial_cost < cost:
+                break
+            damping *= 4
+            if damping > 1e8:
+                return weights
+        improvement = (cost - trial_cost) / cost
+        weights = trial
+        cost = trial_cost
+        damping = max(damping / 3, 1e-7)
+        if improvement < 1e-6:
+            break
+    return weights
+
+###############################################################################
+#                                                                             #
+#  The surrogate                                                              #
+#                                                                             #
+###############################################################################
+
+class Surrogate:
+    """
+    An ensemble of mean-field models calibrated against the agent model
+    """
+    def __init__(self, ranges, members, num_iterations, error=None):
+        """
+        ranges:     A dict of the (low, high, whole) range of each parameter
+        members:    A list of the weights of each model in the ensemble
+        num_iterations: The number of time-steps it was calibrated over
+        error:      The error against the held-out agent runs, if known
+        """
+        self.ranges = ranges
+        self.members = [np.asarray(weights, dtype=float)
+                        for weights in members]
+        self.num_iterations = num_iterations
+        self.error = error or {}
+
+    def predict(self, values, num_iterations=None):
+        '''
+        Predict the populations for many parameter sets at once
+
+        values:     A dict of an array of values for each parameter
+        num_iterations: The number of time-steps, by default the number it
+                    was calibrated over
+
+        returns:    The mean over the ensemble of the bee and mite
+                    populations after each time-step, and their standard
+                    deviation over the ensemble, each with a row for each
+                    parameter set
+        '''
+        num_iterations = num_iterations or self.num_iterations
+        runs = [simulate(values, self.ranges, weights, num_iterations)
+                for weights in self.members]
+        bees = np.array([run[0] for run in runs])
+        mites = np.array([run[1] for run in runs])
+        return bees.mean(axis=0), mites.mean(axis=0), bees.std(axis=0), \
+            mites.std(axis=0)
+
+    def save(self, filename=SURROGATE_FILE):
+        with open(filename, 'w') as file1:
+            json.dump({"ranges": self.ranges,
+                       "num_iterations": self.num_iterations,
+                       "members": [weights.tolist()
+                                   for weights in self.members],
+                       "error": self.error}, file1, indent=1)
+
+    @classmethod
+    def load(cls, filename=SURROGATE_FILE):
+        with open(filename) as file1:
+            saved = json.load(file1)
+        ranges = {name: tuple(saved["ranges"][name])
+                  for name in saved["ranges"]}
+        return cls(ranges, saved["members"], saved["num_iterations"],
+                   saved["error"])
+
+def tail_means(pop):
+    '''
+    The means over the last quarter of the run of each row, as the outputs
+    of sensitivity.py
+    '''
+    tail = max(pop.shape[1] // 4, 1)
+    return pop[:, -tail:].mean(axis=1)
+
+def relative_error(predicted, observed):
+    '''
+    The root mean square error relative to the mean of the observations
+    '''
+    return float(np.sqrt(np.mean((predicted - observed)**2)) /
+                 max(np.mean(observed), 1e-9))
+
+###############################################################################
+#                                                                             #
+#  Agent runs                                                                 #
+#                                                                             #
+###############################################################################
+
+# The shared landscape attached to by each worker process
+_shared = None
+
+def _attach_landscape(spec):
+    '''
+    Attach a worker process to the shared landscape
+    '''
+    global _shared
+    _shared = landscape.SharedLandscape.attach(spec)
+
+def run_agents(values, seed, num_iterations, replicates, backend="python"):
+    '''
+    Run an ensemble of the agent model with one parameter set, as the
+    replicates of a batched simulation on the shared landscape
+
+    returns:    The mean bee and mite populations after each time-step
+    '''
+    batch = arraybee.BatchSimulation(
+        _shared.original, replicates, num_iterations=num_iterations,
+        seed=seed, backend=backend, landscape=_shared,
+        hive_locations=model.HIVE_LOCATIONS[:model.NUM_HIVES], **values)
+    for i in range(num_iterations):
+        batch.update()
+    return np.mean(batch.bee_pop, axis=1), np.mean(batch.mite_pop, axis=1)
+
+def _run_agents(task):
+    return run_agents(*task)
+
+def run_ensembles(environment, samples, seed, num_iterations, replicates,
+                  workers, backend):
+    '''
+    Run an ensemble of the agent model for each parameter set in a pool of
+    worker processes sharing the landscape
+
+    samples:    A list of a dict of parameter values for each set
+
+    returns:    Arrays of the mean bee and mite populations, with a row for
+                each set, and the time taken per agent run in seconds
+    '''
+    seeds = arraybee.replicate_seeds(seed, len(samples))
+    tasks = [(values, seeds[k], num_iterations, replicates, backend)
+             for k, values in enumerate(samples)]
+    shared = landscape.SharedLandscape.create(environment)
+    try:
+        start = time.perf_counter()
+        with multiprocessing.Pool(workers, initializer=_attach_landscape,
+                                  initargs=(shared.spec(),)) as pool:
+            results = pool.map(_run_agents, tasks)
+        seconds = time.perf_counter() - start
+    finally:
+        shared.unlink()
+    bees = np.array([result[0] for result in results])
+    mites = np.array([result[1] for result in results])
+    return bees, mites, seconds * min(workers, len(tasks)) / \
+        (len(tasks) * replicates)
+
+def as_columns(samples):
+    '''
+    Turn a list of dicts of parameter values into a dict of arrays
+    '''
+    return {name: np.array([values[name] for values in samples])
+            for name in samples[0]}
+
+###############################################################################
+#                                                                             #
+#  Commands                                                                   #
+#                                                                             #
+###############################################################################
+
+def calibrate(environment, args):
+    '''
+    Run the agent model for the training and test sets, fit the surrogate
+    ensemble and report its error
+
+    returns:    The Surrogate
+    '''
+    rng = np.random.default_rng(args.seed)
+    names = list(args.ranges)
+    num_sets = args.train + args.test
+    samples = sensitivity.scale(
+        sensitivity.latin_hypercube(num_sets, len(names), rng), args.ranges)
+    backend = "numba" if args.engine == "jit" else "python"
+    print("Running the agent model for", num_sets, "parameter sets of",
+          args.replicates, "replicates")
+    bees, mites, agent_seconds = run_ensembles(
+        environment, samples, int(rng.integers(2**63)), args.num_iterations,
+        args.replicates, args.workers, backend)
+
+    # Hold out the test sets, which the Latin hypercube spreads through
+    # the parameter space like the training sets
+    order = rng.permutation(num_sets)
+    train = order[:args.train]
+    test = order[args.train:]
+    values = as_columns(samples)
+    train_values = {name: values[name][train] for name in values}
+
+    print("Calibrating", args.members, "surrogates")
+    initial = np.zeros((len(names) + 1, len(RATES)))
+    weights = fit(train_values, args.ranges, bees[train], mites[train],
+                  initial)
+    members = [weights]
+    for member in range(1, args.members):
+        resample = rng.integers(len(train), size=len(train))
+        members.append(fit({name: train_values[name][resample]
+                            for name in train_values}, args.ranges,
+                           bees[train][resample], mites[train][resample],
+                           weights))
+    surrogate = Surrogate(args.ranges, members, args.num_iterations)
+
+    predicted_bees, predicted_mites, bees_sd, mites_sd = \
+        surrogate.predict(values)
+    start = time.perf_counter()
+    many = {name: np.repeat(values[name], 1000 // num_sets + 1)
+            for name in values}
+    surrogate.predict(many)
+    surrogate_seconds = (time.perf_counter() - start) / len(many[names[0]])
+
+    error = {}
+    for part, sets in (("train", train), ("test", test)):
+        if not len(sets):
+            continue
+        error[part] = {
+            "bees": relative_error(predicted_bees[sets], bees[sets]),
+            "mites": relative_error(predicted_mites[sets], mites[sets]),
+            "final_bees": relative_error(tail_means(predicted_bees[sets]),
+                                         tail_means(bees[sets])),
+            "final_mites": relative_error(tail_means(predicted_mites[sets]),
+                                          tail_means(mites[sets]))}
+    error["speedup"] = agent_seconds / surrogate_seconds
+    surrogate.error = error
+    print_error(error)
+    return surrogate
+
+def print_error(error):
+    '''
+    Print the error of the surrogate against the agent runs
+    '''
+    print("Error relative to the mean population (root mean square):")
+    print("%-6s %10s %10s %12s %12s" % ("sets", "bees", "mites",
+                                        "final bees", "final mites"))
+    for part in ("train", "test"):
+        if part in error:
+            print("%-6s %10.3f %10.3f %12.3f %12.3f" % (
+                part, error[part]["bees"], error[part]["mites"],
+                error[part]["final_bees"], error[part]["final_mites"]))
+    print("Speedup over the agent model = %.0f" % error["speedup"])
+
+def query(args):
+    '''
+    Predict the populations for the parameter values on the command line,
+    or for a sweep of one parameter
+    '''
+    surrogate = Surrogate.load(args.surrogate)
+    base = {name: (low + high) / 2
+            for name, (low, high, whole) in surrogate.ranges.items()}
+    for name, value in args.set:
+        if name not in base:
+            sys.exit("Unknown parameter %s, use one of %s"
+                     % (name, ", ".join(base)))
+        base[name] = float(value)
+    for name, (low, high, whole) in surrogate.ranges.items():
+        if whole:
+            base[name] = int(round(base[name]))
+
+    if args.sweep is None:
+        values = {name: np.array([base[name]]) for name in base}
+        bees, mites, bees_sd, mites_sd = surrogate.predict(values)
+        with open('surrogate_results.csv', 'w', newline='') as file1:
+            writer = csv.writer(file1)
+            for i in range(bees.shape[1]):
+                writer.writerow([i, bees[0, i], mites[0, i], bees_sd[0, i],
+                                 mites_sd[0, i]])
+        spread = uncertainty(bees, mites, bees_sd, mites_sd)[0]
+        print("Bees = %.1f, mites = %.1f over the last quarter of the run"
+              % (tail_means(bees)[0], tail_means(mites)[0]))
+        if spread > args.tolerance:
+            print("Uncertain (the ensemble disagrees by %.2f), run the agent"
+                  " model to check" % spread)
+        return
+
+    name, low, high, number = args.sweep
+    if name not in base:
+        sys.exit("Unknown parameter %s, use one of %s"
+                 % (name, ", ".join(base)))
+    sweep = np.linspace(float(low), float(high), int(number))
+    if surrogate.ranges[name][2]:
+        sweep = np.round(sweep).astype(int)
+    values = {other: np.full(len(sweep), base[other]) for other in base}
+    values[name] = sweep
+    start = time.perf_counter()
+    bees, mites, bees_sd, mites_sd = surrogate.predict(values)
+    print("Predicted", len(sweep), "parameter sets in %.3f seconds"
+          % (time.perf_counter() - start))
+    final_bees = tail_means(bees)
+    final_mites = tail_means(mites)
+    spread = uncertainty(bees, mites, bees_sd, mites_sd)
+    uncertain = np.flatnonzero(spread > args.tolerance)
+    source = ["surrogate"] * len(sweep)
+    if len(uncertain):
+        print(len(uncertain), "of the results are uncertain")
+    if len(uncertain) and args.run_uncertain:
+        print("Running the agent model for them")
+        samples = [{other: values[other][k].item() for other in values}
+                   for k in uncertain]
+        environment = model.read_environment(args.environment_file)
+        agent_bees, agent_mites, seconds = run_ensembles(
+            environment, samples, args.seed, surrogate.num_iterations,
+            args.replicates, args.workers,
+            "numba" if args.engine == "jit" else "python")
+        final_bees[uncertain] = tail_means(agent_bees)
+        final_mites[uncertain] = tail_means(agent_mites)
+        for k in uncertain:
+            source[k] = "agent"
+    with open('surrogate_sweep.csv', 'w', newline='') as file1:
+        writer = csv.writer(file1)
+        writer.writerow([name, "bees", "mites", "uncertainty", "source"])
+        for k in range(len(sweep)):
+            writer.writerow([sweep[k], final_bees[k], final_mites[k],
+                             spread[k], source[k]])
+
+def uncertainty(bees, mites, bees_sd, mites_sd):
+    '''
+    How much the ensemble disagrees about each parameter set: the largest
+    standard deviation of either population relative to its mean
+    '''
+    return np.maximum(np.max(bees_sd / np.maximum(bees, 1), axis=1),
+                      np.max(mites_sd / np.maximum(mites, 1), axis=1))
+
+def parse_args(argv):
+    '''
+    Command line processing
+
+    argv:       The command line arguments, not including the program name
+
+    returns:    An argparse.Namespace with the surrogate parameters
+    '''
+    parser = argparse.ArgumentParser(
+        description="A fast mean-field surrogate of the VarBee model")
+    parser.add_argument("command", choices=("calibrate", "query"),
+                        help="Calibrate the surrogate or query it")
+    parser.add_argument("file", nargs='?', default=None,
+                        help="The environment file to calibrate with, or "
+                             "the surrogate to query")
+    parser.add_argument("num_iterations", nargs='?', type=int,
+                        default=NUM_ITERATIONS,
+                        help="The number of iterations of each run")
+    parser.add_argument("--train", type=int, default=NUM_TRAIN,
+                        help="The number of parameter sets to calibrate with")
+    parser.add_argument("--test", type=int, default=NUM_TEST,
+                        help="The number of parameter sets to test with")
+    parser.add_argument("--replicates", type=int, default=NUM_REPLICATES,
+                        help="The agent runs averaged for each set")
+    parser.add_argument("--members", type=int, default=NUM_MEMBERS,
+                        help="The number of surrogates in the ensemble")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="The seed for the parameter sets and runs")
+    parser.add_argument("--engine", choices=("array", "jit"), default="array",
+                        help="The engine used to run the agent model")
+    parser.add_argument("--range", nargs=3, action="append", default=[],
+                        metavar=("NAME", "LOW", "HIGH"),
+                        help="The range of a parameter")
+    parser.add_argument("--output", default=SURROGATE_FILE,
+                        help="The file to write the surrogate to")
+    parser.add_argument("--set", nargs=2, action="append", default=[],
+                        metavar=("NAME", "VALUE"),
+                        help="The value of a parameter")
+    parser.add_argument("--sweep", nargs=4, default=None,
+                        metavar=("NAME", "LOW", "HIGH", "NUMBER"),
+                        help="Vary a parameter over a range")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="The most the ensemble may disagree")
+    parser.add_argument("--run-uncertain", action="store_true",
+                        help="Run the agent model for uncertain results")
+    parser.add_argument("--environment-file", default=model.ENVIRONMENT_FILE,
+                        help="The environment for --run-uncertain")
+    args = parser.parse_args(argv)
+
+    args.ranges = dict(sensitivity.PARAMETERS)
+    for name, low, high in args.range:
+        if name not in sensitivity.PARAMETERS:
+            parser.error("Unknown parameter %s, use one of %s"
+                         % (name, ", ".join(sensitivity.PARAMETERS)))
+        whole = sensitivity.PARAMETERS[name][2]
+        convert = int if whole else float
+        args.ranges[name] = (convert(low), convert(high), whole)
+    if args.command == "calibrate":
+        args.environment_file = args.file or model.ENVIRONMENT_FILE
+    else:
+        args.surrogate = args.file or SURROGATE_FILE
+    if args.num_iterations <= 0:
+        args.num_iterations = NUM_ITERATIONS
+    if args.train <= 1:
+        args.train = NUM_TRAIN
+    if args.test < 0:
+        args.test = NUM_TEST
+    if args.replicates <= 0:
+        args.replicates = NUM_REPLICATES
+    if args.members <= 0:
+        args.members = NUM_MEMBERS
+    if args.workers <= 0:
+        args.workers = os.cpu_count() or 1
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().generate_state(1)[0])
+    return args
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    if args.command == "query":
+        query(args)
+        return
+    print("Random seed = ", args.seed)
+    environment = model.read_environment(args.environment_file)
+    surrogate = calibrate(environment, args)
+    surrogate.save(args.output)
+    print("The surrogate was written to", args.output)
+
+if __name__ == "__main__":
+    main()
@@ -14,45 +14,134 @@ contained are as follows:
     - Mite
     - Hive
     - Flower
+    - Environment
+    - Simulation
+    - StoppingRules
     """
-import random
+from collections import deque
 import numpy as np
 
+# The number of random draws each agent uses in one time-step. The
+# Simulation draws these for a whole population in a single call
+BEE_DRAWS = 2
+MITE_DRAWS = 5
+
+# Generator used by agents created outside of a Simulation
+DEFAULT_RNG = np.random.default_rng()
+
+def draw_int(draw, low, high):
+    """
+    Turn a uniform draw into an integer, over the same range as
+    random.randint
+
+    draw:       A uniform random number in [0, 1)
+    low:        The lowest integer that can be returned
+    high:       The highest integer that can be returned
+
+    returns:    An integer N such that low <= N <= high
+    """
+    return low + int(draw * (high - low + 1))
+
+def draw_choice(draw, sequence):
+    """
+    Turn a uniform draw into a choice from a sequence, as random.choice
+
+    draw:       A uniform random number in [0, 1)
+    sequence:   A non-empty sequence to choose from
+
+    returns:    An element of the sequence
+    """
+    return sequence[int(draw * len(sequence))]
+
+# Mode codes. An insect holds its current mode as an integer, which is the
+# index of the mode's name in its mode list
+SEARCH = 0
+FORAGE = 1
+BEE_MODES = ("SEARCH", "FORAGE")
+
+WAIT = 0
+TRANSPORT = 1
+REPRODUCE = 2
+DROP = 3
+MITE_MODES = ("WAIT", "TRANSPORT", "REPRODUCE", "DROP")
+
+# The eight possible moves, shared by all bees. Adding a move to a position
+# gives the new position
+MOVES = np.array([[-1, -1],
+                  [-1, 0],
+                  [-1, 1],
+                  [0, -1],
+                  [0, 1],
+                  [1, -1],
+                  [1, 0],
+                  [1, 1]])
+
+def mode_code(mode, mode_list):
+    """
+    Find the code for a mode
+
+    mode:       The name or code of the mode
+    mode_list:  The names of the valid modes
+
+    returns:    The integer code of the mode, or None if it is not valid
+    """
+    if isinstance(mode, str):
+        if mode in mode_list:
+            return mode_list.index(mode)
+        return None
+    if 0 <= mode < len(mode_list):
+        return int(mode)
+    return None
+
 class Insect:
     """
     The Insect class is a super class used as the basis for the insects in the
     model. It contains the variables and methods common to all insect classes
+
+    Insects use __slots__ and plain attributes to keep each agent small and
+    quick to access. The mode is held as an integer code (see mode_code).
     """
+    __slots__ = ("lifespan", "current_mode", "virus_present", "environment",
+                 "mode_list", "alive", "rng")
 
     def __init__(self, lifespan, current_mode, virus_present, environment,
-                 mode_list):
+                 mode_list, rng=None):
         """
         Initialisation of the Insect superclass
 
         lifespan:      The lifespan of the insect in time units of the model
                        run
         current_mode:  The current objective of the insect, i.e. what it is
-                       currently aiming to do
+                       currently aiming to do, as a name or code
         virus_present: True if the virus is present, False otherwise
         environment:   A copy of the environment the agents occupy
-        mode_list:     A list of valid modes for the insect
+        mode_list:     A sequence of the names of the valid modes
+        rng:           The numpy Generator used for random draws
         """
 
-        self.set_lifespan(lifespan)
-        self.set_mode_list(mode_list)
+        self.lifespan = lifespan
+        self.mode_list = mode_list
+        self.current_mode = None
         self.set_current_mode(current_mode)
-        self.set_virus_present(virus_present)
-        self.set_environment(environment)
+        self.virus_present = virus_present
+        self.environment = environment
         self.alive = True
+        self.rng = rng if rng is not None else DEFAULT_RNG
 
     def change_mode(self, mode):
         """
-        change_mode takes a string and sets the mode to that string
+        change_mode takes the name or code of a mode and sets the mode to it
 
         mode:       The mode to change to
         """
         self.set_current_mode(mode)
 
+    def get_mode_name(self):
+        """
+        returns: The name of the current mode
+        """
+        return self.mode_list[self.current_mode]
+
     ###########################################################################
     #                                                                         #
     # Get, set and del methods                                                #
@@ -60,50 +149,51 @@ class Insect:
     ###########################################################################
 
     def get_lifespan(self):
-        return self._lifespan
+        return self.lifespan
 
     def get_current_mode(self):
-        return self._current_mode
+        return self.current_mode
 
     def get_virus_present(self):
-        return self._virus_present
+        return self.virus_present
 
     def get_environment(self):
-        return self._environment
+        return self.environment
 
     def get_mode_list(self):
-        return self._mode_list
+        return self.mode_list
 
     def set_lifespan(self, value):
-        self._lifespan = value
+        self.lifespan = value
 
     def set_current_mode(self, value):
-        if value in self.mode_list:
-            self._current_mode = value
+        code = mode_code(value, self.mode_list)
+        if code is not None:
+            self.current_mode = code
 
     def set_virus_present(self, value):
-        self._virus_present = value
+        self.virus_present = value
 
     def set_environment(self, value):
-        self._environment = value
+        self.environment = value
 
     def set_mode_list(self, value):
-        self._mode_list = value
+        self.mode_list = value
 
     def del_lifespan(self):
-        del self._lifespan
+        del self.lifespan
 
     def del_current_mode(self):
-        del self._current_mode
+        del self.current_mode
 
     def del_virus_present(self):
-        del self._virus_present
+        del self.virus_present
 
     def del_environment(self):
-        del self._environment
+        del self.environment
 
     def del_mode_list(self):
-        del self._mode_list
+        del self.mode_list
 
     ###########################################################################
     #                                                                         #
@@ -111,31 +201,28 @@ class Insect:
     #                                                                         #
     ###########################################################################
 
-    lifespan = property(get_lifespan, set_lifespan, del_lifespan,
-                        "The lifespan of the Insect")
-    current_mode = property(get_current_mode, set_current_mode,
-                            del_current_mode, "The current mode of the Insect")
-    virus_present = property(get_virus_present, set_virus_present,
-                             del_virus_present, "Presence of virus")
-    environment = property(get_environment, set_environment, del_environment,
-                           "The environment")
-    mode_list = property(get_mode_list, set_mode_list, del_mode_list,
-                         "The list of valid modes")
-
 class Bee(Insect):
     """
     The class representing the Bee. Contains all of the attributes of the
     Insect class, plus those needed by the Bee class.
     """
-    def __init__(self, lifespan=100, current_mode="SEARCH",
+    __slots__ = ("x_size", "y_size", "max_nectar_level", "nectar_level",
+                 "hive_location", "current_position", "current_target",
+                 "store", "last_target_amount", "last_target_location",
+                 "hives", "bees", "mites")
+
+    # The moves are shared by all bees
+    move = MOVES
+
+    def __init__(self, lifespan=100, current_mode=SEARCH,
                  virus_present=False, environment=[],
-                 mode_list=["SEARCH",
-                            "FORAGE"],
+                 mode_list=BEE_MODES,
                  hive_location=(),
                  hives={},
                  max_nectar_level=100,
                  bees=[],
-                 mites=[]):
+                 mites=[],
+                 rng=None):
 
         """
         Initialise the Bee class
@@ -155,26 +242,17 @@ class Bee(Insect):
                                 of known flowers (i.e. food sources)
         max_nectar_level:       The maximum nectar the bee can carry
         nectar_level:           The current level of nectar
+        rng:                    The numpy Generator used for random draws
         """
         Insect.__init__(self, lifespan, current_mode, virus_present,
-                        environment, mode_list)
+                        environment, mode_list, rng)
         self.x_size = len(environment)
         self.y_size = len(environment[0])
-        self._max_nectar_level = max_nectar_level
-        self._nectar_level = 0
+        self.max_nectar_level = max_nectar_level
+        self.nectar_level = 0
         self.set_hive_location(hive_location)
-        self._current_position = self.set_initial_position()
-        self._current_target = None
-        # Create the move array. I use a variable to hold it for
-        # adding to another array to find the final position
-        self.move = np.array([[-1, -1],
-                              [-1, 0],
-                              [-1, 1],
-                              [0, -1],
-                              [0, 1],
-                              [1, -1],
-                              [1, 0],
-                              [1, 1]])
+        self.current_position = self.set_initial_position()
+        self.current_target = None
         self.store = 0
         self.last_target_amount = 0
         self.last_target_location = hive_location
@@ -182,7 +260,7 @@ class Bee(Insect):
         self.bees = bees
         self.mites = mites
 
-    def update(self):
+    def update(self, draws=None):
         """
         Decide what to do, be that any of the following:
             - move
@@ -192,11 +270,18 @@ class Bee(Insect):
 
         Note the use of tuple() to convert the numpy array so that the
         locations can be correctly compared.
+
+        draws:  BEE_DRAWS uniform random numbers for this time-step, one
+                for the move and one for the death check. Drawn from the
+                bee's own generator if not given.
         """
+        if draws is None:
+            draws = self.rng.random(BEE_DRAWS)
+
         # Set a variable containing our bees hive object
         own_hive = self.hives[self.hive_location]
 
-        if self.current_mode == "FORAGE" and self.alive:
+        if self.current_mode == FORAGE and self.alive:
             if self.check_pos(self.current_position, self.current_target):
                 # If the bee is at the hive
                 if self.check_pos(self.current_position, self.hive_location):
@@ -219,7 +304,7 @@ class Bee(Insect):
                     #if nectar level == 0, set the mode to search
                     if (self.environment[self.current_position[1]]
                             [self.current_position[0]] == 0):
-                        self.current_mode = "SEARCH"
+                        self.current_mode = SEARCH
                     #take remaining nectar from the flower (if available)
                     if (0 < self.environment[self.current_position[1]]
                             [self.current_position[0]] < 10):
@@ -249,13 +334,13 @@ class Bee(Insect):
                         self.last_target_location = tuple(self.current_position)
 
         if self.alive:
-            self.take_move(self.current_target)
+            self.take_move(self.current_target, draws[0])
 
-        if self.current_mode == "SEARCH" and self.alive:
+        if self.current_mode == SEARCH and self.alive:
             if (self.environment[self.current_position[0]]
                     [self.current_position[1]] > 0):
                 self.current_target = self.current_position
-                self.current_mode = "FORAGE"
+                self.current_mode = FORAGE
 
         # Reduce the lifespan, reducing by more if infected with virus
         if self.virus_present:
@@ -263,9 +348,31 @@ class Bee(Insect):
         self.lifespan -= 1
         # randomly determine if a bee should die. The bee will live at
         # least 55 time-steps
-        if self.lifespan < random.randint(0, 45):
+        if self.lifespan < draw_int(draws[1], 0, 45):
             self.alive = False
 
+    def reset(self, hive_location, lifespan=100, max_nectar_level=100):
+        """
+        Reset a dead bee in place so it can be reused as a newly born bee,
+        as if it had been created with these values
+
+        hive_location:      The location of this bees hive
+        lifespan:           The lifespan of the new bee
+        max_nectar_level:   The maximum nectar the bee can carry
+        """
+        self.lifespan = lifespan
+        self.current_mode = SEARCH
+        self.virus_present = False
+        self.alive = True
+        self.max_nectar_level = max_nectar_level
+        self.nectar_level = 0
+        self.set_hive_location(hive_location)
+        self.current_position = self.set_initial_position()
+        self.current_target = None
+        self.store = 0
+        self.last_target_amount = 0
+        self.last_target_location = hive_location
+
     def check_pos(self, pos1, pos2):
         """
         Check if one position is the same as another
@@ -275,31 +382,38 @@ class Bee(Insect):
         else:
             return False
 
-    def take_move(self, current_target):
+    def take_move(self, current_target, draw=None):
         """
         Move the bee. if set to SEARCH, perform a random move. If set to
         FORAGE move towards the current target (be it Hive or Flower)
-        """
-        if self.current_mode == "SEARCH":
-            self.random_move()
-        if self.current_mode == "FORAGE":
-            self.targeted_move(current_target)
 
-    def random_move(self):
+        draw:       A uniform random number used to choose the move
         """
-        Move the bee randomly. Choose a direction from the numpy array using
-        random.choice, then set the new location by summing the arrays.
-        """
-        potential_position = self.get_position() + random.choice(self.move)
-        while (potential_position[0] >= self.x_size or
-               potential_position[0] < 0 or
-               potential_position[1] >= self.y_size or
-               potential_position[1] < 0):
-            potential_position = self.get_position() + random.choice(self.move)
+        if self.current_mode == SEARCH:
+            self.random_move(draw)
+        if self.current_mode == FORAGE:
+            self.targeted_move(current_target, draw)
 
-        self.set_position(potential_position)
+    def random_move(self, draw=None):
+        """
+        Move the bee randomly. Choose a direction from the numpy array of
+        the moves that stay inside the environment, then set the new
+        location by summing the arrays.
 
-    def targeted_move(self, target):
+        draw:       A uniform random number used to choose the move
+        """
+        if draw is None:
+            draw = self.rng.random()
+        potential_positions = self.get_position() + self.move
+        valid_positions = potential_positions[
+            (potential_positions[:, 0] >= 0) &
+            (potential_positions[:, 0] < self.x_size) &
+            (potential_positions[:, 1] >= 0) &
+            (potential_positions[:, 1] < self.y_size)]
+
+        self.set_position(draw_choice(draw, valid_positions))
+
+    def targeted_move(self, target, draw=None):
         """
         Take the shortest path to the target. The distance to the
         target from the current position is calculated for each
@@ -308,7 +422,10 @@ class Bee(Insect):
         is equal, a random direction is chosen
 
         target:     A tuple containing coordinates to the target
+        draw:       A uniform random number used to break ties
         """
+        if draw is None:
+            draw = self.rng.random()
         shortest_moves = []
         current_shortest = -1
         for possible_move in self.move:
@@ -333,7 +450,7 @@ class Bee(Insect):
                 shortest_moves.append(possible_move)
 
         # Choose one of the shortest moves randomly
-        self.current_position += random.choice(shortest_moves)
+        self.current_position += draw_choice(draw, shortest_moves)
 
     def distance_between(self, location1, location2):
         """
@@ -360,47 +477,47 @@ class Bee(Insect):
     #                                                                         #
     ###########################################################################
     def set_position(self, position):
-        self._current_position = position
+        self.current_position = position
 
     def set_hive_location(self, position):
         if (0 <= position[0] <= len(self.environment) and
                 0 <= position[1] <= len(self.environment)):
-            self._hive_location = position
+            self.hive_location = position
         else:
             print("hive_location not valid, setting to the middle of the\
                    environment")
-            self._hive_location = ((len(self.environment[0]/2)),
-                                   len(self.environment[1]/2))
+            self.hive_location = ((len(self.environment[0]/2)),
+                                  len(self.environment[1]/2))
 
     def set_current_target(self, target):
-        self._current_target = target
+        self.current_target = target
 
     def set_max_nectar_level(self, target):
-        self._max_nectar_level = target
+        self.max_nectar_level = target
 
     def get_position(self):
-        return self._current_position
+        return self.current_position
 
     def get_hive_location(self):
-        return self._hive_location
+        return self.hive_location
 
     def get_current_target(self):
-        return self._current_target
+        return self.current_target
 
     def get_max_nectar_level(self):
-        return self._max_nectar_level
+        return self.max_nectar_level
 
     def del_position(self):
-        del self._current_position
+        del self.current_position
 
     def del_hive_locaton(self):
-        del self._hive_location
+        del self.hive_location
 
     def del_current_target(self):
-        del self._current_target
+        del self.current_target
 
     def del_max_nectar_level(self):
-        del self._max_nectar_level
+        del self.max_nectar_level
 
     ###########################################################################
     #                                                                         #
@@ -408,24 +525,22 @@ class Bee(Insect):
     #                                                                         #
     ###########################################################################
 
-    current_position = property(get_position, set_position, del_position,
-                                "The current position")
-    hive_location = property(get_hive_location, set_hive_location,
-                             del_hive_locaton, "The hive location")
-    current_target = property(get_current_target, set_current_target,
-                              del_current_target, "The current target")
-    max_nectar_level = property(get_max_nectar_level, set_max_nectar_level,
-                                del_max_nectar_level, "The max nectar level")
-
 class Hive:
     """
     The hive class. Used as a base for the bees storing food and flower
     location information
+
+    Dead bees can be handed back to the hive with recycle(). They are kept
+    in a pool and reused for the next births rather than creating new Bee
+    objects.
     """
-    def __init__(self, environment, hive_location, bees, num_iterations):
+    def __init__(self, environment, hive_location, bees, num_iterations,
+                 rng=None, births_per_step=1):
         """
         Initialise the hive with its location, an empty dict to store the
         current knowledge of flower locations and nectar levels
+
+        births_per_step:    The number of bees born each time-step
         """
         self.set_environment(environment)
         self.set_hive_location(hive_location)
@@ -434,21 +549,42 @@ class Hive:
         self.bees = bees
         self.timestep = 1
         self.num_iterations = num_iterations
+        self.rng = rng
+        self.births_per_step = births_per_step
+        self.pool = []
 
     def update(self):
         """
-        Update hive - increase the bee numbers by one bee per timestep
+        Update hive - increase the bee numbers by births_per_step bees per
+        timestep, reusing dead bees from the pool when there are any
+        """
+        births = []
+        for i in range(self.births_per_step):
+            if self.pool:
+                bee = self.pool.pop()
+                bee.reset(self.hive_location,
+                          max_nectar_level=self.bees[0].get_max_nectar_level)
+            else:
+                bee = Bee(lifespan=100,
+                          current_mode=SEARCH,
+                          virus_present=False,
+                          environment=self.environment,
+                          mode_list=BEE_MODES,
+                          hive_location=self.hive_location,
+                          hives=self.bees[0].hives,
+                          max_nectar_level=self.bees[0].get_max_nectar_level,
+                          bees=self.bees,
+                          rng=self.rng)
+            births.append(bee)
+        self.bees.extend(births)
+
+    def recycle(self, bee):
+        """
+        Hand a dead bee back to the hive to be reused for a birth. The bee
+        must no longer be in the list of bees, and nothing still running
+        should hold a reference to it.
         """
-        self.bees.append(Bee(lifespan=100,
-                             current_mode="SEARCH",
-                             virus_present=False,
-                             environment=self.environment,
-                             mode_list=["SEARCH",
-                                        "FORAGE"],
-                             hive_location=self.hive_location,
-                             hives=self.bees[0].hives,
-                             max_nectar_level=self.bees[0].get_max_nectar_level,
-                             bees=self.bees))
+        self.pool.append(bee)
 
     ###########################################################################
     #                                                                         #
@@ -506,106 +642,139 @@ class Mite(Insect):
 
     TODO: Implement lifespan reduction of bees.
     """
+    __slots__ = ("host_infected", "current_position", "bees", "mites",
+                 "bee_index")
+
     def __init__(self, host_infected=None, current_position=(0, 0),
-                 lifespan=100, current_mode="WAIT",
+                 lifespan=100, current_mode=WAIT,
                  virus_present=False, environment=[],
-                 mode_list=["WAIT",
-                            "TRANSPORT",
-                            "REPRODUCE",
-                            "DROP"],
+                 mode_list=MITE_MODES,
                  bees=[],
-                 mites=[]):
+                 mites=[],
+                 rng=None,
+                 bee_index=None):
         """
         Initialise the mite.
+
+        bee_index:  An optional dict of the bees at each location, kept up
+                    to date by the Simulation. If None, waiting mites look
+                    through all of the bees.
         """
         Insect.__init__(self, lifespan, current_mode,
                         virus_present, environment,
-                        mode_list)
+                        mode_list, rng)
         self.host_infected = host_infected
         self.current_position = current_position
         self.bees = bees
         self.mites = mites
+        self.bee_index = bee_index
 
-    def update(self):
+    def update(self, draws=None):
         """
         Perform an update for the mite class. First perform operations
         depending on the current mode, then do a lifespan check. Note
         that if the bee carrying the mites dies, it is also assumed
         that the mites die.
-        """
-        if self.current_mode == "WAIT":
-            self.wait()
 
-        if self.current_mode == "TRANSPORT":
-            self.transport()
-
-        if self.current_mode == "REPRODUCE":
-            self.reproduce()
-
-        if self.current_mode == "DROP":
-            self.drop()
+        draws:  MITE_DRAWS uniform random numbers for this time-step, for
+                choosing a host, dropping off, reproducing, leaving the
+                hive and the death check. Drawn from the mite's own
+                generator if not given.
+        """
+        if draws is None:
+            draws = self.rng.random(MITE_DRAWS)
+
+        # Carry out the action for the current mode. If the action changes
+        # to a mode that comes later in MITE_MODES, that mode's action is
+        # also carried out this time-step.
+        mode = self.current_mode
+        while True:
+            self.actions[mode](self, draws)
+            if self.current_mode <= mode:
+                break
+            mode = self.current_mode
 
         self.lifespan -= 1
         if self.host_infected:
             self.host_infected.lifespan -= 1
             if not self.host_infected.alive:
                 self.alive = False
-        if random.randint(0, 45) > self.lifespan:
+        if draw_int(draws[4], 0, 45) > self.lifespan:
             self.alive = False
 
-    def wait(self):
+    def wait(self, draws=None):
         """
         Perform actions while waiting
+
+        draws:  The mite's draws for this time-step (see update). The first
+                is used to choose a host
         """
         # Check if there are any bees in the current location
-        bees_here = []
-        for bee in self.bees:
-            if tuple(bee.current_position) == tuple(self.current_position):
-                bees_here.append(bee)
+        if self.bee_index is not None:
+            bees_here = self.bee_index.get(tuple(self.current_position), [])
+        else:
+            bees_here = []
+            for bee in self.bees:
+                if tuple(bee.current_position) == tuple(self.current_position):
+                    bees_here.append(bee)
 
         # If there are bees, randomly attach to one
         if bees_here:
-            self.infect(random.choice(bees_here))
-            self.current_mode = "TRANSPORT"
+            if draws is None:
+                draws = self.rng.random(MITE_DRAWS)
+            self.infect(draw_choice(draws[0], bees_here))
+            self.current_mode = TRANSPORT
 
         # Mites waiting are dormant and assumed they won't die
         self.lifespan += 1
 
-    def transport(self):
+    def transport(self, draws=None):
         """
         Perform actions to wait on a bee until the hive is reached
+
+        draws:  The mite's draws for this time-step (see update). The second
+                is used for the chance to drop off
         """
-        self.current_position = self.host_infected.current_position
-        if tuple(self.current_position) == tuple(self.host_infected.hive_location):
-            self.current_mode = "REPRODUCE"
+        if draws is None:
+            draws = self.rng.random(MITE_DRAWS)
+        self.current_position = tuple(self.host_infected.current_position)
+        if self.current_position == tuple(self.host_infected.hive_location):
+            self.current_mode = REPRODUCE
             self.host_infected = None
         # Small chance the mite will drop off
-        if random.randint(0, 100) < 2:
-            self.current_mode = "WAIT"
+        if draw_int(draws[1], 0, 100) < 2:
+            self.current_mode = WAIT
             self.drop()
 
-    def reproduce(self):
+    def reproduce(self, draws=None):
         """
         If in a hive there is a chance to reproduce and a chance to attach
         to a new bee.
 
         The mite population will not increase if it is greater than four
         times the bee population.
+
+        draws:  The mite's draws for this time-step (see update). The third
+                and fourth are used for the chance to reproduce and the
+                chance to leave the hive
         """
-        if random.randint(0, len(self.bees) * 4) > len(self.mites):
+        if draws is None:
+            draws = self.rng.random(MITE_DRAWS)
+        if draw_int(draws[2], 0, len(self.bees) * 4) > len(self.mites):
             self.mites.append(Mite(current_position=self.current_position,
                                    environment=self.environment,
-                                   bees=self.bees, mites=self.mites))
+                                   bees=self.bees, mites=self.mites,
+                                   rng=self.rng, bee_index=self.bee_index))
 
-        if random.randint(0, 100) > 95:
-            self.current_mode = "WAIT"
+        if draw_int(draws[3], 0, 100) > 95:
+            self.current_mode = WAIT
 
-    def drop(self):
+    def drop(self, draws=None):
         """
         Drop in the current location (i.e. set mode to wait)
         """
         self.host_infected = None
-        self.current_mode = "WAIT"
+        self.current_mode = WAIT
 
     def infect(self, host):
         """
@@ -617,6 +786,9 @@ class Mite(Insect):
         """ Get the current position """
         return self.current_position
 
+    # The action for each mode, indexed by the mode code
+    actions = (wait, transport, reproduce, drop)
+
 class Environment:
     """
     The environment class is used to update the environment - i,e, the
@@ -658,3 +830,547 @@ class Environment:
             for val in range(len(self.environment[row])):
                 if self.environment[row][val] < self.original_environment[row][val]:
                     self.environment[row][val] += self.replenishment[row][val]
+
+class Flight:
+    """
+    A bee parked by an event-driven Simulation while it flies to its target.
+    A foraging bee that is not at its target takes the shortest path to it:
+    diagonally until it is level with the target on one axis, then straight
+    along the other. There are no ties to break on the way, so the position
+    after any number of moves can be worked out rather than simulated.
+    """
+    def __init__(self, bee, step):
+        """
+        Park a bee at its current position
+
+        bee:    The bee, which must be foraging and not at its target
+        step:   The time-step of the bee's last update
+        """
+        position = bee.current_position
+        target = bee.current_target
+        self.bee = bee
+        self.step = step
+        self.start = (int(position[0]), int(position[1]))
+        self.sign = (int(np.sign(target[0] - position[0])),
+                     int(np.sign(target[1] - position[1])))
+        self.length = (abs(int(target[0] - position[0])),
+                       abs(int(target[1] - position[1])))
+        # The number of moves made while parked, cut short if the bee has to
+        # be seen by waiting mites on the way
+        self.moves = max(self.length)
+        self.lifespan = bee.lifespan
+        self.loss = 4 if bee.virus_present else 1
+        # The move on which the bee dies, or None if it survives the flight
+        self.death = None
+
+    def position(self, moves):
+        """
+        returns: The position of the bee after a number of moves
+        """
+        return (self.start[0] + self.sign[0] * min(moves, self.length[0]),
+                self.start[1] + self.sign[1] * min(moves, self.length[1]))
+
+    def first_visit(self, location, first_move):
+        """
+        Find when the bee will be at a location
+
+        location:   A tuple of the coordinates
+        first_move: The first move to consider
+
+        returns:    The first number of moves, not less than first_move,
+                    after which the bee is at the location, or None
+        """
+        earliest = first_move
+        latest = self.moves
+        for axis in range(2):
+            if self.length[axis] == 0:
+                if location[axis] != self.start[axis]:
+                    return None
+                continue
+            offset = (location[axis] - self.start[axis]) * self.sign[axis]
+            if offset < 0 or offset > self.length[axis]:
+                return None
+            earliest = max(earliest, offset)
+            if offset < self.length[axis]:
+                latest = min(latest, offset)
+        if earliest <= latest:
+            return earliest
+        return None
+
+class Simulation:
+    """
+    The simulation class holds everything needed for a model run: the
+    environment, hives, bees and mites. It owns the numpy Generator that all
+    of its agents draw from, so a run can be repeated exactly from its seed.
+    Each time-step the random numbers for a whole population are drawn in one
+    call and handed out to the agents.
+
+    In event-driven mode, a foraging bee flying to its target with no mites
+    on board is parked as a Flight rather than being moved each time-step.
+    Its death is drawn in advance for every move of the flight. It is woken
+    when it arrives, when it dies, or before it would pass a location with
+    waiting mites. A parked bee's current_position is where it was parked;
+    wake_all() brings every parked bee up to date.
+
+    If the simulation is given a rasters.Rasters, the visits, visits by
+    bees carrying mites, waiting mites and nectar removed in each location
+    are added to it every time-step. The visits of a parked bee are added
+    when it lands.
+    """
+    def __init__(self, environment, num_bees=40, num_mites=40,
+                 hive_locations=[(25, 25)], num_iterations=100, seed=None,
+                 event_driven=False, births_per_step=1,
+                 environment_object=None, rasters=None):
+        """
+        Initialise the simulation, creating the hives, bees and mites
+
+        environment:    A list of lists containing the nectar in each
+                        location
+        num_bees:       The number of bees to start with
+        num_mites:      The number of mites to start with
+        hive_locations: A list of tuples containing the hive coordinates
+        num_iterations: The number of iterations the model will run for
+        seed:           The seed for the random number generator. If None a
+                        fresh seed is taken from the operating system
+        event_driven:   True to park bees flying to their target
+        births_per_step: The number of bees born in each hive each
+                        time-step
+        environment_object: The object that regrows the environment. If
+                        None an Environment is created from environment
+        rasters:        A rasters.Rasters to add to, or None
+        """
+        self.rng = np.random.default_rng(seed)
+        self.environment = environment
+        self.hives = {} #Store hives as a dict so bees can access the obj by location
+        self.bees = []
+        self.mites = []
+        self.bee_count = {}
+        self.bee_pop = []
+        self.mite_pop = []
+        self.timestep = 0
+        self.event_driven = event_driven
+        # The bees at each location, for the waiting mites
+        self.bee_index = {}
+        # Parked bees, and the time-steps they wake or die on
+        self.flights = {}
+        self.wakes = {}
+        self.deaths = {}
+        self.wait_locations = set()
+        self.rasters = rasters
+
+        # Create the environment object
+        if environment_object is None:
+            environment_object = Environment(environment)
+        self.environment_object = environment_object
+
+        # Create the hive(s)
+        for location in hive_locations:
+            self.hives[location] = Hive(environment=environment,
+                                        hive_location=location,
+                                        bees=self.bees,
+                                        num_iterations=num_iterations,
+                                        rng=self.rng,
+                                        births_per_step=births_per_step)
+
+        # Create Bees
+        for j in range(num_bees):
+            self.bees.append(Bee(environment=environment,
+                                 hive_location=hive_locations[0],
+                                 hives=self.hives, bees=self.bees,
+                                 mites=self.mites, rng=self.rng))
+
+        # Create mites in random locations
+        x_locations = self.rng.integers(0, len(environment[0]) + 1,
+                                        size=num_mites)
+        y_locations = self.rng.integers(0, len(environment) + 1,
+                                        size=num_mites)
+        for i in range(num_mites):
+            randloc = (int(x_locations[i]), int(y_locations[i]))
+            self.mites.append(Mite(current_position=randloc,
+                                   environment=environment, bees=self.bees,
+                                   mites=self.mites, rng=self.rng,
+                                   bee_index=self.bee_index))
+
+        # Make a blank heat map for all locations
+        for i in range(len(environment[0])):
+            for j in range(len(environment)):
+                self.bee_count[(i, j)] = 0
+
+    def update(self):
+        """
+        Run one time-step of the model and log the bee and mite populations
+        """
+        step = self.timestep
+
+        # Wake the parked bees due this time-step
+        for flight in self.wakes.pop(step, []):
+            if self.flights.get(flight.bee) is flight:
+                self.land(flight, flight.moves)
+
+        # Index the bees that can be seen by the waiting mites
+        self.bee_index.clear()
+        for bee in self.bees:
+            if bee not in self.flights:
+                self.bee_index.setdefault(tuple(bee.current_position),
+                                          []).append(bee)
+
+        # Process mites. Mites born during this loop are appended to the
+        # list and also updated, drawing their own random numbers.
+        if self.mites:
+            draws = self.rng.random((len(self.mites), MITE_DRAWS))
+            for k, mite in enumerate(self.mites):
+                mite.update(draws[k] if k < len(draws) else None)
+
+        if self.event_driven:
+            self.check_flights(step)
+
+        # Parked bees that die this time-step
+        for flight in self.deaths.pop(step, []):
+            if self.flights.get(flight.bee) is flight:
+                if flight.death <= flight.moves:
+                    self.land(flight, flight.death)
+                    flight.bee.alive = False
+
+        # Move Bees
+        active = [bee for bee in self.bees
+                  if bee.alive and bee not in self.flights]
+        if self.rasters is not None:
+            foraged = [(tuple(bee.current_position), bee.store)
+                       for bee in active]
+        if active:
+            draws = self.rng.random((len(active), BEE_DRAWS))
+            for bee, bee_draws in zip(active, draws):
+                bee.update(bee_draws)
+
+            # Count the number of bees in the current location
+            for bee in active:
+                self.bee_count[tuple(bee.current_position)] += 1
+
+            if self.event_driven:
+                self.park(active, step)
+
+        if self.rasters is not None:
+            self.add_rasters(active, foraged)
+
+        # Hive actions (make more bees)
+        for location in self.hives:
+            self.hives[location].update()
+
+        # Clean up dead insects. The lists are changed in place as the
+        # agents hold references to them. Dead bees go back to their hive to
+        # be reused. Mites riding a dead bee find out it has died next
+        # time-step, before any hive can reuse it.
+        dead_bees = [bee for bee in self.bees if not bee.alive]
+        if dead_bees:
+            self.bees[:] = [bee for bee in self.bees if bee.alive]
+            for bee in dead_bees:
+                self.hives[bee.hive_location].recycle(bee)
+        self.mites[:] = [mite for mite in self.mites if mite.alive]
+
+        # Update the environment
+        self.environment_object.update()
+
+        # Log the bee and mite populations
+        self.bee_pop.append(len(self.bees))
+        self.mite_pop.append(len(self.mites))
+        self.timestep += 1
+        if self.rasters is not None:
+            self.rasters.end_step()
+
+    def add_rasters(self, active, foraged):
+        """
+        Add the time-step's visits, carrier visits, waiting mites and nectar
+        removed to the rasters
+
+        active:     The bees moved this time-step
+        foraged:    The position and nectar store of each of them before
+                    they moved. Any nectar gained was taken there.
+        """
+        rows, columns = self.rasters.shape
+        carried = set()
+        waiting = []
+        for mite in self.mites:
+            if not mite.alive:
+                continue
+            if mite.host_infected is not None:
+                carried.add(id(mite.host_infected))
+            elif mite.current_mode == WAIT:
+                x, y = mite.current_position
+                # Mites can start just outside the environment
+                if 0 <= x < rows and 0 <= y < columns:
+                    waiting.append((x, y))
+
+        visits = [tuple(bee.current_position) for bee in active]
+        carriers = [visit for bee, visit in zip(active, visits)
+                    if id(bee) in carried]
+        nectar = [(position, bee.store - store)
+                  for bee, (position, store) in zip(active, foraged)
+                  if bee.store > store]
+        for layer, locations in (("visits", visits),
+                                 ("carrier_visits", carriers),
+                                 ("waiting_mites", waiting)):
+            if locations:
+                x, y = zip(*locations)
+                self.rasters.add(layer, x, y)
+        if nectar:
+            positions, amounts = zip(*nectar)
+            x, y = zip(*positions)
+            self.rasters.add("nectar_removed", x, y, amounts)
+
+    def check_flights(self, step):
+        """
+        Cut short the flights that pass a location where mites have started
+        waiting, so the bee can be seen when it gets there
+
+        step:   The current time-step
+        """
+        wait_locations = set()
+        for mite in self.mites:
+            if mite.alive and mite.current_mode == WAIT:
+                wait_locations.add(tuple(mite.current_position))
+        new_locations = wait_locations - self.wait_locations
+        self.wait_locations = wait_locations
+
+        if new_locations and self.flights:
+            for flight in list(self.flights.values()):
+                # The next mites to look will see the bee after this
+                # time-step's move
+                first_move = step - flight.step
+                for location in new_locations:
+                    moves = flight.first_visit(location, first_move)
+                    if moves is not None and moves < flight.moves:
+                        flight.moves = moves
+                        self.wakes.setdefault(flight.step + moves + 1,
+                                              []).append(flight)
+
+    def park(self, bees, step):
+        """
+        Park the foraging bees that are flying to their target with no mites
+        on board
+
+        bees:   The bees updated this time-step
+        step:   The current time-step
+        """
+        carried = set()
+        for mite in self.mites:
+            if mite.host_infected is not None:
+                carried.add(id(mite.host_infected))
+
+        flights = []
+        for bee in bees:
+            if (bee.alive and bee.current_mode == FORAGE and
+                    id(bee) not in carried and
+                    not bee.check_pos(bee.current_position,
+                                      bee.current_target)):
+                flight = Flight(bee, step)
+                # The bee must be seen at any location with waiting mites
+                for moves in range(flight.moves):
+                    if flight.position(moves) in self.wait_locations:
+                        flight.moves = moves
+                        break
+                if flight.moves > 0:
+                    flights.append(flight)
+        if not flights:
+            return
+
+        # Draw the death checks for every move of every flight at once
+        draws = self.rng.random(sum(flight.moves for flight in flights))
+        start = 0
+        for flight in flights:
+            for move in range(1, flight.moves + 1):
+                if (flight.lifespan - move * flight.loss <
+                        draw_int(draws[start + move - 1], 0, 45)):
+                    flight.death = move
+                    break
+            start += flight.moves
+            self.flights[flight.bee] = flight
+            if flight.death is not None:
+                self.deaths.setdefault(step + flight.death, []).append(flight)
+            else:
+                self.wakes.setdefault(step + flight.moves + 1,
+                                      []).append(flight)
+
+    def land(self, flight, moves):
+        """
+        Bring a parked bee up to date after a number of moves and stop
+        parking it
+
+        flight: The Flight of the bee
+        moves:  The number of moves the bee has made since it was parked
+        """
+        bee = flight.bee
+        for move in range(1, moves + 1):
+            self.bee_count[flight.position(move)] += 1
+        if self.rasters is not None and moves > 0:
+            x, y = zip(*(flight.position(move)
+                         for move in range(1, moves + 1)))
+            self.rasters.add("visits", x, y)
+        bee.current_position = np.array(flight.position(moves))
+        bee.lifespan = flight.lifespan - moves * flight.loss
+        del self.flights[bee]
+
+    def wake_all(self):
+        """
+        Bring every parked bee up to date and stop parking them
+        """
+        for flight in list(self.flights.values()):
+            self.land(flight, self.timestep - 1 - flight.step)
+        self.wakes.clear()
+        self.deaths.clear()
+
+    def population(self):
+        """
+        returns: A tuple of the number of living bees and mites
+        """
+        return len(self.bees), len(self.mites)
+
+    def metrics(self):
+        """
+        returns: A dict of the number of bees foraging and searching, and
+                 the nectar stored in all the hives
+        """
+        foraging = 0
+        for bee in self.bees:
+            if bee.current_mode == FORAGE:
+                foraging += 1
+        return {"foraging": foraging,
+                "searching": len(self.bees) - foraging,
+                "hive_store": sum(hive.hive_store
+                                  for hive in self.hives.values())}
+
+    def snapshot(self):
+        """
+        The state of the simulation, for viewing while it runs. A parked
+        bee is shown where it was parked.
+
+        returns: Arrays of the bee and mite positions, one row each, and
+                 the environment
+        """
+        bees = np.array([bee.current_position for bee in self.bees],
+                        dtype=np.int64).reshape(-1, 2)
+        mites = np.array([mite.current_position for mite in self.mites],
+                         dtype=np.int64).reshape(-1, 2)
+        environment = self.environment
+        if hasattr(environment, "to_list"):
+            environment = environment.to_list()
+        return bees, mites, np.asarray(environment)
+
+    def heatmap(self):
+        """
+        Create a heatmap of the total number of bees in each position
+
+        returns: A list of lists of the bee counts
+        """
+        self.wake_all()
+        heat = []
+        heat_initial = [i for i in range(len(self.environment[0]))]
+        for i in range(len(self.environment)):
+            heat.append(heat_initial[:])
+        for key in self.bee_count.keys():
+            heat[key[0]][key[1]] = self.bee_count[key]
+        return heat
+
+class StoppingRules:
+    """
+    Rules for ending a model run early, checked after each time-step:
+
+        - extinction: stop when there are no bees or no mites left
+        - steady state: stop when, over a rolling window of time-steps, the
+          bee and mite populations both vary little about their mean and
+          the mean of the newer half of the window is close to the mean of
+          the older half
+
+    The reason and time-step a run stopped on are kept in stop_reason and
+    stop_step.
+    """
+    def __init__(self, extinction=False, window=0, tolerance=0.05):
+        """
+        extinction: True to stop when the bees or the mites die out
+        window:     The number of time-steps in the rolling window. 0 turns
+                    off the steady state check
+        tolerance:  The largest coefficient of variation, and the largest
+                    relative change between the two halves of the window,
+                    for a population to count as steady
+        """
+        self.extinction = extinction
+        self.window = window
+        self.tolerance = tolerance
+        self.stop_reason = None
+        self.stop_step = None
+        self.step = 0
+        # The bee and mite populations in the older and newer halves of the
+        # window, with running sums of the values and their squares
+        self.halves = [[deque(), deque()], [deque(), deque()]]
+        self.sums = [[0, 0], [0, 0]]
+        self.squares = [[0, 0], [0, 0]]
+
+    def check(self, num_bees, num_mites):
+        """
+        Check the populations after a time-step
+
+        num_bees:   The number of bees alive
+        num_mites:  The number of mites alive
+
+        returns:    The reason to stop, or None to carry on
+        """
+        self.step += 1
+        if self.extinction:
+            if num_bees == 0:
+                return self.stop("bees extinct")
+            if num_mites == 0:
+                return self.stop("mites extinct")
+        if self.window:
+            steady = True
+            for series, value in enumerate((num_bees, num_mites)):
+                self.add(series, value)
+                steady = steady and self.is_steady(series)
+            if steady:
+                return self.stop("steady state")
+        return None
+
+    def add(self, series, value):
+        """
+        Add a value to the newer half of a window, moving the oldest values
+        along so each half holds at most half the window
+        """
+        older, newer = self.halves[series]
+        newer.append(value)
+        self.sums[series][1] += value
+        self.squares[series][1] += value * value
+        if len(newer) > self.window - self.window // 2:
+            moved = newer.popleft()
+            older.append(moved)
+            self.sums[series][1] -= moved
+            self.squares[series][1] -= moved * moved
+            self.sums[series][0] += moved
+            self.squares[series][0] += moved * moved
+        if len(older) > self.window // 2:
+            removed = older.popleft()
+            self.sums[series][0] -= removed
+            self.squares[series][0] -= removed * removed
+
+    def is_steady(self, series):
+        """
+        returns: True if the window is full and the series is steady
+        """
+        older, newer = self.halves[series]
+        count = len(older) + len(newer)
+        if count < self.window or not older:
+            return False
+        mean = (self.sums[series][0] + self.sums[series][1]) / count
+        if mean == 0:
+            return True
+        square = (self.squares[series][0] + self.squares[series][1]) / count
+        variance = max(square - mean * mean, 0)
+        drift = (self.sums[series][1] / len(newer) -
+                 self.sums[series][0] / len(older))
+        return (variance**0.5 <= self.tolerance * mean and
+                abs(drift) <= self.tolerance * mean)
+
+    def stop(self, reason):
+        """
+        Record why and when the run stopped
+        """
+        self.stop_reason = reason
+        self.stop_step = self.step
+        return reason
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+NAME
+    viewer.py - A live viewer of a running VarBee model
+
+SYNOPSIS
+    python3 viewer.py Name [--fps number1] [--wait number2]
+
+    Name: The name the run publishes its snapshots to (model.py --publish)
+    number1: The most frames per second to draw (default 20)
+    number2: The most seconds to wait for the run to start publishing
+             (default 30)
+
+DESCRIPTION
+    Shows the environment, the bees (yellow), the mites (red) and the hive
+    (pink) of a run in another process, drawing its latest snapshot at the
+    viewer's own frame rate. The run doesn't wait for the viewer, so it
+    runs at full speed, and closing the window doesn't stop it. Viewers can
+    be started and closed at any time while the run goes on, e.g.:
+
+        python3 model.py myfile.csv 5000 --headless --publish mybees &
+        python3 viewer.py mybees
+
+    When the run finishes, its final state is left in the window.
+"""
+###############################################################################
+#                                                                             #
+#  Python library imports                                                     #
+#                                                                             #
+###############################################################################
+import sys
+import time
+import argparse
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+
+###############################################################################
+#                                                                             #
+#  Custom imports                                                             #
+#                                                                             #
+###############################################################################
+import model
+import snapshots
+
+###############################################################################
+#                                                                             #
+#  Viewer functions                                                           #
+#                                                                             #
+###############################################################################
+
+def attach(name, wait=30):
+    '''
+    Attach to the snapshots of a run, waiting for it to start publishing
+
+    name:       The name the run publishes to
+    wait:       The most seconds to wait
+
+    returns:    A snapshots.SnapshotReader, or None if the run didn't start
+                publishing in time
+    '''
+    start = time.monotonic()
+    while True:
+        try:
+            return snapshots.SnapshotReader(name)
+        except FileNotFoundError:
+            if time.monotonic() - start > wait:
+                return None
+            time.sleep(0.1)
+
+def view(name, fps=20, wait=30):
+    '''
+    Show the snapshots of a run until the window is closed
+
+    name:       The name the run publishes to
+    fps:        The most frames per second to draw
+    wait:       The most seconds to wait for the run to start publishing
+
+    returns:    False if there was no run to view, True otherwise
+    '''
+    reader = attach(name, wait)
+    if reader is None:
+        print("No run is publishing to", name)
+        return False
+    # Keep trying for up to wait seconds while the run is writing
+    snapshot = reader.read(timeout=wait)
+    if snapshot is None:
+        print("No complete snapshot could be read from", name)
+        reader.close()
+        return False
+
+    fig = plt.figure(figsize=(7, 7))
+    ax = fig.add_axes([0, 0, 1, 1])
+    image = ax.imshow(snapshot["environment"], interpolation='none')
+    bees = ax.scatter(snapshot["bee_positions"][:, 0],
+                      snapshot["bee_positions"][:, 1],
+                      color="yellow")
+    mites = ax.scatter(snapshot["mite_positions"][:, 0],
+                       snapshot["mite_positions"][:, 1],
+                       color="red")
+    hives = model.HIVE_LOCATIONS[:model.NUM_HIVES]
+    ax.scatter([hive[0] for hive in hives], [hive[1] for hive in hives],
+               color="pink")
+    label = ax.text(0.01, 0.99, "", transform=ax.transAxes, va="top",
+                    color="white")
+
+    def update(frame_number):
+        snapshot = reader.read()
+        if snapshot is None:
+            return image, bees, mites, label
+        image.set_data(snapshot["environment"])
+        bees.set_offsets(snapshot["bee_positions"])
+        mites.set_offsets(snapshot["mite_positions"])
+        label.set_text("Timestep = %d / %d   Bees = %d   Mites = %d%s" % (
+            snapshot["timestep"], snapshot["num_iterations"],
+            snapshot["bees"], snapshot["mites"],
+            "   Finished" if snapshot["finished"] else ""))
+        if snapshot["finished"]:
+            viewer_animation.event_source.stop()
+        return image, bees, mites, label
+
+    viewer_animation = animation.FuncAnimation(
+        fig, update, interval=1000 / max(fps, 1), cache_frame_data=False)
+    plt.show()
+    reader.close()
+    return True
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="A live viewer of a running VarBee model")
+    parser.add_argument("name",
+                        help="The name the run publishes its snapshots to")
+    parser.add_argument("--fps", type=float, default=20,
+                        help="The most frames per second to draw")
+    parser.add_argument("--wait", type=float, default=30,
+                        help="The most seconds to wait for the run")
+    args = parser.parse_args(argv)
+    if not view(args.name, args.fps, args.wait):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()